@@ -1,126 +1,367 @@
 from fastapi import APIRouter, File, UploadFile, Form
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 import os
-from uuid import uuid4
-from datetime import datetime
-from app.utils.pdf_parser import extract_text_from_pdf, extract_pdfs_from_zip, extract_invoice_date
-from app.core.analyzer import analyze_invoice
-from app.core.vector_store import store_invoice_embedding
+import json
+import asyncio
+import hashlib
+import zipfile
+from typing import Optional
+from app.core.pipeline import run_invoice_pipeline, sources_from_zip
+from app.core.policy_registry import policy_registry
+from app.core.verdict_cache import verdict_cache
+from app.core.jobs import job_manager, FINISHED_STATES, JobNotFoundError, JobWaitTimeoutError
+from app.core.ingest_writer import ingest_writer
+from app.core.upload_storage import upload_storage, StorageQuotaError
 
 router = APIRouter()
 
-# Directory to temporarily store uploaded files
-UPLOAD_DIR = "tmp_uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# How long the job event stream waits for news before sending a keep-alive
+JOB_EVENTS_KEEPALIVE_SECONDS = 15
+
+# Uploads are written to disk in chunks of this size instead of being read into memory
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+# Size limits for uploads (bytes); limits on ZIP contents live in app.core.pipeline
+MAX_POLICY_BYTES = int(os.environ.get("MAX_POLICY_BYTES", str(20 * 1024 * 1024)))
+MAX_ZIP_BYTES = int(os.environ.get("MAX_ZIP_BYTES", str(1024 * 1024 * 1024)))
+
+
+class UploadTooLargeError(ValueError):
+    """
+    Raised when an uploaded file exceeds its size limit.
+    """
+
+
+async def save_upload(upload: UploadFile, dest_path: str, max_bytes: int, hasher=None) -> int:
+    """
+    Streams an uploaded file to disk in chunks, enforcing a size limit.
+
+    Args:
+        upload (UploadFile): The uploaded file.
+        dest_path (str): Where to write it.
+        max_bytes (int): Maximum allowed size.
+        hasher (optional): A hashlib object updated with the content as it is written.
+
+    Returns:
+        int: Number of bytes written.
+
+    Raises:
+        UploadTooLargeError: If the upload is larger than max_bytes (the partial file is removed).
+    """
+    written = 0
+    try:
+        with open(dest_path, "wb") as f:
+            while chunk := await upload.read(UPLOAD_CHUNK_BYTES):
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadTooLargeError(
+                        f"'{upload.filename}' exceeds the maximum upload size of {max_bytes} bytes."
+                    )
+                if hasher is not None:
+                    hasher.update(chunk)
+                await asyncio.to_thread(f.write, chunk)
+    except UploadTooLargeError:
+        os.remove(dest_path)
+        raise
+    return written
+
+
+async def save_session_file(session_id: str, upload: UploadFile, max_bytes: int) -> str:
+    """
+    Saves an uploaded file into an upload session (see app.core.upload_storage).
+
+    Returns:
+        str: Path of the stored file (shared with other sessions if the same file was uploaded before).
+
+    Raises:
+        UploadTooLargeError: If the upload is larger than max_bytes.
+        StorageQuotaError: If upload storage is full.
+    """
+    path = upload_storage.session_path(session_id, upload.filename)
+    hasher = hashlib.sha256() if upload_storage.dedup else None
+    await save_upload(upload, path, max_bytes, hasher)
+    digest = hasher.hexdigest() if hasher is not None else None
+    return await asyncio.to_thread(upload_storage.add_file, session_id, path, digest)
+
 
 @router.post("/upload")
 async def upload_policy_and_invoices(
     employee_name: str = Form(...),
-    policy_pdf: UploadFile = File(...),
-    invoices_zip: UploadFile = File(...)
+    invoices_zip: UploadFile = File(...),
+    policy_pdf: Optional[UploadFile] = File(None),
+    policy_id: Optional[str] = Form(None),
+    batch_mode: bool = Form(False),
+    background: bool = Form(False)
 ):
     """
     Endpoint to upload an HR policy PDF and a ZIP of invoice PDFs.
     Analyzes each invoice against the policy using LLM and stores embeddings.
+    Invoices are processed concurrently (see PIPELINE_CONCURRENCY).
+
+    Instead of the policy PDF, the ID of an already registered policy
+    (see POST /analyze/policies) can be given.
+
+    With background=true the endpoint returns a job ID immediately and the
+    invoices are processed by the job workers; poll GET /analyze/jobs/{job_id}
+    or stream GET /analyze/jobs/{job_id}/events for results.
+
+    Uploaded files are deleted as soon as the analysis finishes (in background
+    mode, when the job finishes).
+
+    Only the ingest writer stores invoices: in a read replica (see
+    app.core.ingest_writer) the upload is queued as a job for the writer, and
+    without background=true the endpoint waits for that job's results.
 
     Args:
         employee_name (str): Name of the employee uploading the files.
-        policy_pdf (UploadFile): Uploaded HR policy PDF.
         invoices_zip (UploadFile): ZIP file containing invoice PDFs.
+        policy_pdf (UploadFile, optional): Uploaded HR policy PDF.
+        policy_id (str, optional): ID of a registered policy.
+        batch_mode (bool): Classify several invoices per LLM call (see LLM_BATCH_SIZE).
+        background (bool): Queue the upload as a job instead of waiting for the results.
 
     Returns:
-        dict: Summary of analysis for each invoice.
+        dict: Summary of analysis for each invoice plus per-stage timings, or the job ID in background mode.
     """
+    if policy_pdf is None and not policy_id:
+        return JSONResponse(
+            status_code=400,
+            content={"error": "Provide either a policy PDF or the ID of a registered policy."}
+        )
+
     try:
-        # Create a unique folder for this upload session
-        session_id = str(uuid4())
-        session_dir = os.path.join(UPLOAD_DIR, session_id)
-        os.makedirs(session_dir, exist_ok=True)
+        # === Resolve an already registered policy ===
+        policy = None
+        if policy_id and policy_pdf is None:
+            policy = await asyncio.to_thread(policy_registry.get, policy_id)
+            if policy is None:
+                return JSONResponse(
+                    status_code=404,
+                    content={"error": f"Unknown policy ID: {policy_id}"}
+                )
 
-        # === Save the uploaded policy PDF ===
+        # Create an upload session; its files are deleted once the upload is processed
+        session_id = await asyncio.to_thread(upload_storage.create_session)
+        queued = False
         try:
-            policy_path = os.path.join(session_dir, policy_pdf.filename)
-            with open(policy_path, "wb") as f:
-                f.write(await policy_pdf.read())
-        except Exception as e:
-            return JSONResponse(
-                status_code=400,
-                content={"error": f"Failed to save policy PDF: {str(e)}"}
-            )
-
-        # === Save the uploaded invoices ZIP ===
-        try:
-            zip_path = os.path.join(session_dir, invoices_zip.filename)
-            with open(zip_path, "wb") as f:
-                f.write(await invoices_zip.read())
-        except Exception as e:
-            return JSONResponse(
-                status_code=400,
-                content={"error": f"Failed to save invoice ZIP file: {str(e)}"}
-            )
-
-        # === Extract text from the policy PDF ===
-        policy_text = extract_text_from_pdf(policy_path)
-        if not policy_text.strip():
-            return JSONResponse(
-                status_code=400,
-                content={"error": "The policy PDF appears to be empty or unreadable."}
-            )
-
-        # === Extract PDFs from the ZIP and parse them ===
-        invoice_paths = extract_pdfs_from_zip(zip_path, session_dir)
-        if not invoice_paths:
-            return JSONResponse(
-                status_code=400,
-                content={"error": "No valid PDF invoices found in the ZIP file."}
-            )
-
-        # Read and process each invoice
-        invoice_texts = {}
-        for path in invoice_paths:
-            try:
-                text = extract_text_from_pdf(path)
-                if text.strip():  # Avoid storing empty content
-                    invoice_texts[os.path.basename(path)] = text
-            except Exception as e:
-                print(f"Warning: Could not extract text from {path}: {e}")
+            # === Save the uploaded policy PDF ===
+            if policy is None:
+                try:
+                    policy_path = await save_session_file(session_id, policy_pdf, MAX_POLICY_BYTES)
+                except UploadTooLargeError as e:
+                    return JSONResponse(status_code=413, content={"error": str(e)})
+                except StorageQuotaError as e:
+                    return JSONResponse(status_code=507, content={"error": str(e)})
+                except Exception as e:
+                    return JSONResponse(
+                        status_code=400,
+                        content={"error": f"Failed to save policy PDF: {str(e)}"}
+                    )
 
-        analysis_results = {}
+                # === Register the policy (parsed only the first time it is seen) ===
+                try:
+                    policy = await asyncio.to_thread(policy_registry.register_pdf, policy_path)
+                except ValueError as ve:
+                    return JSONResponse(status_code=400, content={"error": str(ve)})
 
-        for filename, invoice_text in invoice_texts.items():
+            # === Save the uploaded invoices ZIP ===
             try:
-                # Analyze invoice content against the policy using LLM
-                analysis = analyze_invoice(policy_text, invoice_text)
+                zip_path = await save_session_file(session_id, invoices_zip, MAX_ZIP_BYTES)
+            except UploadTooLargeError as e:
+                return JSONResponse(status_code=413, content={"error": str(e)})
+            except StorageQuotaError as e:
+                return JSONResponse(status_code=507, content={"error": str(e)})
+            except Exception as e:
+                return JSONResponse(
+                    status_code=400,
+                    content={"error": f"Failed to save invoice ZIP file: {str(e)}"}
+                )
 
-                # Combine invoice and LLM decision for embedding
-                combined_text = f"{invoice_text}\n\nLLM Decision: {analysis['reason']}"
+            # === Open the ZIP; its PDFs are read lazily, without extracting to disk ===
+            try:
+                zip_ref = await asyncio.to_thread(zipfile.ZipFile, zip_path)
+            except zipfile.BadZipFile:
+                return JSONResponse(
+                    status_code=400,
+                    content={"error": "The uploaded invoices file is not a valid ZIP archive."}
+                )
 
-                # Prepare metadata for vector storage
-                metadata = {
-                    "employee_name": employee_name,
-                    "invoice_file": filename,
-                    "status": analysis["status"],
-                    "reason": analysis["reason"],
-                    "date": extract_invoice_date(invoice_text) or datetime.now().isoformat()
-                }
+            with zip_ref:
+                invoices = sources_from_zip(zip_ref)
+                if not invoices:
+                    return JSONResponse(
+                        status_code=400,
+                        content={"error": "No valid PDF invoices found in the ZIP file."}
+                    )
 
-                # Store in vector DB
-                store_invoice_embedding(combined_text, metadata)
-                analysis_results[filename] = analysis
+                if background or not ingest_writer.is_writer:
+                    # The job deletes the session when it finishes
+                    job_id = await job_manager.submit(
+                        employee_name, policy.policy_id, zip_path, batch_mode, session_id=session_id
+                    )
+                    queued = True
+                    if background:
+                        return JSONResponse(status_code=202, content={
+                            "job_id": job_id,
+                            "status": "queued",
+                            "num_invoices": len(invoices),
+                            "status_url": f"/analyze/jobs/{job_id}",
+                            "events_url": f"/analyze/jobs/{job_id}/events"
+                        })
+                else:
+                    # Parse, analyze and store the invoices concurrently
+                    pipeline_result = await run_invoice_pipeline(
+                        employee_name, policy, invoices, batch_mode=batch_mode
+                    )
 
-            except Exception as e:
-                analysis_results[filename] = {
-                    "status": "Error",
-                    "reason": f"Failed to analyze invoice: {str(e)}"
-                }
+            if queued:
+                # A read replica: the writer processes the upload
+                try:
+                    pipeline_result = await job_manager.wait_for_result(job_id)
+                except JobWaitTimeoutError as e:
+                    # The job stays queued and can still be followed; 503 when no writer is there to run it
+                    no_writer = await asyncio.to_thread(ingest_writer.holder_pid) is None
+                    return JSONResponse(status_code=503 if no_writer else 504, content={
+                        "error": "No ingest writer is running." if no_writer else str(e),
+                        "job_id": job_id,
+                        "status_url": f"/analyze/jobs/{job_id}",
+                        "events_url": f"/analyze/jobs/{job_id}/events"
+                    })
+                except JobNotFoundError as e:
+                    return JSONResponse(status_code=503, content={"error": str(e)})
+        finally:
+            if not queued:
+                await asyncio.to_thread(upload_storage.finish, session_id)
 
         return {
             "employee_name": employee_name,
-            "policy_summary": policy_text[:300],  # Optional: preview of the policy text
-            "num_invoices": len(invoice_texts),
-            "analysis_results": analysis_results
+            "policy_id": policy.policy_id,
+            "policy_summary": policy.text[:300],  # Optional: preview of the policy text
+            "num_invoices": pipeline_result["num_invoices"],
+            "num_unchanged": pipeline_result["num_unchanged"],
+            "analysis_results": pipeline_result["analysis_results"],
+            "timings": pipeline_result["timings"]
         }
 
     except Exception as e:
         # Catch-all error in case something unexpected goes wrong
-        return JSONResponse(status_code=500, content={"error": f"Internal server error: {str(e)}"})
\ No newline at end of file
+        return JSONResponse(status_code=500, content={"error": f"Internal server error: {str(e)}"})
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Returns the state of a background upload job and the results received so far.
+
+    Args:
+        job_id (str): ID returned by /analyze/upload in background mode.
+
+    Returns:
+        dict: Job status, progress and per-invoice results.
+    """
+    job = await asyncio.to_thread(job_manager.store.get, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Unknown job ID: {job_id}"})
+
+    results = await asyncio.to_thread(job_manager.store.results, job_id)
+    return {
+        "job_id": job_id,
+        "employee_name": job["employee_name"],
+        "policy_id": job["policy_id"],
+        "status": job["status"],
+        "error": job["error"],
+        "progress": {"done": len(results), "total": job["total"]},
+        "analysis_results": {
+            result["invoice_file"]: {
+                "status": result["status"], "reason": result["reason"], "decision_path": result["decision_path"]
+            }
+            for result in results
+        },
+        "timings": job["timings"]
+    }
+
+
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """
+    Streams a background job's per-invoice results as server-sent events.
+
+    Emits one "result" event per finished invoice (including those finished
+    before the client connected) and a final "done" event with the job status.
+    """
+    job = await asyncio.to_thread(job_manager.store.get, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Unknown job ID: {job_id}"})
+
+    async def events():
+        last_seq = -1
+        while True:
+            job = await asyncio.to_thread(job_manager.store.get, job_id)
+            for result in await asyncio.to_thread(job_manager.store.results, job_id, last_seq):
+                last_seq = result["seq"]
+                yield f"event: result\ndata: {json.dumps(result)}\n\n"
+
+            if job["status"] in FINISHED_STATES:
+                done = {"status": job["status"], "error": job["error"], "total": job["total"]}
+                yield f"event: done\ndata: {json.dumps(done)}\n\n"
+                return
+
+            await job_manager.wait_for_update(job_id, JOB_EVENTS_KEEPALIVE_SECONDS)
+            yield ": keep-alive\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@router.post("/policies")
+async def register_policy(policy_pdf: UploadFile = File(...)):
+    """
+    Registers an HR policy PDF so later uploads can refer to it by ID.
+    Registering the same PDF twice returns the existing policy.
+
+    Args:
+        policy_pdf (UploadFile): Uploaded HR policy PDF.
+
+    Returns:
+        dict: The policy ID and the sections found in the policy.
+    """
+    try:
+        session_id = await asyncio.to_thread(upload_storage.create_session)
+        try:
+            policy_path = await save_session_file(session_id, policy_pdf, MAX_POLICY_BYTES)
+            policy = await asyncio.to_thread(policy_registry.register_pdf, policy_path)
+        finally:
+            # The registry keeps the parsed policy, not the PDF
+            await asyncio.to_thread(upload_storage.finish, session_id)
+        return {
+            "policy_id": policy.policy_id,
+            "sections": sorted(policy.sections),
+            "policy_summary": policy.text[:300]
+        }
+
+    except UploadTooLargeError as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
+
+    except StorageQuotaError as e:
+        return JSONResponse(status_code=507, content={"error": str(e)})
+
+    except ValueError as ve:
+        return JSONResponse(status_code=400, content={"error": str(ve)})
+
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": f"Failed to register policy: {str(e)}"})
+
+
+@router.get("/policies")
+async def list_policies():
+    """
+    Lists all registered policies.
+    """
+    return {"policies": await asyncio.to_thread(policy_registry.list)}
+
+
+@router.get("/cache/stats")
+async def verdict_cache_stats():
+    """
+    Returns hit/miss counters and size of the LLM verdict cache.
+    """
+    return verdict_cache.stats()
@@ -1,8 +1,13 @@
 from fastapi import APIRouter
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
-from app.core.rag_chatbot import get_rag_response
+from typing import Dict, Optional
+from datetime import datetime
+import json
+import time
+from app.core.rag_chatbot import aget_rag_response, stream_rag_response
+from app.core.embedding_cache import embedding_cache
+from app.core.answer_cache import answer_cache
 
 router = APIRouter()
 
@@ -13,14 +18,40 @@ class ChatQuery(BaseModel):
     query: str
     employee_name: Optional[str] = None
     date: Optional[str] = None  # Expected in ISO format: "YYYY-MM-DD"
+    date_from: Optional[str] = None  # Inclusive range start, "YYYY-MM-DD"
+    date_to: Optional[str] = None  # Inclusive range end, "YYYY-MM-DD"
     status: Optional[str] = None  # E.g., "Fully Reimbursed", "Partially Reimbursed", "Declined"
+    vendor: Optional[str] = None  # As printed on the invoice, e.g. "Udapi Hotel"
+    category: Optional[str] = None  # "meals", "cab", "travel" or "accommodation"
+    currency: Optional[str] = None  # ISO 4217 code, e.g. "INR"
+
+def query_filters(query_data: ChatQuery) -> Dict[str, str]:
+    """
+    Returns the filters of a chat query, without empty values.
+
+    Raises:
+        ValueError: If date_from or date_to is not a YYYY-MM-DD date.
+    """
+    filters = {k: v for k, v in query_data.dict().items() if k != "query" and v is not None}
+
+    # Date ranges are compared as YYYY-MM-DD
+    for key in ("date_from", "date_to"):
+        if key in filters:
+            try:
+                datetime.strptime(filters[key], "%Y-%m-%d")
+            except ValueError:
+                raise ValueError(f"{key} must be a date in YYYY-MM-DD format.")
+    return filters
+
 
 @router.post("/query")
 async def chatbot_query(query_data: ChatQuery):
     """
     Handles POST requests to query the RAG chatbot.
 
-    Uses optional filters like employee name, date, and reimbursement status.
+    Uses optional filters like employee name, date (or date range), reimbursement status,
+    and the vendor, category or currency read from the invoice text.
+    Counting and listing questions are answered from the structured invoice index.
 
     Args:
         query_data (ChatQuery): User's natural language query with optional filters.
@@ -29,11 +60,10 @@ async def chatbot_query(query_data: ChatQuery):
         dict: Markdown-formatted response from the chatbot.
     """
     try:
-        # Prepare filter dictionary, removing None values
-        filters = {k: v for k, v in query_data.dict().items() if k != "query" and v is not None}
+        filters = query_filters(query_data)
 
-        # Call the core RAG logic
-        response = get_rag_response(
+        # Call the core RAG logic (awaited, so slow LLM calls do not block other requests)
+        response = await aget_rag_response(
             query=query_data.query,
             filters=filters
         )
@@ -49,4 +79,46 @@ async def chatbot_query(query_data: ChatQuery):
         return JSONResponse(
             status_code=500,
             content={"error": f"An error occurred while processing your query: {str(e)}"}
-        )
\ No newline at end of file
+        )
+
+
+@router.post("/query/stream")
+async def chatbot_query_stream(query_data: ChatQuery):
+    """
+    Streaming variant of /chatbot/query: the answer is sent as server-sent events
+    while the LLM generates it.
+
+    Emits "token" events ({"text": ...}) as chunks arrive and a final "done" event
+    with the time to first token and the total time, in seconds.
+
+    Args:
+        query_data (ChatQuery): User's natural language query with optional filters.
+    """
+    try:
+        filters = query_filters(query_data)
+    except ValueError as ve:
+        return JSONResponse(status_code=400, content={"error": str(ve)})
+
+    async def events():
+        start = time.perf_counter()
+        first_token = None
+        async for text in stream_rag_response(query_data.query, filters):
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            yield f"event: token\ndata: {json.dumps({'text': text})}\n\n"
+
+        done = {
+            "time_to_first_token": round(first_token, 4) if first_token is not None else None,
+            "total_seconds": round(time.perf_counter() - start, 4)
+        }
+        yield f"event: done\ndata: {json.dumps(done)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@router.get("/cache/stats")
+async def chatbot_cache_stats():
+    """
+    Returns hit/miss counters of the caches used by the chatbot.
+    """
+    return {"embeddings": embedding_cache.stats(), "answers": answer_cache.stats()}
@@ -1,43 +1,26 @@
 import os
 import json
-from langchain.chat_models import init_chat_model
+import asyncio
+from typing import Dict, List, Optional, Tuple
 from langchain.prompts import ChatPromptTemplate
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_chroma import Chroma
+from app.core.llm_client import llm_client
+from app.core.verdict_cache import verdict_cache, make_verdict_key
+from app.core.rules import pre_classify
+from app.core.metrics import span, llm_batch_fallbacks, invoice_decisions
 
-# Ensure API Key is set
-if not os.environ.get("GOOGLE_API_KEY"):
-    # You can load it securely via dotenv or env config in production
-    os.environ["GOOGLE_API_KEY"] = "your-google-api-key-here"
+# Bump whenever an analysis prompt changes so cached verdicts are not reused
+PROMPT_VERSION = "1"
 
-#Initialize Gemini LLM
-llm = init_chat_model("gemini-2.0-flash", model_provider="google_genai")
+# Maximum number of invoices classified in one LLM call in batched mode
+LLM_BATCH_SIZE = int(os.environ.get("LLM_BATCH_SIZE", "10"))
 
-# 📌 Set up embeddings (used for vector DB)
-embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+# How a verdict was reached, reported in its "decision_path" field
+DECISION_RULES = "rules"
+DECISION_CACHE = "cache"
+DECISION_LLM = "llm"
 
-# Chroma vector store (optional usage)
-vector_store = Chroma(
-    collection_name="policy_embeddings",
-    embedding_function=embeddings,
-    persist_directory="./chroma_langchain_db"
-)
-
-#Analyze Invoice using LLM
-def analyze_invoice(policy_text: str, invoice_text: str) -> dict:
-    """
-    Uses a Gemini LLM to analyze an invoice against a reimbursement policy.
-
-    Args:
-        policy_text (str): The reimbursement policy text.
-        invoice_text (str): The content of the invoice.
-
-    Returns:
-        dict: A dictionary with status and reason from LLM response.
-    """
-    try:
-        # Format the system prompt for the LLM using a template
-        prompt_template = ChatPromptTemplate.from_template("""
+# Prompt for classifying one invoice
+ANALYSIS_PROMPT = ChatPromptTemplate.from_template("""
 You are a financial reimbursement assistant. Given a company's reimbursement policy and an invoice, classify the invoice into:
 - Fully Reimbursed
 - Partially Reimbursed
@@ -59,43 +42,297 @@ Respond in JSON format like this:
   "reason": "All items are food-related and within reimbursement policy"
 }}
 """)
-        # Prepare the message for LLM
-        messages = prompt_template.format_messages(
-            policy=policy_text,
-            invoice=invoice_text
-        )
 
-        # Invoke the LLM
-        response = llm.invoke(messages)
-        content = response.content.strip()
+# Prompt for classifying several invoices in one call
+BATCH_ANALYSIS_PROMPT = ChatPromptTemplate.from_template("""
+You are a financial reimbursement assistant. Given a company's reimbursement policy and several invoices, classify EACH invoice independently into:
+- Fully Reimbursed
+- Partially Reimbursed
+- Declined
+
+## Reimbursement Policy:
+{policy}
+
+## Invoices:
+{invoices}
+
+Respond with a JSON array containing exactly one object per invoice, in any order, like this:
+[
+  {{"invoice_id": 1, "status": "Fully Reimbursed", "reason": "All items are food-related and within reimbursement policy"}},
+  {{"invoice_id": 2, "status": "Declined", "reason": "Alcoholic beverages are not reimbursable"}}
+]
+""")
+
+
+def _strip_code_fences(content: str) -> str:
+    """
+    Removes markdown-style code fences (e.g. ```json blocks) around an LLM response.
+    """
+    content = content.strip()
+    if content.startswith("```json"):
+        content = content.removeprefix("```json").strip()
+    elif content.startswith("```"):
+        content = content.removeprefix("```").strip()
+    if content.endswith("```"):
+        content = content.removesuffix("```").strip()
+    return content
+
+#Analyze Invoice using LLM
+def analyze_invoice(policy_text: str, invoice_text: str) -> dict:
+    """
+    Uses a Gemini LLM to analyze an invoice against a reimbursement policy.
+
+    Clear-cut invoices (e.g. a cab bill well under the cab limit) are classified
+    by rules without calling the LLM (see pre_classify). LLM verdicts are cached
+    by policy/invoice content, so re-analyzing an identical invoice under the
+    same policy does not call the LLM again.
+
+    Args:
+        policy_text (str): The reimbursement policy text.
+        invoice_text (str): The content of the invoice.
 
-        # Clean markdown-style formatting if present (e.g., ```json blocks)
-        if content.startswith("```json"):
-            content = content.removeprefix("```json").strip()
-        elif content.startswith("```"):
-            content = content.removeprefix("```").strip()
-        if content.endswith("```"):
-            content = content.removesuffix("```").strip()
+    Returns:
+        dict: Status and reason, plus decision_path ("rules", "cache" or "llm").
+    """
+    with span("analyze_invoice"):
+        verdict, cache_key = _known_verdict(policy_text, invoice_text)
+        if verdict is None:
+            try:
+                # Invoke the LLM (rate-limited, retried on quota and transient errors)
+                response = llm_client.invoke(_analysis_messages(policy_text, invoice_text), operation="analyze")
+                verdict = _parse_verdict(response.content, cache_key)
+            except Exception as e:
+                verdict = _error_verdict(e)
+    invoice_decisions.inc(path=verdict["decision_path"])
+    return verdict
 
-        # Try parsing the JSON string
-        parsed = json.loads(content)
 
-        # Validate keys in parsed response
-        if not isinstance(parsed, dict) or "status" not in parsed or "reason" not in parsed:
-            raise ValueError("LLM response is missing required fields.")
+async def aanalyze_invoice(policy_text: str, invoice_text: str) -> dict:
+    """
+    Async variant of analyze_invoice: the LLM call is awaited instead of
+    blocking a worker thread.
+    """
+    with span("analyze_invoice"):
+        verdict, cache_key = _known_verdict(policy_text, invoice_text)
+        if verdict is None:
+            try:
+                response = await llm_client.ainvoke(_analysis_messages(policy_text, invoice_text), operation="analyze")
+                verdict = _parse_verdict(response.content, cache_key)
+            except Exception as e:
+                verdict = _error_verdict(e)
+    invoice_decisions.inc(path=verdict["decision_path"])
+    return verdict
 
-        return parsed
 
+def _known_verdict(policy_text: str, invoice_text: str) -> Tuple[Optional[dict], str]:
+    """
+    Returns the rule-based or cached verdict of an invoice (None if the LLM has
+    to decide) and its verdict cache key.
+    """
+    with span("rules"):
+        verdict = pre_classify(policy_text, invoice_text)
+    if verdict is not None:
+        return {**verdict, "decision_path": DECISION_RULES}, ""
+
+    # Return the stored verdict if this exact policy + invoice was analyzed before
+    cache_key = make_verdict_key(policy_text, invoice_text, PROMPT_VERSION)
+    cached = verdict_cache.get(cache_key)
+    if cached is not None:
+        return {**cached, "decision_path": DECISION_CACHE}, cache_key
+    return None, cache_key
+
+
+def _analysis_messages(policy_text: str, invoice_text: str) -> List:
+    return ANALYSIS_PROMPT.format_messages(policy=policy_text, invoice=invoice_text)
+
+
+def _error_verdict(error: Exception) -> dict:
+    return {
+        "status": "Error",
+        "reason": f"Exception during analysis: {str(error)}",
+        "decision_path": DECISION_LLM
+    }
+
+
+def _parse_verdict(content: str, cache_key: str) -> dict:
+    """
+    Parses and validates the LLM's verdict for one invoice and caches it.
+    """
+    try:
+        with span("json_parse"):
+            # Clean markdown-style formatting if present (e.g., ```json blocks)
+            parsed = json.loads(_strip_code_fences(content))
     except json.JSONDecodeError:
         # JSON decoding failed
         return {
             "status": "Error",
-            "reason": f"Invalid JSON format in LLM response: {response.content}"
+            "reason": f"Invalid JSON format in LLM response: {content}",
+            "decision_path": DECISION_LLM
         }
 
+    # Validate keys in parsed response
+    if not isinstance(parsed, dict) or "status" not in parsed or "reason" not in parsed:
+        return _error_verdict(ValueError("LLM response is missing required fields."))
+
+    verdict_cache.put(cache_key, parsed)
+    return {**parsed, "decision_path": DECISION_LLM}
+
+
+# Analyze several invoices against one policy in a single LLM call
+def analyze_invoices_batch(policy_text: str, invoices: Dict[str, str]) -> Dict[str, dict]:
+    """
+    Classifies several invoices against the same policy with one LLM call.
+
+    The policy is sent once and the LLM returns a JSON array with one verdict per
+    invoice. Each verdict is validated on its own; invoices whose verdict is
+    missing or malformed (or all of them, if the response cannot be parsed) are
+    re-analyzed individually with analyze_invoice. Invoices the rules can
+    classify and cached verdicts never reach the LLM.
+
+    Args:
+        policy_text (str): The reimbursement policy text.
+        invoices (Dict[str, str]): Invoice contents keyed by file name.
+
+    Returns:
+        Dict[str, dict]: Status, reason and decision_path for each invoice, keyed by file name.
+    """
+    results, pending = _split_known(policy_text, invoices)
+
+    names: List[str] = list(pending)
+    for start in range(0, len(names), max(1, LLM_BATCH_SIZE)):
+        chunk = names[start:start + max(1, LLM_BATCH_SIZE)]
+        verdicts = _classify_chunk(policy_text, [pending[name] for name in chunk]) if len(chunk) > 1 else {}
+
+        for name in _record_chunk(policy_text, pending, chunk, verdicts, results):
+            results[name] = analyze_invoice(policy_text, pending[name])
+
+    return {name: results[name] for name in invoices}
+
+
+async def aanalyze_invoices_batch(policy_text: str, invoices: Dict[str, str]) -> Dict[str, dict]:
+    """
+    Async variant of analyze_invoices_batch: LLM calls are awaited, and the
+    batches (and any single-invoice fallbacks) run concurrently.
+    """
+    results, pending = _split_known(policy_text, invoices)
+
+    async def classify(chunk: List[str]):
+        verdicts = await _aclassify_chunk(policy_text, [pending[name] for name in chunk]) if len(chunk) > 1 else {}
+        fallbacks = _record_chunk(policy_text, pending, chunk, verdicts, results)
+        singles = await asyncio.gather(*(aanalyze_invoice(policy_text, pending[name]) for name in fallbacks))
+        results.update(zip(fallbacks, singles))
+
+    names: List[str] = list(pending)
+    size = max(1, LLM_BATCH_SIZE)
+    await asyncio.gather(*(classify(names[start:start + size]) for start in range(0, len(names), size)))
+    return {name: results[name] for name in invoices}
+
+
+def _split_known(policy_text: str, invoices: Dict[str, str]) -> Tuple[Dict[str, dict], Dict[str, str]]:
+    """
+    Separates invoices with a rule-based or cached verdict from those that need the LLM.
+
+    Returns:
+        Tuple: Known verdicts by file name, and the remaining invoice texts by file name.
+    """
+    results: Dict[str, dict] = {}
+    pending: Dict[str, str] = {}
+
+    # Only invoices the rules cannot classify and that have not been analyzed before need the LLM
+    for name, invoice_text in invoices.items():
+        with span("rules"):
+            verdict = pre_classify(policy_text, invoice_text)
+        if verdict is not None:
+            results[name] = {**verdict, "decision_path": DECISION_RULES}
+            invoice_decisions.inc(path=DECISION_RULES)
+            continue
+        cached = verdict_cache.get(make_verdict_key(policy_text, invoice_text, PROMPT_VERSION))
+        if cached is not None:
+            results[name] = {**cached, "decision_path": DECISION_CACHE}
+            invoice_decisions.inc(path=DECISION_CACHE)
+        else:
+            pending[name] = invoice_text
+    return results, pending
+
+
+def _record_chunk(
+    policy_text: str, pending: Dict[str, str], chunk: List[str], verdicts: Dict[int, dict], results: Dict[str, dict]
+) -> List[str]:
+    """
+    Stores the valid verdicts of a batch in results (and the verdict cache).
+
+    Returns:
+        List[str]: Invoices without a valid verdict, to re-analyze one by one.
+    """
+    fallbacks = []
+    for index, name in enumerate(chunk):
+        verdict = verdicts.get(index)
+        if verdict is None:
+            # Missing or malformed verdict: fall back to a single-invoice call
+            if len(chunk) > 1:
+                llm_batch_fallbacks.inc()
+            fallbacks.append(name)
+        else:
+            verdict_cache.put(make_verdict_key(policy_text, pending[name], PROMPT_VERSION), verdict)
+            results[name] = {**verdict, "decision_path": DECISION_LLM}
+            invoice_decisions.inc(path=DECISION_LLM)
+    return fallbacks
+
+
+def _batch_messages(policy_text: str, invoice_texts: List[str]) -> List:
+    invoices_block = "\n\n".join(
+        f"### Invoice {index + 1}\n{text}" for index, text in enumerate(invoice_texts)
+    )
+    return BATCH_ANALYSIS_PROMPT.format_messages(policy=policy_text, invoices=invoices_block)
+
+
+def _classify_chunk(policy_text: str, invoice_texts: List[str]) -> Dict[int, dict]:
+    """
+    Sends one batch of invoices to the LLM and returns the valid verdicts by position.
+    Returns an empty dict if the call fails or the response is not a JSON array.
+    """
+    try:
+        response = llm_client.invoke(_batch_messages(policy_text, invoice_texts), operation="analyze_batch")
     except Exception as e:
-        # Catch-all for any other issues
-        return {
-            "status": "Error",
-            "reason": f"Exception during analysis: {str(e)}"
-        }
\ No newline at end of file
+        print(f"Warning: Batched analysis failed, falling back to single calls: {e}")
+        return {}
+    return _parse_batch(response.content, len(invoice_texts))
+
+
+async def _aclassify_chunk(policy_text: str, invoice_texts: List[str]) -> Dict[int, dict]:
+    """
+    Async variant of _classify_chunk.
+    """
+    try:
+        response = await llm_client.ainvoke(_batch_messages(policy_text, invoice_texts), operation="analyze_batch")
+    except Exception as e:
+        print(f"Warning: Batched analysis failed, falling back to single calls: {e}")
+        return {}
+    return _parse_batch(response.content, len(invoice_texts))
+
+
+def _parse_batch(content: str, count: int) -> Dict[int, dict]:
+    """
+    Returns the valid verdicts of a batched response by invoice position (0-based).
+    """
+    try:
+        with span("json_parse"):
+            parsed = json.loads(_strip_code_fences(content))
+    except Exception as e:
+        print(f"Warning: Batched analysis failed, falling back to single calls: {e}")
+        return {}
+
+    if not isinstance(parsed, list):
+        return {}
+
+    verdicts: Dict[int, dict] = {}
+    for item in parsed:
+        if not isinstance(item, dict) or "status" not in item or "reason" not in item:
+            continue
+        try:
+            index = int(item.get("invoice_id")) - 1
+        except (TypeError, ValueError):
+            continue
+        if 0 <= index < count and index not in verdicts:
+            verdicts[index] = {"status": item["status"], "reason": item["reason"]}
+    return verdicts
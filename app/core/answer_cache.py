@@ -0,0 +1,223 @@
+import os
+import json
+import math
+import time
+import sqlite3
+import threading
+from array import array
+from typing import Dict, List, Optional
+from app.core.config import CACHE_DIR
+
+# Reuse a chatbot answer when a new question with the same filters is at least this similar (cosine)
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+# Eviction limits for cached answers
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_TTL_SECONDS = float(os.environ.get("ANSWER_CACHE_TTL_SECONDS", str(24 * 3600)))
+
+
+def make_filters_key(filters: Dict) -> str:
+    """
+    Canonical form of a filter set: the same filters in any order give the same key.
+    """
+    return json.dumps({key: value for key, value in filters.items() if value}, sort_keys=True)
+
+
+def _unit_vector(vector: List[float]) -> array:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return array("f", (x / norm for x in vector))
+
+
+# Filters compared without regard to case
+_CASELESS_KEYS = ("employee_name", "vendor")
+
+
+def filters_match_metadata(filters: Dict, metadata: Dict) -> bool:
+    """
+    Tells whether an invoice with this metadata falls inside a chatbot filter set,
+    i.e. whether storing it could change the answer to a query with these filters.
+    """
+    for key, value in filters.items():
+        if not value:
+            continue
+        invoice_date = (metadata.get("date") or "")[:10]
+        if key == "date_from":
+            if invoice_date and invoice_date < value:
+                return False
+        elif key == "date_to":
+            if invoice_date and invoice_date > value:
+                return False
+        elif key == "date":
+            if metadata.get("date") != value:
+                return False
+        elif key in _CASELESS_KEYS:
+            # Matched case-insensitively, like the invoice index (see filter_conditions)
+            if metadata.get(key) and str(metadata[key]).lower() != str(value).lower():
+                return False
+        elif key in metadata and metadata[key] != value:
+            return False
+    return True
+
+
+class AnswerCache:
+    """
+    Persistent SQLite cache of chatbot answers, looked up by filter set and
+    query embedding similarity.
+
+    A question hits when an earlier question with exactly the same filters has
+    a cosine similarity of at least similarity_threshold. Entries expire after
+    ttl_seconds, the least recently used are evicted past max_entries, and
+    entries whose filters match newly stored invoices are dropped (see invalidate).
+    """
+
+    def __init__(
+        self,
+        path: str,
+        similarity_threshold: float = ANSWER_CACHE_SIMILARITY,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS
+    ):
+        self.path = path
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS answers (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    filters_key TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    answer TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_filters_key ON answers (filters_key)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_last_used ON answers (last_used)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, filters: Dict, query_vector: List[float]) -> Optional[str]:
+        """
+        Returns the answer of the most similar cached question with the same filters,
+        or None if none is similar enough.
+        """
+        now = time.time()
+        target = _unit_vector(query_vector)
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute(
+                "SELECT id, vector, answer FROM answers WHERE filters_key = ? AND created_at >= ?",
+                (make_filters_key(filters), now - self.ttl_seconds)
+            ).fetchall()
+
+            best_id, best_answer, best_score = None, None, self.similarity_threshold
+            for entry_id, blob, answer in rows:
+                vector = array("f")
+                vector.frombytes(blob)
+                if len(vector) != len(target):
+                    continue
+                score = sum(a * b for a, b in zip(vector, target))
+                if score >= best_score:
+                    best_id, best_answer, best_score = entry_id, answer, score
+
+            if best_id is None:
+                self.misses += 1
+                return None
+
+            conn.execute("UPDATE answers SET last_used = ? WHERE id = ?", (now, best_id))
+            conn.commit()
+            self.hits += 1
+            return best_answer
+
+    def put(self, filters: Dict, query: str, query_vector: List[float], answer: str):
+        """
+        Stores an answer and evicts expired / least recently used entries if needed.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT INTO answers (filters_key, query, vector, answer, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (make_filters_key(filters), query, _unit_vector(query_vector).tobytes(), answer, now, now)
+            )
+            self.evictions += conn.execute(
+                "DELETE FROM answers WHERE created_at < ?", (now - self.ttl_seconds,)
+            ).rowcount
+
+            overflow = conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self.evictions += conn.execute(
+                    "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY last_used LIMIT ?)",
+                    (overflow,)
+                ).rowcount
+            conn.commit()
+
+    def invalidate(self, metadatas: List[Dict]) -> int:
+        """
+        Drops cached answers whose filters match any of the newly stored invoices.
+
+        Args:
+            metadatas (List[dict]): Metadata of the stored invoices.
+
+        Returns:
+            int: Number of answers dropped.
+        """
+        if not metadatas:
+            return 0
+        with self._lock:
+            conn = self._connect()
+            keys = [row[0] for row in conn.execute("SELECT DISTINCT filters_key FROM answers").fetchall()]
+            stale = [
+                key for key in keys
+                if any(filters_match_metadata(json.loads(key), metadata) for metadata in metadatas)
+            ]
+            dropped = 0
+            for key in stale:
+                dropped += conn.execute("DELETE FROM answers WHERE filters_key = ?", (key,)).rowcount
+            conn.commit()
+            self.invalidations += dropped
+        return dropped
+
+    def clear(self):
+        """
+        Removes every cached answer.
+        """
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM answers")
+            conn.commit()
+
+    def stats(self) -> Dict:
+        """
+        Returns hit/miss/eviction/invalidation counters and the number of stored answers.
+        """
+        with self._lock:
+            entries = self._connect().execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+# Shared cache used by the RAG chatbot
+answer_cache = AnswerCache(os.path.join(CACHE_DIR, "answers.sqlite3"))
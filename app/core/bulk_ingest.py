@@ -0,0 +1,355 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import sqlite3
+import zipfile
+import argparse
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+from app.core.config import CACHE_DIR
+from app.core.ingest_writer import require_writer
+from app.core.pipeline import InvoiceSource, run_invoice_pipeline, sources_from_paths, sources_from_zip
+from app.core.policy_registry import PolicyRecord, policy_registry
+from app.utils.pdf_pool import shutdown_pdf_pool
+
+# Loose PDFs of one folder are processed in pipeline runs of at most this many (a ZIP is one run)
+BULK_INGEST_CHUNK_SIZE = int(os.environ.get("BULK_INGEST_CHUNK_SIZE", "200"))
+
+# Pipeline runs (ZIPs or chunks of loose PDFs) in progress at the same time
+BULK_INGEST_PARALLEL_UNITS = int(os.environ.get("BULK_INGEST_PARALLEL_UNITS", "4"))
+
+# Checkpoint status of PDFs without extractable text (not retried on resume)
+UNREADABLE = "Unreadable"
+
+
+class IngestCheckpoint:
+    """
+    Records which invoices of a bulk ingest have finished, per policy, so an
+    interrupted run can skip them when it is started again.
+
+    Invoices are keyed by their path relative to the ingest root
+    ("folder/invoice.pdf" or "folder/archive.zip::member.pdf").
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS ingested (
+                    policy_id TEXT NOT NULL,
+                    source_key TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    finished_at REAL NOT NULL,
+                    PRIMARY KEY (policy_id, source_key)
+                )
+            """)
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def done(self, policy_id: str) -> Set[str]:
+        """
+        Returns the keys of every invoice already finished under a policy.
+        Failed invoices are never finished, so they are retried.
+        """
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT source_key FROM ingested WHERE policy_id = ? AND status != 'Error'", (policy_id,)
+            ).fetchall()
+        return {key for (key,) in rows}
+
+    def mark(self, policy_id: str, source_key: str, status: str):
+        """
+        Records one finished invoice.
+        """
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO ingested (policy_id, source_key, status, finished_at) VALUES (?, ?, ?, ?)",
+                (policy_id, source_key, status, time.time())
+            )
+            conn.commit()
+
+
+@dataclass
+class IngestUnit:
+    """
+    One pipeline run of a bulk ingest: a ZIP archive, or a chunk of loose PDFs from one folder.
+    """
+    employee_name: str
+    # Path of the ZIP, or of the folder holding the PDFs
+    path: str
+    pdf_paths: List[str] = field(default_factory=list)
+
+    @property
+    def is_zip(self) -> bool:
+        return not self.pdf_paths
+
+
+class IngestReport:
+    """
+    Counts and timings of a bulk ingest, written as the throughput report.
+    """
+
+    def __init__(self, root: str, policy_id: str):
+        self.root = root
+        self.policy_id = policy_id
+        self.started = time.perf_counter()
+        self.units = 0
+        self.counts: Dict[str, int] = defaultdict(int)
+        self.statuses: Dict[str, int] = defaultdict(int)
+        self.decision_paths: Dict[str, int] = defaultdict(int)
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.interrupted = False
+
+    def add_result(self, analysis: Dict):
+        self.statuses[analysis["status"]] += 1
+        self.decision_paths[analysis.get("decision_path") or "unknown"] += 1
+        self.counts["errors" if analysis["status"] == "Error" else "processed"] += 1
+
+    def add_timings(self, timings: Dict):
+        for stage, totals in timings["stages"].items():
+            merged = self.stages.setdefault(stage, {"count": 0, "total_seconds": 0.0})
+            merged["count"] += totals["count"]
+            merged["total_seconds"] = round(merged["total_seconds"] + totals["total_seconds"], 4)
+
+    def summary(self) -> Dict:
+        """
+        Returns the report: invoice counts, throughput, verdicts, decision paths and stage totals.
+        """
+        wall = time.perf_counter() - self.started
+        return {
+            "root": self.root,
+            "policy_id": self.policy_id,
+            "interrupted": self.interrupted,
+            "wall_seconds": round(wall, 4),
+            "units": self.units,
+            "invoices": {
+                key: self.counts[key]
+                for key in ("found", "skipped_checkpoint", "processed", "unchanged", "unreadable", "errors")
+            },
+            "invoices_per_second": round(self.counts["processed"] / wall, 2) if wall else 0.0,
+            "statuses": dict(self.statuses),
+            "decision_paths": dict(self.decision_paths),
+            "stages": self.stages
+        }
+
+
+def discover_units(
+    root: str,
+    employee_name: Optional[str] = None,
+    chunk_size: int = BULK_INGEST_CHUNK_SIZE
+) -> List[IngestUnit]:
+    """
+    Walks a directory tree of invoice ZIPs and PDFs.
+
+    Unless employee_name is given, invoices belong to the employee named by the
+    top-level folder they are in (root/<employee>/...); files directly in root
+    belong to the employee named by root itself.
+
+    Args:
+        root (str): Directory to scan.
+        employee_name (str, optional): Employee of every invoice.
+        chunk_size (int): Maximum loose PDFs per unit.
+
+    Returns:
+        List[IngestUnit]: One unit per ZIP and per chunk of loose PDFs, in path order.
+    """
+    root = os.path.abspath(root)
+    units: List[IngestUnit] = []
+    for folder, folders, names in os.walk(root):
+        folders.sort()
+        relative = os.path.relpath(folder, root)
+        employee = employee_name or (
+            os.path.basename(root) if relative == "." else relative.split(os.sep)[0]
+        )
+
+        pdfs = []
+        for name in sorted(names):
+            path = os.path.join(folder, name)
+            if name.lower().endswith(".zip"):
+                units.append(IngestUnit(employee, path))
+            elif name.lower().endswith(".pdf") and not name.startswith("._"):
+                pdfs.append(path)
+        for start in range(0, len(pdfs), max(1, chunk_size)):
+            units.append(IngestUnit(employee, folder, pdfs[start:start + max(1, chunk_size)]))
+    return units
+
+
+async def ingest_unit(
+    unit: IngestUnit,
+    root: str,
+    policy: PolicyRecord,
+    checkpoint: IngestCheckpoint,
+    done: Set[str],
+    report: IngestReport,
+    concurrency: Optional[int] = None,
+    batch_mode: bool = False
+) -> int:
+    """
+    Runs the invoice pipeline over one unit, skipping invoices recorded in the
+    checkpoint and recording each invoice as it finishes.
+
+    Returns:
+        int: Number of invoices in the unit.
+    """
+    async def run(sources: List[InvoiceSource], keys: Dict[str, str]) -> int:
+        pending = [source for source in sources if keys[source[0]] not in done]
+        report.counts["found"] += len(sources)
+        report.counts["skipped_checkpoint"] += len(sources) - len(pending)
+        if not pending:
+            return len(sources)
+
+        async def record(filename: str, analysis: Dict):
+            report.add_result(analysis)
+            # Failed invoices are left out of the checkpoint so they are retried
+            if analysis["status"] != "Error":
+                await asyncio.to_thread(checkpoint.mark, policy.policy_id, keys[filename], analysis["status"])
+
+        result = await run_invoice_pipeline(
+            unit.employee_name, policy, pending, concurrency=concurrency, batch_mode=batch_mode, on_result=record
+        )
+        # Unchanged invoices were reported through record too; they count as unchanged, not processed
+        report.counts["unchanged"] += result["num_unchanged"]
+        report.counts["processed"] -= result["num_unchanged"]
+        report.add_timings(result["timings"])
+        for filename, _ in pending:
+            if filename not in result["analysis_results"]:
+                report.counts["unreadable"] += 1
+                await asyncio.to_thread(checkpoint.mark, policy.policy_id, keys[filename], UNREADABLE)
+        return len(sources)
+
+    relative = os.path.relpath(unit.path, root)
+    if unit.is_zip:
+        try:
+            zip_ref = await asyncio.to_thread(zipfile.ZipFile, unit.path)
+        except zipfile.BadZipFile:
+            print(f"Warning: '{unit.path}' is not a valid ZIP archive.", file=sys.stderr)
+            return 0
+        with zip_ref:
+            sources = sources_from_zip(zip_ref)
+            found = await run(sources, {name: f"{relative}::{name}" for name, _ in sources})
+    else:
+        sources = sources_from_paths(unit.pdf_paths)
+        found = await run(sources, {name: os.path.normpath(os.path.join(relative, name)) for name, _ in sources})
+    report.units += 1
+    return found
+
+
+async def bulk_ingest(
+    root: str,
+    policy: PolicyRecord,
+    checkpoint: IngestCheckpoint,
+    report: IngestReport,
+    employee_name: Optional[str] = None,
+    concurrency: Optional[int] = None,
+    batch_mode: bool = False,
+    parallel_units: int = BULK_INGEST_PARALLEL_UNITS,
+    chunk_size: int = BULK_INGEST_CHUNK_SIZE
+):
+    """
+    Parses, classifies and stores every invoice under a directory tree.
+
+    Units (ZIPs and chunks of loose PDFs) run through run_invoice_pipeline
+    several at a time, so PDF parsing uses the PDF process pool and stores are
+    batched across units. Invoices already stored with the same content are
+    skipped by the pipeline; invoices recorded in the checkpoint are not even read.
+
+    Args:
+        root (str): Directory to scan (see discover_units).
+        policy (PolicyRecord): The registered policy to classify against.
+        checkpoint (IngestCheckpoint): Finished invoices, for resuming.
+        report (IngestReport): Collects counts and timings.
+        employee_name (str, optional): Employee of every invoice. Defaults to the top-level folder names.
+        concurrency (int, optional): Invoices in flight per unit. Defaults to PIPELINE_CONCURRENCY.
+        batch_mode (bool): Classify several invoices per LLM call.
+        parallel_units (int): Units processed at the same time.
+        chunk_size (int): Maximum loose PDFs per unit.
+    """
+    root = os.path.abspath(root)
+    units = await asyncio.to_thread(discover_units, root, employee_name, chunk_size)
+    done = await asyncio.to_thread(checkpoint.done, policy.policy_id)
+    slots = asyncio.Semaphore(max(1, parallel_units))
+
+    async def process(unit: IngestUnit):
+        async with slots:
+            start = time.perf_counter()
+            found = await ingest_unit(unit, root, policy, checkpoint, done, report, concurrency, batch_mode)
+            print(
+                f"{time.perf_counter() - start:8.2f}s  {found:5d} invoice(s)  "
+                f"{unit.employee_name}: {os.path.relpath(unit.path, root)}",
+                file=sys.stderr
+            )
+
+    await asyncio.gather(*(process(unit) for unit in units))
+
+
+def main(argv: Optional[list] = None):
+    """
+    Command-line entry point: ingest a directory tree of invoice ZIPs and PDFs.
+
+    Takes the ingest writer lock, so it refuses to start while an API worker
+    is the writer; run the API with INGEST_ROLE=reader alongside it.
+
+    Example:
+        python -m app.core.bulk_ingest archives/ --policy Policy-Nov-2024.pdf --report report.json
+    """
+    parser = argparse.ArgumentParser(description="Parse, classify and store invoice archives in bulk.")
+    parser.add_argument("root", help="Directory of ZIPs and PDFs, one top-level folder per employee")
+    parser.add_argument("--policy", required=True, help="Policy PDF to classify against")
+    parser.add_argument("--employee", help="Employee of every invoice (default: top-level folder names)")
+    parser.add_argument("--checkpoint", default=os.path.join(CACHE_DIR, "bulk_ingest.sqlite3"),
+                        help="Checkpoint database used to resume an interrupted run")
+    parser.add_argument("--report", help="Write the throughput report to this JSON file")
+    parser.add_argument("--batch-mode", action="store_true", help="Classify several invoices per LLM call")
+    parser.add_argument("--concurrency", type=int, help="Invoices in flight per unit (default: PIPELINE_CONCURRENCY)")
+    parser.add_argument("--parallel-units", type=int, default=BULK_INGEST_PARALLEL_UNITS,
+                        help="ZIPs / PDF chunks processed at the same time")
+    parser.add_argument("--chunk-size", type=int, default=BULK_INGEST_CHUNK_SIZE, help="Loose PDFs per unit")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.root):
+        parser.error(f"'{args.root}' is not a directory.")
+    require_writer("bulk_ingest")
+
+    policy = policy_registry.register_pdf(args.policy)
+    report = IngestReport(os.path.abspath(args.root), policy.policy_id)
+    try:
+        asyncio.run(bulk_ingest(
+            args.root, policy, IngestCheckpoint(args.checkpoint), report,
+            employee_name=args.employee, concurrency=args.concurrency, batch_mode=args.batch_mode,
+            parallel_units=args.parallel_units, chunk_size=args.chunk_size
+        ))
+    except KeyboardInterrupt:
+        # Finished invoices are already in the checkpoint; the next run continues from there
+        report.interrupted = True
+    finally:
+        shutdown_pdf_pool()
+
+    summary = report.summary()
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    counts = summary["invoices"]
+    print(
+        f"{'Interrupted after' if report.interrupted else 'Finished in'} {summary['wall_seconds']:.2f}s: "
+        f"{counts['processed']} processed ({summary['invoices_per_second']:.1f}/s), "
+        f"{counts['unchanged']} unchanged, {counts['skipped_checkpoint']} already in checkpoint, "
+        f"{counts['unreadable']} unreadable, {counts['errors']} failed",
+        file=sys.stderr
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+import os
+
+# Directory for local caches and indexes (created on first use)
+CACHE_DIR = os.environ.get("CACHE_DIR", "./cache")
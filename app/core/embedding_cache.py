@@ -0,0 +1,214 @@
+import os
+import asyncio
+import time
+import hashlib
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from langchain_core.embeddings import Embeddings
+from app.core.config import CACHE_DIR
+from app.core.metrics import span
+
+# Size limits: vectors kept in memory (LRU) and on disk (oldest evicted first)
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.environ.get("EMBEDDING_CACHE_MEMORY_ITEMS", "5000"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+
+
+def make_embedding_key(model_name: str, kind: str, text: str) -> str:
+    """
+    Builds the cache key of one embedding.
+
+    Queries and documents are cached separately because some providers embed
+    them differently (e.g. Gemini's retrieval_query vs retrieval_document).
+    """
+    return f"{model_name}:{kind}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache of embedding vectors.
+
+    Vectors are stored on disk in SQLite as float32 blobs (4 bytes per
+    dimension) and the most recently used ones are also kept in memory.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        memory_items: int = EMBEDDING_CACHE_MEMORY_ITEMS,
+        max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES
+    ):
+        self.path = path
+        self.memory_items = memory_items
+        self.max_entries = max_entries
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    vector BLOB NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_created_at ON embeddings (created_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _remember(self, key: str, vector: List[float]):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """
+        Returns the cached vectors for the given keys; missing keys are left out.
+        """
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            missing = []
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+                    self.memory_hits += 1
+                else:
+                    missing.append(key)
+
+            if missing:
+                conn = self._connect()
+                for start in range(0, len(missing), 500):
+                    chunk = missing[start:start + 500]
+                    rows = conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                    ).fetchall()
+                    for key, blob in rows:
+                        vector = array("f")
+                        vector.frombytes(blob)
+                        found[key] = vector.tolist()
+                        self._remember(key, found[key])
+                        self.disk_hits += 1
+
+            self.misses += len(missing) - sum(1 for key in missing if key in found)
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        """
+        Stores vectors in both tiers and evicts the oldest disk entries past max_entries.
+        """
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            for key, vector in items.items():
+                self._remember(key, list(vector))
+
+            conn = self._connect()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, created_at) VALUES (?, ?, ?)",
+                [(key, array("f", vector).tobytes(), now) for key, vector in items.items()]
+            )
+            overflow = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY created_at LIMIT ?)",
+                    (overflow,)
+                )
+            conn.commit()
+
+    def stats(self) -> Dict:
+        """
+        Returns hit/miss counters and the number of vectors held in each tier.
+        """
+        with self._lock:
+            disk_entries = self._connect().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            memory_entries = len(self._memory)
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "memory_entries": memory_entries,
+            "disk_entries": disk_entries,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model so repeated texts and queries skip the embedding API.
+    Only cache misses are sent to the underlying model, in a single call.
+    The async methods read and write the cache in a worker thread, so SQLite
+    never blocks the event loop.
+    """
+
+    def __init__(self, underlying: Embeddings, model_name: str, cache: EmbeddingCache):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.cache = cache
+
+    def _split(self, kind: str, texts: List[str]):
+        keys = [make_embedding_key(self.model_name, kind, text) for text in texts]
+        found = self.cache.get_many(keys)
+        # Each distinct missing text is embedded once, even if it appears several times
+        missing = list(dict.fromkeys(
+            (key, text) for key, text in zip(keys, texts) if key not in found
+        ))
+        return keys, found, missing
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, missing = self._split("document", texts)
+        if missing:
+            with span("embedding"):
+                vectors = self.underlying.embed_documents([text for _, text in missing])
+            new = {key: vector for (key, _), vector in zip(missing, vectors)}
+            self.cache.put_many(new)
+            found.update(new)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        keys, found, missing = self._split("query", [text])
+        if missing:
+            with span("embedding"):
+                vector = self.underlying.embed_query(text)
+            self.cache.put_many({keys[0]: vector})
+            return vector
+        return found[keys[0]]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, missing = await asyncio.to_thread(self._split, "document", texts)
+        if missing:
+            with span("embedding"):
+                vectors = await self.underlying.aembed_documents([text for _, text in missing])
+            new = {key: vector for (key, _), vector in zip(missing, vectors)}
+            await asyncio.to_thread(self.cache.put_many, new)
+            found.update(new)
+        return [found[key] for key in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        keys, found, missing = await asyncio.to_thread(self._split, "query", [text])
+        if missing:
+            with span("embedding"):
+                vector = await self.underlying.aembed_query(text)
+            await asyncio.to_thread(self.cache.put_many, {keys[0]: vector})
+            return vector
+        return found[keys[0]]
+
+
+# Shared cache used by the embedding provider
+embedding_cache = EmbeddingCache(os.path.join(CACHE_DIR, "embeddings.sqlite3"))
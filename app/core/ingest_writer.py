@@ -0,0 +1,214 @@
+import os
+import sys
+import signal
+import asyncio
+import threading
+from typing import Dict, Optional
+from app.core.config import CACHE_DIR
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory file locks, every process considers itself the writer
+    fcntl = None
+
+# Whether this process may become the writer: "auto" (the first process to take the writer lock
+# writes the vector store and indexes and runs upload jobs; the others serve reads and take over
+# if it exits) or "reader" (never writes; uploads are queued for the writer)
+INGEST_ROLE = os.environ.get("INGEST_ROLE", "auto").lower()
+
+# Lock file that elects the writer among the processes sharing CACHE_DIR (e.g. uvicorn workers)
+INGEST_WRITER_LOCK = os.environ.get("INGEST_WRITER_LOCK", os.path.join(CACHE_DIR, "ingest_writer.lock"))
+
+# How often a read replica tries to take over the writer lock
+INGEST_WRITER_RETRY_SECONDS = float(os.environ.get("INGEST_WRITER_RETRY_SECONDS", "5"))
+
+INGEST_ROLES = ("auto", "reader")
+
+
+class WriterLock:
+    """
+    Elects a single writer among the processes that share the vector store,
+    with an exclusive advisory lock (flock) on a file.
+
+    The lock-holding process is the only one that stores invoices, compacts
+    the store and runs upload jobs; the others are read replicas that answer
+    chatbot queries and queue uploads for the writer. The operating system
+    releases the lock when the writer exits, however it exits, and a replica
+    retrying in the background takes over.
+    """
+
+    def __init__(self, path: str, role: str = INGEST_ROLE):
+        if role not in INGEST_ROLES:
+            raise ValueError(f"INGEST_ROLE must be one of {', '.join(INGEST_ROLES)}, not '{role}'.")
+        self.path = path
+        self.role = role
+        self._lock = threading.Lock()
+        self._file = None
+        self._retry: Optional[asyncio.Task] = None
+
+    @property
+    def is_writer(self) -> bool:
+        return self._file is not None
+
+    def try_acquire(self) -> bool:
+        """
+        Takes the writer lock if no other process holds it. Never blocks.
+
+        Returns:
+            bool: Whether this process is now the writer.
+        """
+        if self.role == "reader":
+            return False
+        with self._lock:
+            if self._file is not None:
+                return True
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            lock_file = open(self.path, "a+")
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    lock_file.close()
+                    return False
+            # Record the holder, for holder_pid() in the other processes
+            lock_file.seek(0)
+            lock_file.truncate()
+            lock_file.write(str(os.getpid()))
+            lock_file.flush()
+            self._file = lock_file
+            return True
+
+    def release(self):
+        """
+        Gives up the writer lock (it is also released when the process exits).
+        """
+        with self._lock:
+            if self._file is not None:
+                if fcntl is not None:
+                    fcntl.flock(self._file, fcntl.LOCK_UN)
+                self._file.close()
+                self._file = None
+
+    def holder_pid(self) -> Optional[int]:
+        """
+        Returns the process ID of the writer, if it is still running.
+        """
+        if fcntl is None:
+            return os.getpid() if self.is_writer else None
+        try:
+            with open(self.path) as f:
+                pid = int(f.read().strip() or 0)
+            if pid:
+                os.kill(pid, 0)
+                return pid
+        except PermissionError:
+            return pid
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def stats(self) -> Dict:
+        return {"role": self.role, "writer": self.is_writer, "writer_pid": self.holder_pid()}
+
+    async def start(self):
+        """
+        Tries to become the writer and, if another process holds the lock,
+        keeps retrying in the background. Call from the app lifespan.
+        """
+        if not await asyncio.to_thread(self.try_acquire) and self.role != "reader":
+            self._retry = asyncio.create_task(self._retry_loop())
+
+    async def stop(self):
+        """
+        Stops retrying and releases the lock.
+        """
+        if self._retry is not None:
+            self._retry.cancel()
+            await asyncio.gather(self._retry, return_exceptions=True)
+            self._retry = None
+        self.release()
+
+    async def _retry_loop(self):
+        while not self.is_writer:
+            await asyncio.sleep(INGEST_WRITER_RETRY_SECONDS)
+            try:
+                if await asyncio.to_thread(self.try_acquire):
+                    print(f"Process {os.getpid()} took over as the ingest writer.")
+            except Exception as e:
+                print(f"Warning: Could not take the ingest writer lock: {e}")
+
+
+# Shared writer election for this process
+ingest_writer = WriterLock(INGEST_WRITER_LOCK)
+
+
+def require_writer(command: str):
+    """
+    Takes the writer lock for a command-line tool, or exits if another process
+    (e.g. an API worker) is the writer.
+    """
+    if not ingest_writer.try_acquire():
+        holder = ingest_writer.holder_pid()
+        sys.exit(
+            f"{command}: another process{f' (pid {holder})' if holder else ''} is writing the vector store. "
+            f"Stop it, or run the API with INGEST_ROLE=reader, and try again."
+        )
+
+
+async def serve():
+    """
+    Runs a dedicated writer: waits for the writer lock, then processes the
+    upload jobs queued by the API's read replicas until interrupted.
+    """
+    from app.core.jobs import job_manager
+    from app.core.upload_storage import upload_storage
+    from app.core.vector_store import backfill_invoice_index, backfill_lexical_index
+
+    if not await asyncio.to_thread(ingest_writer.try_acquire):
+        print(f"Waiting for the ingest writer lock (held by pid {ingest_writer.holder_pid()}) ...")
+        while not await asyncio.to_thread(ingest_writer.try_acquire):
+            await asyncio.sleep(INGEST_WRITER_RETRY_SECONDS)
+
+    await asyncio.to_thread(backfill_invoice_index)
+    await asyncio.to_thread(backfill_lexical_index)
+    await upload_storage.start()
+    await job_manager.start()
+    print(f"Ingest writer running (pid {os.getpid()}); processing queued upload jobs.")
+
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stopped.set)
+        except NotImplementedError:  # Windows: Ctrl+C interrupts asyncio.run instead
+            pass
+    try:
+        await stopped.wait()
+    finally:
+        await job_manager.stop()
+        await upload_storage.stop()
+        ingest_writer.release()
+
+
+def main(argv: Optional[list] = None):
+    """
+    Command-line entry point: run the single writer next to API workers started with INGEST_ROLE=reader.
+
+    Example:
+        INGEST_ROLE=reader uvicorn main:app --workers 4 &
+        python -m app.core.ingest_writer
+    """
+    import argparse
+    from app.utils.pdf_pool import shutdown_pdf_pool
+
+    argparse.ArgumentParser(description="Run the single vector store writer and upload job processor.").parse_args(argv)
+    if ingest_writer.role == "reader":
+        sys.exit("The ingest writer cannot run with INGEST_ROLE=reader.")
+    try:
+        asyncio.run(serve())
+    finally:
+        shutdown_pdf_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+from app.core.config import CACHE_DIR
+
+# Maximum rows listed in an index-answered chatbot reply
+INVOICE_INDEX_LIST_LIMIT = int(os.environ.get("INVOICE_INDEX_LIST_LIMIT", "50"))
+
+# Filters understood by InvoiceIndex.query and InvoiceIndex.aggregate
+INDEX_FILTER_KEYS = (
+    "employee_name", "status", "policy_id", "date", "date_from", "date_to", "month", "min_amount", "max_amount",
+    "vendor", "category", "currency"
+)
+
+# Fields extracted from the invoice text (see extract_invoice_fields), stored next to the verdict
+EXTRACTED_COLUMNS = ("vendor", "category", "currency", "invoice_number")
+
+
+def filter_conditions(filters: Dict) -> Tuple[List[str], List]:
+    """
+    Translates chatbot-style filters into SQL conditions and their parameters,
+    for tables with employee_name, status, policy_id, date, amount, vendor,
+    category and currency columns.
+    Dates are compared as ISO strings (YYYY-MM-DD), which sort chronologically;
+    month ("01".."12") matches that month in any year.
+    """
+    conditions, params = [], []
+    for key, value in filters.items():
+        if value is None or value == "":
+            continue
+        if key in ("employee_name", "vendor"):
+            conditions.append(f"{key} = ? COLLATE NOCASE")
+        elif key in ("status", "policy_id", "category", "currency"):
+            conditions.append(f"{key} = ?")
+        elif key == "date":
+            conditions.append("date = ?")
+        elif key == "date_from":
+            conditions.append("date >= ?")
+        elif key == "date_to":
+            conditions.append("date <= ?")
+        elif key == "month":
+            conditions.append("substr(date, 6, 2) = ?")
+        elif key == "min_amount":
+            conditions.append("amount >= ?")
+        elif key == "max_amount":
+            conditions.append("amount <= ?")
+        else:
+            continue
+        params.append(value)
+    return conditions, params
+
+
+def _where_clause(filters: Dict) -> Tuple[str, List]:
+    conditions, params = filter_conditions(filters)
+    return (" WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+
+class InvoiceIndex:
+    """
+    Structured index of analyzed invoices, kept in SQLite next to the vector store.
+
+    Holds one row per stored invoice (keyed by its deterministic vector store
+    ID, see make_invoice_doc_id) with the verdict and the fields extracted from
+    the invoice text (date, amount, vendor, ...), so filter-only and
+    aggregation questions (counts, sums, "list all") are answered with indexed
+    SQL over every matching row instead of a top-k similarity search.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Databases created before rows were keyed by document ID held one row per
+            # (employee, file name); they are rebuilt by backfill_invoice_index
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(invoices)")]
+            if columns and "doc_id" not in columns:
+                conn.execute("DROP TABLE invoices")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS invoices (
+                    doc_id TEXT PRIMARY KEY,
+                    employee_name TEXT NOT NULL,
+                    invoice_file TEXT NOT NULL,
+                    policy_id TEXT,
+                    status TEXT NOT NULL,
+                    reason TEXT,
+                    date TEXT,
+                    amount REAL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            # Databases created before the extracted fields were recorded
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(invoices)")]
+            for column in EXTRACTED_COLUMNS:
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE invoices ADD COLUMN {column} TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_employee ON invoices (employee_name COLLATE NOCASE)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_status ON invoices (status)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_date ON invoices (date)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_amount ON invoices (amount)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_vendor ON invoices (vendor COLLATE NOCASE)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def add_many(self, metadatas: List[Dict]):
+        """
+        Records (or replaces) the invoices described by vector store metadata.
+
+        Args:
+            metadatas (List[dict]): Metadata as stored with each invoice embedding,
+                including the invoice's doc_id.
+        """
+        now = time.time()
+        rows = [
+            (
+                metadata["doc_id"],
+                metadata["employee_name"],
+                metadata["invoice_file"],
+                metadata.get("policy_id"),
+                metadata["status"],
+                metadata.get("reason"),
+                (metadata.get("date") or "")[:10] or None,
+                metadata.get("amount"),
+                *(metadata.get(column) for column in EXTRACTED_COLUMNS),
+                now
+            )
+            for metadata in metadatas
+            if metadata.get("doc_id") and metadata.get("employee_name") and metadata.get("invoice_file")
+            and metadata.get("status")
+        ]
+        if not rows:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.executemany(
+                "INSERT OR REPLACE INTO invoices "
+                "(doc_id, employee_name, invoice_file, policy_id, status, reason, date, amount, "
+                "vendor, category, currency, invoice_number, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.commit()
+
+    def query(self, filters: Dict, limit: Optional[int] = None) -> List[Dict]:
+        """
+        Returns the invoices matching the filters, newest first.
+
+        Args:
+            filters (dict): Any of INDEX_FILTER_KEYS.
+            limit (int, optional): Maximum number of rows.
+
+        Returns:
+            List[dict]: One dict per invoice.
+        """
+        where, params = _where_clause(filters)
+        sql = (
+            "SELECT employee_name, invoice_file, policy_id, status, reason, date, amount, "
+            "vendor, category, currency, invoice_number FROM invoices"
+            f"{where} ORDER BY date DESC, invoice_file"
+        )
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._connect().execute(sql, params).fetchall()
+        keys = ("employee_name", "invoice_file", "policy_id", "status", "reason", "date", "amount", *EXTRACTED_COLUMNS)
+        return [dict(zip(keys, row)) for row in rows]
+
+    def aggregate(self, filters: Dict) -> Dict:
+        """
+        Counts and sums the invoices matching the filters.
+
+        Returns:
+            dict: count, total_amount (over invoices with a known amount),
+            count_without_amount and per-status count/amount.
+        """
+        where, params = _where_clause(filters)
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute(
+                f"SELECT status, COUNT(*), SUM(amount), COUNT(amount) FROM invoices{where} GROUP BY status",
+                params
+            ).fetchall()
+        by_status = {
+            status: {"count": count, "total_amount": round(total or 0.0, 2)}
+            for status, count, total, _ in rows
+        }
+        count = sum(row[1] for row in rows)
+        with_amount = sum(row[3] for row in rows)
+        return {
+            "count": count,
+            "total_amount": round(sum(row[2] or 0.0 for row in rows), 2),
+            "count_without_amount": count - with_amount,
+            "by_status": by_status
+        }
+
+    def employee_names(self) -> List[str]:
+        """
+        Returns every employee name in the index.
+        """
+        with self._lock:
+            rows = self._connect().execute("SELECT DISTINCT employee_name FROM invoices").fetchall()
+        return [row[0] for row in rows]
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._connect().execute("SELECT 1 FROM invoices LIMIT 1").fetchone() is None
+
+
+# Shared index, filled in by store_invoice_embeddings
+invoice_index = InvoiceIndex(os.path.join(CACHE_DIR, "invoice_index.sqlite3"))
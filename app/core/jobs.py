@@ -0,0 +1,418 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import zipfile
+import threading
+from uuid import uuid4
+from typing import Dict, List, Optional, Set
+from app.core.config import CACHE_DIR
+from app.core.ingest_writer import ingest_writer
+from app.core.pipeline import run_invoice_pipeline, sources_from_zip
+from app.core.policy_registry import policy_registry
+from app.core.upload_storage import upload_storage
+
+# Number of upload sessions processed at the same time in job mode
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+
+# How often the writer picks up jobs queued by other processes, and read replicas check on job progress
+JOB_POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", "1"))
+
+# How long an upload handed to the writer waits for its job before the request gives up (the job keeps going)
+JOB_WAIT_TIMEOUT_SECONDS = float(os.environ.get("JOB_WAIT_TIMEOUT_SECONDS", "300"))
+
+# Job lifecycle states
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+FINISHED_STATES = (JOB_COMPLETED, JOB_FAILED)
+
+
+class JobNotFoundError(LookupError):
+    """
+    Raised when a job no longer exists (e.g. it was deleted while being waited on).
+    """
+
+
+class JobWaitTimeoutError(TimeoutError):
+    """
+    Raised when a job does not finish within the time a caller waits for it.
+    """
+
+
+class JobStore:
+    """
+    Persists upload jobs and their per-invoice results in SQLite,
+    so that job state survives a server restart.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    employee_name TEXT NOT NULL,
+                    policy_id TEXT NOT NULL,
+                    zip_path TEXT NOT NULL,
+                    session_id TEXT,
+                    batch_mode INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    total INTEGER,
+                    error TEXT,
+                    unchanged INTEGER,
+                    timings TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_results (
+                    job_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    invoice_file TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    reason TEXT NOT NULL,
+                    decision_path TEXT,
+                    PRIMARY KEY (job_id, invoice_file)
+                )
+            """)
+            # Databases created before decision_path was recorded
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(job_results)")]
+            if "decision_path" not in columns:
+                conn.execute("ALTER TABLE job_results ADD COLUMN decision_path TEXT")
+            # Databases created before uploads were tracked as sessions
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+            if "session_id" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN session_id TEXT")
+            # Databases created before unchanged invoices were counted
+            if "unchanged" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN unchanged INTEGER")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def create(
+        self, employee_name: str, policy_id: str, zip_path: str, batch_mode: bool, session_id: Optional[str] = None
+    ) -> str:
+        """
+        Records a new queued job and returns its ID.
+        """
+        job_id = str(uuid4())
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT INTO jobs (job_id, employee_name, policy_id, zip_path, session_id, batch_mode, status, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, employee_name, policy_id, zip_path, session_id, int(batch_mode), JOB_QUEUED, now, now)
+            )
+            conn.commit()
+        return job_id
+
+    def update(self, job_id: str, **fields):
+        """
+        Updates columns of a job (status, total, error, unchanged, timings).
+        """
+        if "timings" in fields:
+            fields["timings"] = json.dumps(fields["timings"])
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        with self._lock:
+            conn = self._connect()
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+            conn.commit()
+
+    def add_result(self, job_id: str, invoice_file: str, analysis: Dict):
+        """
+        Records the result of one invoice. A result that replaces an earlier one
+        (e.g. a retried failure) gets a new sequence number, so event streams send it.
+        """
+        with self._lock:
+            conn = self._connect()
+            seq = conn.execute(
+                "SELECT COALESCE(MAX(seq), -1) + 1 FROM job_results WHERE job_id = ?", (job_id,)
+            ).fetchone()[0]
+            conn.execute(
+                "INSERT OR REPLACE INTO job_results (job_id, seq, invoice_file, status, reason, decision_path) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, seq, invoice_file, analysis["status"], analysis["reason"], analysis.get("decision_path"))
+            )
+            conn.commit()
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """
+        Returns a job record, or None if the job does not exist.
+        """
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT job_id, employee_name, policy_id, zip_path, session_id, batch_mode, status, total, error, "
+                "unchanged, timings, created_at, updated_at FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("job_id", "employee_name", "policy_id", "zip_path", "session_id", "batch_mode", "status", "total",
+                "error", "unchanged", "timings", "created_at", "updated_at")
+        job = dict(zip(keys, row))
+        job["batch_mode"] = bool(job["batch_mode"])
+        job["timings"] = json.loads(job["timings"]) if job["timings"] else None
+        # Jobs created before sessions were recorded: the ZIP sits in its session's folder
+        job["session_id"] = job["session_id"] or os.path.basename(os.path.dirname(job["zip_path"]))
+        return job
+
+    def results(self, job_id: str, after: int = -1) -> List[Dict]:
+        """
+        Returns the results of a job in completion order, optionally only those after a sequence number.
+        """
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT seq, invoice_file, status, reason, decision_path FROM job_results "
+                "WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, after)
+            ).fetchall()
+        return [
+            {"seq": seq, "invoice_file": invoice_file, "status": status, "reason": reason, "decision_path": path}
+            for seq, invoice_file, status, reason, path in rows
+        ]
+
+    def unfinished(self) -> List[str]:
+        """
+        Returns the IDs of jobs that were queued or running, oldest first.
+        """
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT job_id FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (JOB_QUEUED, JOB_RUNNING)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+class JobManager:
+    """
+    Runs upload jobs on a pool of background workers.
+
+    Jobs are persisted in a JobStore; on start-up any job that was queued or
+    still running when the server stopped is queued again, and invoices that
+    already have a result (other than Error) are not processed a second time.
+    A job's upload session is deleted once the job completes or fails.
+
+    Only the ingest writer (see app.core.ingest_writer) runs jobs: it also
+    picks up, every JOB_POLL_SECONDS, the jobs that read replicas persisted,
+    and the jobs left unfinished by a writer that exited.
+    """
+
+    def __init__(self, store: JobStore, workers: int = JOB_WORKERS):
+        self.store = store
+        self.workers = max(1, workers)
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._updates: Dict[str, asyncio.Event] = {}
+        # Jobs queued in this process and not yet finished
+        self._claimed: Set[str] = set()
+
+    async def start(self):
+        """
+        Starts the workers and re-queues unfinished jobs. Call from the app lifespan.
+        """
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        await self._claim_jobs()
+        self._tasks.append(asyncio.create_task(self._poll_loop()))
+
+    async def stop(self):
+        """
+        Stops the workers. Interrupted jobs stay "running" and are resumed on next start.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._claimed.clear()
+
+    async def _claim_jobs(self):
+        """
+        Queues the unfinished jobs not yet queued here, if this process is the writer.
+        """
+        if not ingest_writer.is_writer:
+            return
+        for job_id in await asyncio.to_thread(self.store.unfinished):
+            if job_id in self._claimed:
+                continue
+            self._claimed.add(job_id)
+            # Keep the job's uploaded files from being swept while it waits
+            job = await asyncio.to_thread(self.store.get, job_id)
+            await asyncio.to_thread(upload_storage.acquire, job["session_id"])
+            self._queue.put_nowait(job_id)
+
+    async def _poll_loop(self):
+        while True:
+            await asyncio.sleep(JOB_POLL_SECONDS)
+            try:
+                await self._claim_jobs()
+            except Exception as e:
+                print(f"Warning: Could not pick up queued jobs: {e}")
+
+    async def submit(
+        self,
+        employee_name: str,
+        policy_id: str,
+        zip_path: str,
+        batch_mode: bool = False,
+        session_id: Optional[str] = None
+    ) -> str:
+        """
+        Persists a new job and queues it for the workers.
+        The upload session holding the ZIP is deleted when the job finishes.
+
+        In a read replica the job is only persisted; the writer picks it up.
+
+        Returns:
+            str: The job ID.
+        """
+        if self._queue is None:
+            raise RuntimeError("The job manager has not been started.")
+        job_id = await asyncio.to_thread(
+            self.store.create, employee_name, policy_id, zip_path, batch_mode, session_id
+        )
+        if ingest_writer.is_writer:
+            if job_id not in self._claimed:
+                self._claimed.add(job_id)
+                self._queue.put_nowait(job_id)
+        elif session_id is not None:
+            # The session stays protected (by its holder) until the writer acquires it
+            upload_storage.release(session_id)
+        return job_id
+
+    async def wait_for_update(self, job_id: str, timeout: float):
+        """
+        Waits until the job records a new result or changes state, or until the timeout.
+        Jobs run by another process are not signalled, so their state is polled.
+        """
+        if job_id not in self._claimed:
+            timeout = min(timeout, JOB_POLL_SECONDS)
+        event = self._updates.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def wait_for_result(self, job_id: str, timeout: float = JOB_WAIT_TIMEOUT_SECONDS) -> Dict:
+        """
+        Waits for a job to finish, e.g. an upload a read replica handed to the writer.
+
+        Args:
+            job_id (str): The job to wait for.
+            timeout (float): Seconds to wait before giving up; the job itself keeps going.
+
+        Returns:
+            dict: The job's results, shaped like run_invoice_pipeline's.
+
+        Raises:
+            RuntimeError: If the job failed.
+            JobNotFoundError: If the job no longer exists.
+            JobWaitTimeoutError: If the job did not finish in time (e.g. no writer is running).
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = await asyncio.to_thread(self.store.get, job_id)
+            if job is None:
+                raise JobNotFoundError(f"Job {job_id} no longer exists.")
+            if job["status"] in FINISHED_STATES:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise JobWaitTimeoutError(f"Job {job_id} did not finish within {timeout:g} seconds.")
+            await self.wait_for_update(job_id, min(JOB_POLL_SECONDS, remaining))
+        if job["status"] == JOB_FAILED:
+            raise RuntimeError(job["error"])
+
+        results = await asyncio.to_thread(self.store.results, job_id)
+        return {
+            "num_invoices": len(results),
+            "num_unchanged": job["unchanged"] or 0,
+            "analysis_results": {
+                result["invoice_file"]: {
+                    "status": result["status"], "reason": result["reason"], "decision_path": result["decision_path"]
+                }
+                for result in results
+            },
+            "timings": job["timings"]
+        }
+
+    def _notify(self, job_id: str):
+        event = self._updates.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+                await self._finish_session(job_id)
+            except Exception as e:
+                await asyncio.to_thread(self.store.update, job_id, status=JOB_FAILED, error=str(e))
+                await self._finish_session(job_id)
+            finally:
+                self._claimed.discard(job_id)
+                self._notify(job_id)
+                self._queue.task_done()
+
+    async def _finish_session(self, job_id: str):
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is not None and job["status"] in FINISHED_STATES:
+            try:
+                await asyncio.to_thread(upload_storage.finish, job["session_id"])
+            except Exception as e:
+                print(f"Warning: Could not delete the uploaded files of job {job_id}: {e}")
+
+    async def _run(self, job_id: str):
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is None or job["status"] in FINISHED_STATES:
+            return
+
+        policy = await asyncio.to_thread(policy_registry.get, job["policy_id"])
+        if policy is None:
+            raise ValueError(f"Unknown policy ID: {job['policy_id']}")
+
+        # Invoices finished before a restart are not analyzed again; failed ones are retried
+        done = {
+            result["invoice_file"] for result in await asyncio.to_thread(self.store.results, job_id)
+            if result["status"] != "Error"
+        }
+
+        async def record(filename: str, analysis: Dict):
+            await asyncio.to_thread(self.store.add_result, job_id, filename, analysis)
+            self._notify(job_id)
+
+        with await asyncio.to_thread(zipfile.ZipFile, job["zip_path"]) as zip_ref:
+            invoices = sources_from_zip(zip_ref)
+            await asyncio.to_thread(self.store.update, job_id, status=JOB_RUNNING, total=len(invoices))
+            self._notify(job_id)
+
+            pipeline_result = await run_invoice_pipeline(
+                job["employee_name"],
+                policy,
+                [source for source in invoices if source[0] not in done],
+                batch_mode=job["batch_mode"],
+                on_result=record
+            )
+
+        # PDFs without extractable text get no result, so the final total only counts parsed invoices
+        await asyncio.to_thread(
+            self.store.update, job_id, status=JOB_COMPLETED, total=len(done) + pipeline_result["num_invoices"],
+            unchanged=pipeline_result["num_unchanged"], timings=pipeline_result["timings"]
+        )
+
+
+# Shared job manager, started and stopped by the FastAPI lifespan
+job_manager = JobManager(JobStore(os.path.join(CACHE_DIR, "jobs.sqlite3")))
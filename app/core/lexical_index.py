@@ -0,0 +1,226 @@
+import os
+import re
+import json
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+from langchain_core.documents import Document
+from app.core.config import CACHE_DIR
+from app.core.invoice_index import filter_conditions
+
+# Combine vector search results with keyword (BM25) matches in the chatbot
+LEXICAL_SEARCH_ENABLED = os.environ.get("LEXICAL_SEARCH_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Invoice numbers, amounts and dates in a question: words with at least 4 characters including a digit
+_IDENTIFIER_PATTERN = re.compile(r"[A-Za-z0-9#][\w#/.\-]*\d[\w#/.\-]*")
+# Years restricting a period ("in 2024", "during 2023", "March 2024"), as opposed to amounts such as "2000"
+_YEAR_PATTERN = re.compile(
+    r"\b(?:in|during|since|year|(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?)\s+((?:19|20)\d\d)\b",
+    re.IGNORECASE
+)
+_TERM_PATTERN = re.compile(r"\w+")
+# Extracted invoice fields that filters can refer to (see filter_conditions)
+_FILTER_COLUMNS = ("vendor", "category", "currency")
+# Words too common in chatbot questions to say anything about an invoice (also used by app.core.rag_context)
+STOP_WORDS = {
+    "the", "and", "for", "are", "was", "were", "what", "which", "who", "whom", "with", "from", "that", "this",
+    "have", "has", "did", "does", "how", "why", "any", "all", "his", "her", "their", "its", "about", "been",
+    "invoice", "invoices", "show", "tell", "give", "list", "is", "of", "in", "on", "to", "a", "an", "me"
+}
+
+
+def _quote(phrase: str) -> str:
+    """
+    Quotes text as an FTS5 phrase, so it is matched as consecutive tokens and
+    punctuation in it is never read as query syntax.
+    """
+    return '"' + phrase.replace('"', '""') + '"'
+
+
+def find_identifiers(query: str) -> List[str]:
+    """
+    Returns the identifier-like words of a question (invoice numbers, amounts,
+    dates), which embeddings match poorly. Years after a date word ("in 2024",
+    "March 2024") are left out, as they restrict a period rather than name an
+    invoice.
+    """
+    years = set(_YEAR_PATTERN.findall(query))
+    identifiers = []
+    for match in _IDENTIFIER_PATTERN.findall(query):
+        word = match.rstrip(".-/")
+        if len(word) >= 4 and word not in years and word not in identifiers:
+            identifiers.append(word)
+    return identifiers
+
+
+class LexicalIndex:
+    """
+    Keyword index of the documents in the vector store, kept in SQLite (FTS5)
+    next to it and updated together with it.
+
+    Ranks documents with BM25, so exact tokens such as invoice numbers,
+    vendor names and amounts are found even when embeddings blur them, and
+    answers identifier lookups without embedding the question. Each row also
+    holds the document's metadata, so results can be filtered like the
+    vector search and returned as Documents.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    rowid INTEGER PRIMARY KEY,
+                    doc_id TEXT NOT NULL UNIQUE,
+                    body TEXT NOT NULL,
+                    metadata TEXT NOT NULL,
+                    employee_name TEXT,
+                    status TEXT,
+                    policy_id TEXT,
+                    date TEXT,
+                    amount REAL,
+                    vendor TEXT,
+                    category TEXT,
+                    currency TEXT
+                )
+            """)
+            # Databases created before the extracted fields could be filtered on
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(documents)")]
+            for column in _FILTER_COLUMNS:
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE documents ADD COLUMN {column} TEXT")
+            # The full-text index reads document bodies from the table above; triggers keep it in sync
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5("
+                "body, content='documents', content_rowid='rowid')"
+            )
+            conn.executescript("""
+                CREATE TRIGGER IF NOT EXISTS documents_ai AFTER INSERT ON documents BEGIN
+                    INSERT INTO documents_fts (rowid, body) VALUES (new.rowid, new.body);
+                END;
+                CREATE TRIGGER IF NOT EXISTS documents_ad AFTER DELETE ON documents BEGIN
+                    INSERT INTO documents_fts (documents_fts, rowid, body) VALUES ('delete', old.rowid, old.body);
+                END;
+                CREATE TRIGGER IF NOT EXISTS documents_au AFTER UPDATE ON documents BEGIN
+                    INSERT INTO documents_fts (documents_fts, rowid, body) VALUES ('delete', old.rowid, old.body);
+                    INSERT INTO documents_fts (rowid, body) VALUES (new.rowid, new.body);
+                END;
+            """)
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def add_many(self, ids: List[str], texts: List[str], metadatas: List[Dict]):
+        """
+        Indexes (or re-indexes) documents under their vector store IDs.
+
+        Args:
+            ids (List[str]): Vector store document IDs.
+            texts (List[str]): Document texts.
+            metadatas (List[dict]): Document metadata, in the same order.
+        """
+        rows = [
+            (
+                doc_id,
+                # The file name is searchable too (e.g. "hotel_0123.pdf")
+                f"{text}\n{metadata.get('invoice_file', '')}",
+                json.dumps(metadata),
+                metadata.get("employee_name"),
+                metadata.get("status"),
+                metadata.get("policy_id"),
+                (metadata.get("date") or "")[:10] or None,
+                metadata.get("amount"),
+                *(metadata.get(column) for column in _FILTER_COLUMNS)
+            )
+            for doc_id, text, metadata in zip(ids, texts, metadatas)
+        ]
+        if not rows:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.executemany(
+                "INSERT INTO documents (doc_id, body, metadata, employee_name, status, policy_id, date, amount, "
+                "vendor, category, currency) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (doc_id) DO UPDATE SET "
+                "body = excluded.body, metadata = excluded.metadata, employee_name = excluded.employee_name, "
+                "status = excluded.status, policy_id = excluded.policy_id, date = excluded.date, "
+                "amount = excluded.amount, vendor = excluded.vendor, category = excluded.category, "
+                "currency = excluded.currency",
+                rows
+            )
+            conn.commit()
+
+    def delete(self, ids: List[str]):
+        """
+        Removes documents from the index.
+        """
+        with self._lock:
+            conn = self._connect()
+            conn.executemany("DELETE FROM documents WHERE doc_id = ?", [(doc_id,) for doc_id in ids])
+            conn.commit()
+
+    def search(self, query: str, filters: Dict, k: int) -> List[Document]:
+        """
+        Returns the documents matching any of the question's terms, best BM25 score first.
+
+        Args:
+            query (str): User's question.
+            filters (dict): Chatbot filters (employee_name, status, date, date_from, date_to).
+            k (int): Maximum number of documents.
+
+        Returns:
+            List[Document]: Matching documents, with their vector store IDs.
+        """
+        terms = [
+            term for term in dict.fromkeys(_TERM_PATTERN.findall(query.lower()))
+            if term not in STOP_WORDS and len(term) > 1
+        ]
+        phrases = [_quote(identifier) for identifier in find_identifiers(query)]
+        if not terms and not phrases:
+            return []
+        return self._match(" OR ".join(phrases + [_quote(term) for term in terms]), filters, k)
+
+    def exact_matches(self, query: str, filters: Dict, k: int) -> Optional[List[Document]]:
+        """
+        Looks up the documents containing every identifier (invoice number,
+        amount, date) mentioned in the question.
+
+        Returns:
+            Optional[List[Document]]: The matching documents, best first; None
+            if the question mentions no identifier or nothing matches.
+        """
+        identifiers = find_identifiers(query)
+        if not identifiers:
+            return None
+        return self._match(" AND ".join(_quote(identifier) for identifier in identifiers), filters, k) or None
+
+    def _match(self, expression: str, filters: Dict, k: int) -> List[Document]:
+        conditions, params = filter_conditions(filters)
+        where = "".join(f" AND {condition}" for condition in conditions)
+        sql = (
+            "SELECT documents.doc_id, documents.body, documents.metadata FROM documents_fts "
+            "JOIN documents ON documents.rowid = documents_fts.rowid "
+            f"WHERE documents_fts MATCH ?{where} ORDER BY bm25(documents_fts) LIMIT ?"
+        )
+        with self._lock:
+            rows = self._connect().execute(sql, [expression, *params, k]).fetchall()
+        return [
+            # Drop the searchable file name appended in add_many
+            Document(page_content=body.rsplit("\n", 1)[0], metadata=json.loads(metadata), id=doc_id)
+            for doc_id, body, metadata in rows
+        ]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+
+# Shared index, filled in by store_invoice_embeddings
+lexical_index = LexicalIndex(os.path.join(CACHE_DIR, "lexical_index.sqlite3"))
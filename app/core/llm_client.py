@@ -0,0 +1,466 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from typing import AsyncIterator, List, Optional, Tuple
+from app.core.providers import get_llm
+from app.core.metrics import (
+    span, record_llm_usage, llm_retries, llm_throttled, llm_concurrency_limit, llm_circuit_open
+)
+
+# Provider quota: requests and tokens per minute (0 = unlimited)
+LLM_REQUESTS_PER_MINUTE = float(os.environ.get("LLM_REQUESTS_PER_MINUTE", "1000"))
+LLM_TOKENS_PER_MINUTE = float(os.environ.get("LLM_TOKENS_PER_MINUTE", "1000000"))
+
+# Retries with jittered exponential backoff
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE_SECONDS = float(os.environ.get("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.environ.get("LLM_BACKOFF_MAX_SECONDS", "30"))
+
+# Circuit breaker: open after this many consecutive failures, try again after the cool-down
+LLM_CIRCUIT_FAILURES = int(os.environ.get("LLM_CIRCUIT_FAILURES", "5"))
+LLM_CIRCUIT_RESET_SECONDS = float(os.environ.get("LLM_CIRCUIT_RESET_SECONDS", "30"))
+
+# Adaptive concurrency: grows while calls are fast, halves on 429s, shrinks when calls get slow
+LLM_INITIAL_CONCURRENCY = int(os.environ.get("LLM_INITIAL_CONCURRENCY", "8"))
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "32"))
+LLM_TARGET_LATENCY_SECONDS = float(os.environ.get("LLM_TARGET_LATENCY_SECONDS", "10"))
+
+# Output tokens reserved per call before the real usage is known
+LLM_EXPECTED_OUTPUT_TOKENS = 256
+
+# Error text that identifies provider throttling and requests that will never succeed
+_RATE_LIMIT_MARKERS = ("429", "resourceexhausted", "resource_exhausted", "rate limit", "quota")
+_PERMANENT_MARKERS = ("invalidargument", "invalid_argument", "permissiondenied", "unauthenticated",
+                      "api key not valid", "notfound", "400 ", "401 ", "403 ", "404 ")
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised instead of calling the LLM while the circuit breaker is open.
+    """
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    text = f"{type(error).__name__} {error}".lower()
+    return any(marker in text for marker in _RATE_LIMIT_MARKERS)
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """
+    Rate limits and transient failures are retried; invalid requests and auth errors are not.
+    """
+    if isinstance(error, (CircuitOpenError, ValueError, TypeError)):
+        return False
+    if is_rate_limit_error(error):
+        return True
+    text = f"{type(error).__name__} {error}".lower()
+    return not any(marker in text for marker in _PERMANENT_MARKERS)
+
+
+def estimate_tokens(messages) -> int:
+    """
+    Rough token count of a prompt (about 4 characters per token).
+    """
+    return sum(len(str(getattr(message, "content", message))) for message in messages) // 4 + 1
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at rate_per_minute, holding at most one minute of budget.
+
+    reserve() always succeeds and returns how long the caller must wait before
+    using what it reserved, so waiting callers queue up fairly.
+    """
+
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def adjust(self, amount: float):
+        """
+        Returns (positive) or charges (negative) tokens once the real usage is known.
+        """
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class CircuitBreaker:
+    """
+    Stops calls after repeated failures, then lets a single trial call through
+    after reset_seconds; a success closes the circuit again.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_seconds else "open"
+
+    def before_call(self):
+        with self._lock:
+            state = self.state
+            if state == "open" or (state == "half_open" and self._trial_running):
+                raise CircuitOpenError("LLM circuit breaker is open after repeated failures; try again later.")
+            if state == "half_open":
+                self._trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+        llm_circuit_open.set(0)
+
+    def record_abandoned(self):
+        """
+        A call was cancelled before the provider answered: frees the half-open
+        trial without counting a failure, so another call can try.
+        """
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+        if self.opened_at is not None:
+            llm_circuit_open.set(1)
+
+
+class AdaptiveConcurrency:
+    """
+    Limits concurrent LLM calls with an AIMD limit: +1 per limit's worth of fast
+    successes, halved on a 429, and reduced by 10% when calls exceed the target latency.
+
+    Threads wait on a condition (acquire); coroutines wait on a future that
+    release() resolves (acquire_async), so a cancelled coroutine holds no slot
+    and never parks a worker thread.
+    """
+
+    def __init__(self, initial: int, maximum: int, target_latency: float):
+        self.maximum = max(1, maximum)
+        self.limit = float(min(max(1, initial), self.maximum))
+        self.target_latency = target_latency
+        self.in_flight = 0
+        self._condition = threading.Condition()
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        llm_concurrency_limit.set(self.limit)
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def try_acquire(self) -> bool:
+        """
+        Takes a slot if one is free, without waiting.
+        """
+        with self._condition:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    async def acquire_async(self):
+        """
+        Takes a slot without blocking the event loop. The slot is only taken
+        once one is free, so cancelling the wait leaves nothing to release.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                waiter = (loop, loop.create_future())
+                self._async_waiters.append(waiter)
+            try:
+                await waiter[1]
+            finally:
+                with self._condition:
+                    if waiter in self._async_waiters:
+                        self._async_waiters.remove(waiter)
+
+    def release(self, latency: Optional[float] = None, throttled: bool = False):
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1.0, self.limit / 2)
+            elif latency is not None and latency > self.target_latency:
+                self.limit = max(1.0, self.limit * 0.9)
+            elif latency is not None:
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            llm_concurrency_limit.set(int(self.limit))
+            self._condition.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        # Every waiting coroutine re-checks for a free slot (release may run in another thread)
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:  # The waiter's event loop is closed
+                pass
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class LLMClient:
+    """
+    Shared wrapper around the chat model used by the analyzer and the chatbot.
+
+    Every call passes through request and token buckets (the provider quota),
+    the adaptive concurrency limit and the circuit breaker. Rate-limit and
+    transient errors are retried with jittered exponential backoff.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = LLM_TOKENS_PER_MINUTE,
+        max_retries: int = LLM_MAX_RETRIES,
+        backoff_base: float = LLM_BACKOFF_BASE_SECONDS,
+        backoff_max: float = LLM_BACKOFF_MAX_SECONDS
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.circuit = CircuitBreaker(LLM_CIRCUIT_FAILURES, LLM_CIRCUIT_RESET_SECONDS)
+        self.concurrency = AdaptiveConcurrency(LLM_INITIAL_CONCURRENCY, LLM_MAX_CONCURRENCY, LLM_TARGET_LATENCY_SECONDS)
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Seconds to wait before retry number attempt (1-based), with full jitter.
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    def _admit(self, messages) -> Tuple[int, float]:
+        """
+        Charges the buckets for one call and returns the tokens reserved and the wait needed.
+        """
+        reserved = estimate_tokens(messages) + LLM_EXPECTED_OUTPUT_TOKENS
+        wait = max(self.requests.reserve(1), self.tokens.reserve(reserved))
+        return reserved, wait
+
+    def _settle(self, reserved: int, response):
+        usage = getattr(response, "usage_metadata", None) or {}
+        if usage.get("total_tokens"):
+            self.tokens.adjust(reserved - usage["total_tokens"])
+
+    def _on_error(self, error: Exception, attempt: int, operation: str) -> float:
+        """
+        Records a failed attempt and returns the backoff, or re-raises if it should not be retried.
+        """
+        if is_rate_limit_error(error):
+            llm_throttled.inc(operation=operation)
+        if not is_retryable_error(error):
+            # The provider answered, so this does not count against the circuit
+            self.circuit.record_success()
+            raise error
+        self.circuit.record_failure()
+        if attempt > self.max_retries:
+            raise error
+        llm_retries.inc(operation=operation)
+        return self.backoff(attempt)
+
+    def invoke(self, messages: List, operation: str = "chat"):
+        """
+        Calls the chat model with rate limiting and retries (blocking).
+
+        Args:
+            messages (list): Chat messages for the model.
+            operation (str): Label for metrics (e.g. "analyze", "analyze_batch", "chat").
+
+        Returns:
+            The model's AIMessage.
+
+        Raises:
+            CircuitOpenError: If the circuit breaker is open.
+            Exception: The last error once retries are exhausted, or a non-retryable error.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            self.circuit.before_call()
+            reserved, wait = self._admit(messages)
+            if wait:
+                time.sleep(wait)
+
+            self.concurrency.acquire()
+            start = time.perf_counter()
+            try:
+                with span("llm_call"):
+                    response = get_llm().invoke(messages)
+            except Exception as e:
+                self.concurrency.release(throttled=is_rate_limit_error(e))
+                delay = self._on_error(e, attempt, operation)
+                time.sleep(delay)
+                continue
+
+            self.concurrency.release(latency=time.perf_counter() - start)
+            self.circuit.record_success()
+            self._settle(reserved, response)
+            record_llm_usage(operation, response)
+            return response
+
+    async def ainvoke(self, messages: List, operation: str = "chat"):
+        """
+        Async variant of invoke: awaits the model's ainvoke, and waits for the
+        quota, a concurrency slot or a retry without blocking the event loop.
+
+        Args:
+            messages (list): Chat messages for the model.
+            operation (str): Label for metrics (e.g. "analyze", "analyze_batch", "chat").
+
+        Returns:
+            The model's AIMessage.
+
+        Raises:
+            CircuitOpenError: If the circuit breaker is open.
+            Exception: The last error once retries are exhausted, or a non-retryable error.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            self.circuit.before_call()
+            reserved, wait = self._admit(messages)
+            try:
+                if wait:
+                    await asyncio.sleep(wait)
+                await self.concurrency.acquire_async()
+            except asyncio.CancelledError:
+                self.circuit.record_abandoned()
+                raise
+            start = time.perf_counter()
+            response = error = None
+            try:
+                with span("llm_call"):
+                    response = await get_llm().ainvoke(messages)
+            except Exception as e:
+                error = e
+            finally:
+                if error is not None:
+                    self.concurrency.release(throttled=is_rate_limit_error(error))
+                elif response is not None:
+                    self.concurrency.release(latency=time.perf_counter() - start)
+                else:
+                    # Cancelled (client gone, job stopped): free the slot and the half-open trial
+                    self.concurrency.release()
+                    self.circuit.record_abandoned()
+
+            if error is not None:
+                await asyncio.sleep(self._on_error(error, attempt, operation))
+                continue
+
+            self.circuit.record_success()
+            self._settle(reserved, response)
+            record_llm_usage(operation, response)
+            return response
+
+    async def astream(self, messages: List, operation: str = "chat") -> AsyncIterator:
+        """
+        Streams the chat model's answer with rate limiting.
+
+        Failures before the first chunk are retried like invoke(); once output
+        has been yielded a failure is raised, since the answer cannot be restarted.
+
+        Yields:
+            The model's AIMessageChunks.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            self.circuit.before_call()
+            reserved, wait = self._admit(messages)
+            try:
+                if wait:
+                    await asyncio.sleep(wait)
+                # Cancelling the wait (e.g. the SSE client left) leaves no slot taken
+                await self.concurrency.acquire_async()
+            except asyncio.CancelledError:
+                self.circuit.record_abandoned()
+                raise
+            start = time.perf_counter()
+            response = None
+            error = None
+            finished = False
+            try:
+                with span("llm_stream"):
+                    async for chunk in get_llm().astream(messages):
+                        # Chunks add up to the full message, including its usage metadata
+                        response = chunk if response is None else response + chunk
+                        yield chunk
+                finished = True
+            except Exception as e:
+                error = e
+            finally:
+                # Also runs when the consumer stops reading early or the task is cancelled
+                if error is not None:
+                    self.concurrency.release(throttled=is_rate_limit_error(error))
+                elif finished:
+                    self.concurrency.release(latency=time.perf_counter() - start)
+                else:
+                    self.concurrency.release()
+                    # The provider had answered if chunks arrived; either way the half-open trial ends
+                    if response is None:
+                        self.circuit.record_abandoned()
+                    else:
+                        self.circuit.record_success()
+
+            if error is not None:
+                if response is not None:
+                    self.circuit.record_failure()
+                    raise error
+                await asyncio.sleep(self._on_error(error, attempt, operation))
+                continue
+
+            self.circuit.record_success()
+            self._settle(reserved, response)
+            record_llm_usage(operation, response)
+            return
+
+    def stats(self) -> dict:
+        """
+        Returns the breaker state, the concurrency limit and calls in flight.
+        """
+        return {
+            "circuit": self.circuit.state,
+            "consecutive_failures": self.circuit.failures,
+            "concurrency_limit": int(self.concurrency.limit),
+            "in_flight": self.concurrency.in_flight
+        }
+
+
+# Shared client so all LLM traffic shares one quota and one breaker
+llm_client = LLMClient()
@@ -0,0 +1,218 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+# Histogram buckets (seconds), from fast regex work up to slow LLM calls
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Add a Server-Timing header with the per-span breakdown of each request
+SERVER_TIMING_HEADER = os.environ.get("SERVER_TIMING_HEADER", "false").lower() in ("1", "true", "yes")
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+# Span totals of the request being handled (set by the timing middleware in main.py)
+_request_spans: ContextVar[Optional[Dict[str, List[float]]]] = ContextVar("request_spans", default=None)
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """
+    Monotonic counter with labels, rendered as a Prometheus counter.
+    """
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value:g}")
+        return lines
+
+
+class Gauge:
+    """
+    Value that can go up and down, with labels, rendered as a Prometheus gauge.
+    """
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram with labels, rendered as a Prometheus histogram.
+    """
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = METRICS_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        # Per label set: bucket counts, sum, count
+        self._series: Dict[LabelKey, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            counts, totals = self._series.setdefault(key, ([0] * len(self.buckets), [0.0, 0.0]))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            totals[0] += value
+            totals[1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, (total, count)) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, ('le', f'{bound:g}'))} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {count:g}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total:.6f}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {count:g}")
+        return lines
+
+
+# === Metrics of the invoice pipeline and the chatbot ===
+span_seconds = Histogram("invoice_span_seconds", "Time spent in each instrumented step.")
+span_errors = Counter("invoice_span_errors_total", "Instrumented steps that raised an exception.")
+http_request_seconds = Histogram("invoice_http_request_seconds", "HTTP request latency by route.")
+llm_calls = Counter("invoice_llm_calls_total", "LLM calls by operation.")
+llm_tokens = Counter("invoice_llm_tokens_total", "LLM tokens by operation and kind (input/output).")
+llm_retries = Counter("invoice_llm_retries_total", "LLM calls repeated after a failed or unusable response.")
+llm_throttled = Counter("invoice_llm_throttled_total", "LLM calls rejected by the provider's rate limit (429).")
+llm_batch_fallbacks = Counter(
+    "invoice_llm_batch_fallbacks_total", "Invoices re-analyzed alone after a batch call gave no valid verdict for them."
+)
+llm_concurrency_limit = Gauge("invoice_llm_concurrency_limit", "Current adaptive limit on concurrent LLM calls.")
+llm_circuit_open = Gauge("invoice_llm_circuit_open", "1 while the LLM circuit breaker is open.")
+invoice_decisions = Counter("invoice_decisions_total", "Invoice verdicts by decision path (rules, cache, llm).")
+upload_storage_bytes = Gauge("invoice_upload_storage_bytes", "Disk space used by upload sessions.")
+upload_sessions_removed = Counter(
+    "invoice_upload_sessions_removed_total", "Upload sessions deleted by reason (finished, ttl, quota)."
+)
+
+REGISTRY = [
+    span_seconds, span_errors, http_request_seconds, llm_calls, llm_tokens, llm_retries,
+    llm_throttled, llm_batch_fallbacks, llm_concurrency_limit, llm_circuit_open, invoice_decisions,
+    upload_storage_bytes, upload_sessions_removed
+]
+
+
+@contextmanager
+def span(name: str):
+    """
+    Times a block of code: records it in invoice_span_seconds and in the
+    per-request breakdown (see start_request_timing). Exceptions are counted
+    and re-raised.
+
+    Example:
+        with span("llm_call"):
+            response = get_llm().invoke(messages)
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        span_errors.inc(span=name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        span_seconds.observe(elapsed, span=name)
+        spans = _request_spans.get()
+        if spans is not None:
+            totals = spans.setdefault(name, [0.0, 0])
+            totals[0] += elapsed
+            totals[1] += 1
+
+
+def record_llm_usage(operation: str, response) -> None:
+    """
+    Counts one LLM call and the tokens reported in its usage metadata, if any.
+
+    Args:
+        operation (str): What the call was for (e.g. "analyze", "analyze_batch", "chat").
+        response: The AIMessage (or last streamed chunk) returned by the model.
+    """
+    llm_calls.inc(operation=operation)
+    usage = getattr(response, "usage_metadata", None) or {}
+    for kind in ("input_tokens", "output_tokens"):
+        if usage.get(kind):
+            llm_tokens.inc(usage[kind], operation=operation, kind=kind.replace("_tokens", ""))
+
+
+def start_request_timing():
+    """
+    Starts collecting span totals for the current request. Returns a token for stop_request_timing.
+    """
+    return _request_spans.set({})
+
+
+def stop_request_timing(token) -> Dict[str, List[float]]:
+    """
+    Stops collecting span totals and returns them as {span: [seconds, count]}.
+    """
+    spans = _request_spans.get() or {}
+    _request_spans.reset(token)
+    return spans
+
+
+def format_server_timing(spans: Dict[str, List[float]], total_seconds: float) -> str:
+    """
+    Formats span totals as a Server-Timing header value (durations in milliseconds).
+    Spans that ran concurrently are summed, so they can add up to more than the total.
+    """
+    entries = [f"{name};dur={seconds * 1000:.1f};desc=\"x{count}\"" for name, (seconds, count) in spans.items()]
+    entries.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def render_prometheus() -> str:
+    """
+    Renders every metric in the Prometheus text exposition format.
+    """
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,330 @@
+import os
+import time
+import asyncio
+import zipfile
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from app.utils.pdf_parser import extract_invoice_fields, iter_pdf_members, read_zip_member
+from app.utils.pdf_pool import extract_async
+from app.core.analyzer import aanalyze_invoice, aanalyze_invoices_batch, LLM_BATCH_SIZE
+from app.core.vector_store import ingest_batcher, find_stored_invoices, hash_invoice_text, make_invoice_doc_id
+from app.core.policy_registry import PolicyRecord, build_policy_context
+from app.core.metrics import span
+
+# Maximum number of invoices that may be in flight (parse -> classify -> store) at once
+PIPELINE_CONCURRENCY = int(os.environ.get("PIPELINE_CONCURRENCY", "8"))
+
+# PDF parsing is CPU-bound (done in the PDF process pool), so it gets its own limit
+PARSE_CONCURRENCY = int(os.environ.get("PARSE_CONCURRENCY", str(os.cpu_count() or 2)))
+
+# Limits on the contents of invoice ZIPs
+MAX_INVOICE_BYTES = int(os.environ.get("MAX_INVOICE_BYTES", str(25 * 1024 * 1024)))
+MAX_ZIP_INVOICES = int(os.environ.get("MAX_ZIP_INVOICES", "5000"))
+
+# An invoice to process: its file name and a callable that returns the raw PDF bytes
+InvoiceSource = Tuple[str, Callable[[], bytes]]
+
+# Called with (file name, analysis) as soon as each invoice has been stored
+ResultCallback = Callable[[str, Dict], Awaitable[None]]
+
+
+def sources_from_paths(paths: List[str]) -> List[InvoiceSource]:
+    """
+    Builds invoice sources for PDF files on disk.
+    """
+    def reader(path: str) -> Callable[[], bytes]:
+        def read() -> bytes:
+            with open(path, "rb") as f:
+                return f.read()
+        return read
+
+    return [(os.path.basename(path), reader(path)) for path in paths]
+
+
+def sources_from_zip(
+    zip_ref: zipfile.ZipFile,
+    max_member_bytes: Optional[int] = MAX_INVOICE_BYTES,
+    max_members: Optional[int] = MAX_ZIP_INVOICES
+) -> List[InvoiceSource]:
+    """
+    Builds invoice sources for the PDF members of an open ZIP archive.
+
+    Nothing is extracted to disk: each member is decompressed into memory only
+    when the pipeline is ready to parse it.
+
+    Args:
+        zip_ref (zipfile.ZipFile): An open ZIP archive; must stay open while the sources are used.
+        max_member_bytes (int, optional): Maximum uncompressed size of one PDF. Defaults to MAX_INVOICE_BYTES.
+        max_members (int, optional): Maximum number of PDFs taken from the archive. Defaults to MAX_ZIP_INVOICES.
+
+    Returns:
+        List[InvoiceSource]: One source per PDF, with unique file names.
+    """
+    sources: List[InvoiceSource] = []
+    seen = set()
+    for info in iter_pdf_members(zip_ref, max_member_bytes):
+        if max_members is not None and len(sources) >= max_members:
+            print(f"Warning: Only the first {max_members} PDFs in the ZIP will be processed.")
+            break
+
+        # Same file name in different folders: keep the folder to tell them apart
+        name = os.path.basename(info.filename)
+        if name in seen:
+            name = info.filename
+        seen.add(name)
+
+        sources.append((name, lambda info=info: read_zip_member(zip_ref, info, max_member_bytes)))
+    return sources
+
+
+class StageTimer:
+    """
+    Accumulates wall-clock time spent in each stage of the invoice pipeline.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.totals: Dict[str, float] = defaultdict(float)
+        self.maxima: Dict[str, float] = defaultdict(float)
+        self.counts: Dict[str, int] = defaultdict(int)
+        self.documents: Dict[str, Dict] = {}
+
+    @contextmanager
+    def measure(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.totals[stage] += elapsed
+            self.maxima[stage] = max(self.maxima[stage], elapsed)
+            self.counts[stage] += 1
+
+    def record_document(self, name: str, pages: int, seconds: float):
+        """
+        Records the page count and extraction time of one parsed PDF.
+        """
+        self.documents[name] = {"pages": pages, "parse_seconds": round(seconds, 4)}
+
+    def summary(self) -> Dict:
+        """
+        Returns the per-stage and per-document timings (in seconds) plus the overall wall time.
+        """
+        return {
+            "wall_seconds": round(time.perf_counter() - self.started, 4),
+            "stages": {
+                stage: {
+                    "count": self.counts[stage],
+                    "total_seconds": round(self.totals[stage], 4),
+                    "max_seconds": round(self.maxima[stage], 4),
+                }
+                for stage in self.totals
+            },
+            "documents": self.documents
+        }
+
+
+async def run_invoice_pipeline(
+    employee_name: str,
+    policy: PolicyRecord,
+    invoices: List[InvoiceSource],
+    concurrency: Optional[int] = None,
+    batch_mode: bool = False,
+    on_result: Optional[ResultCallback] = None
+) -> Dict:
+    """
+    Parses, classifies and stores a batch of invoices as overlapping stages.
+
+    Each invoice moves through its stages independently, so one invoice can be
+    waiting on the LLM while another is being parsed or embedded. Blocking work
+    is offloaded to worker threads (PDF parsing to worker processes) and LLM
+    calls are awaited, to keep the event loop responsive. Each invoice is
+    classified against only the policy sections relevant to its category.
+
+    In batch mode, invoices that share the same policy context are classified
+    together with aanalyze_invoices_batch (up to LLM_BATCH_SIZE per LLM call).
+
+    Re-ingest is incremental: an invoice already stored for this employee with
+    the same content and policy is not classified or embedded again; its stored
+    verdict is returned instead. Failed analyses (status "Error", e.g. an LLM
+    outage) are reported but not stored, so the next upload analyzes them again.
+
+    Args:
+        employee_name (str): Name of the employee the invoices belong to.
+        policy (PolicyRecord): The registered reimbursement policy.
+        invoices (List[InvoiceSource]): The invoice PDFs, read lazily (see sources_from_zip).
+        concurrency (int, optional): Maximum invoices (or batches) in flight. Defaults to PIPELINE_CONCURRENCY.
+        batch_mode (bool): Classify several invoices per LLM call.
+        on_result (ResultCallback, optional): Awaited with each invoice's result as it finishes.
+
+    Returns:
+        dict: Number of readable invoices, number of unchanged (skipped) invoices,
+        analysis results per file and stage timings.
+    """
+    timer = StageTimer()
+    unchanged = []
+    in_flight = asyncio.Semaphore(max(1, concurrency or PIPELINE_CONCURRENCY))
+    parse_slots = asyncio.Semaphore(max(1, PARSE_CONCURRENCY))
+
+    async def parse(source: InvoiceSource) -> Optional[str]:
+        filename, read = source
+        try:
+            async with parse_slots:
+                with timer.measure("parse"):
+                    data = await asyncio.to_thread(read)
+                    result = await extract_async(filename, data)
+        except Exception as e:
+            print(f"Warning: Could not extract text from {filename}: {e}")
+            return None
+
+        if result.error:
+            print(f"Error reading PDF file '{filename}': {result.error}")
+            return None
+        timer.record_document(filename, result.pages, result.seconds)
+        return result.text if result.text.strip() else None  # Avoid storing empty content
+
+    async def find_unchanged(names_and_texts: List[Tuple[str, str]]) -> Dict[str, Dict]:
+        """
+        Returns the stored verdict of each invoice that is already in the vector store.
+        Error verdicts (stored before failures were kept out of the store) count as changed.
+        """
+        ids = {
+            name: make_invoice_doc_id(employee_name, hash_invoice_text(text), policy.policy_id)
+            for name, text in names_and_texts
+        }
+        try:
+            with timer.measure("lookup"):
+                stored = await asyncio.to_thread(find_stored_invoices, list(ids.values()))
+        except Exception as e:
+            print(f"Warning: Could not check for already stored invoices: {e}")
+            return {}
+
+        verdicts = {}
+        for name, doc_id in ids.items():
+            if doc_id in stored and stored[doc_id].get("status") != "Error":
+                unchanged.append(name)
+                verdicts[name] = {key: stored[doc_id].get(key) for key in ("status", "reason", "decision_path")}
+        return verdicts
+
+    async def skip(filename: str, analysis: Dict) -> Dict:
+        if on_result is not None:
+            await on_result(filename, analysis)
+        return analysis
+
+    async def store(filename: str, invoice_text: str, analysis: Dict) -> Dict:
+        if analysis["status"] == "Error":
+            # Not stored, so the invoice is analyzed again on the next upload
+            if on_result is not None:
+                await on_result(filename, analysis)
+            return analysis
+        try:
+            # Combine invoice and LLM decision for embedding
+            combined_text = f"{invoice_text}\n\nLLM Decision: {analysis['reason']}"
+
+            # Prepare metadata for vector storage
+            # Facts read from the text itself (date, amount, currency, vendor, ...), not from the LLM
+            with span("field_extract"):
+                fields = extract_invoice_fields(invoice_text)
+            invoice_date = fields.date or datetime.now().isoformat()
+            metadata = {
+                "employee_name": employee_name,
+                "invoice_file": filename,
+                "policy_id": policy.policy_id,
+                "content_hash": hash_invoice_text(invoice_text),
+                "status": analysis["status"],
+                "reason": analysis["reason"],
+                "date": invoice_date,
+                # YYYYMMDD as a number, so the vector store can filter on date ranges
+                "date_int": int(invoice_date[:10].replace("-", "")),
+                **fields.as_metadata()
+            }
+            if analysis.get("decision_path"):
+                # Whether rules, a cached verdict or the LLM decided
+                metadata["decision_path"] = analysis["decision_path"]
+
+            # Batched with the other in-flight invoices
+            with timer.measure("store"):
+                await ingest_batcher.submit(combined_text, metadata)
+
+        except Exception as e:
+            analysis = {
+                "status": "Error",
+                "reason": f"Failed to analyze invoice: {str(e)}"
+            }
+
+        if on_result is not None:
+            await on_result(filename, analysis)
+        return analysis
+
+    async def process(source: InvoiceSource) -> Tuple[str, Optional[Dict]]:
+        filename = source[0]
+        async with in_flight:
+            # === Stage 1: parse ===
+            invoice_text = await parse(source)
+            if invoice_text is None:
+                return filename, None
+
+            # Unchanged since the last upload: keep the stored verdict
+            stored = await find_unchanged([(filename, invoice_text)])
+            if filename in stored:
+                return filename, await skip(filename, stored[filename])
+
+            # === Stage 2: classify ===
+            policy_context = build_policy_context(policy, invoice_text)
+            with timer.measure("classify"):
+                analysis = await aanalyze_invoice(policy_context, invoice_text)
+
+            # === Stage 3: embed and store ===
+            return filename, await store(filename, invoice_text, analysis)
+
+    async def process_batch(policy_context: str, batch: Dict[str, str]) -> List[Tuple[str, Dict]]:
+        async with in_flight:
+            with timer.measure("classify"):
+                try:
+                    verdicts = await aanalyze_invoices_batch(policy_context, batch)
+                except Exception as e:
+                    verdicts = {
+                        name: {"status": "Error", "reason": f"Failed to analyze invoice: {str(e)}"}
+                        for name in batch
+                    }
+            stored = await asyncio.gather(*(
+                store(name, batch[name], verdicts[name]) for name in batch
+            ))
+            return list(zip(batch, stored))
+
+    if not batch_mode:
+        outcomes = await asyncio.gather(*(process(source) for source in invoices))
+    else:
+        # === Stage 1: parse everything so invoices can be grouped by policy context ===
+        texts = await asyncio.gather(*(parse(source) for source in invoices))
+        parsed = [(filename, text) for (filename, _), text in zip(invoices, texts) if text is not None]
+        stored = await find_unchanged(parsed)
+        skipped = await asyncio.gather(*(skip(name, stored[name]) for name in stored))
+
+        groups: Dict[str, Dict[str, str]] = {}
+        for filename, invoice_text in parsed:
+            if filename not in stored:
+                context = build_policy_context(policy, invoice_text)
+                groups.setdefault(context, {})[filename] = invoice_text
+
+        # === Stages 2 + 3: classify each group in LLM-sized batches, then store ===
+        batches = []
+        for context, group in groups.items():
+            names = list(group)
+            for start in range(0, len(names), max(1, LLM_BATCH_SIZE)):
+                chunk = names[start:start + max(1, LLM_BATCH_SIZE)]
+                batches.append(process_batch(context, {name: group[name] for name in chunk}))
+
+        results = dict(pair for batch in await asyncio.gather(*batches) for pair in batch)
+        results.update(zip(stored, skipped))
+        outcomes = [(filename, results.get(filename)) for filename, _ in invoices]
+
+    analysis_results = {filename: analysis for filename, analysis in outcomes if analysis is not None}
+    return {
+        "num_invoices": len(analysis_results),
+        "num_unchanged": len(unchanged),
+        "analysis_results": analysis_results,
+        "timings": timer.summary()
+    }
@@ -0,0 +1,298 @@
+import os
+import re
+import json
+import time
+import bisect
+import hashlib
+import sqlite3
+import threading
+from functools import lru_cache
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from app.core.config import CACHE_DIR
+from app.utils.pdf_parser import extract_text_from_pdf, detect_invoice_category
+
+# Section holding everything that is not specific to one expense category
+GENERAL_SECTION = "general"
+
+# Policy sections to use for each invoice category (first one present wins), besides the general ones
+CATEGORY_SECTIONS = {
+    "meals": ["meals"],
+    "cab": ["cab", "travel"],
+    "travel": ["travel"],
+    "accommodation": ["accommodation", "travel"],
+}
+
+# Numbered headings such as "5. Specific Expense Guidelines" or "5.1 Food and Beverages"
+_HEADING_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)*)\.?\s+([A-Za-z][^\n]{0,80})$", re.MULTILINE)
+
+# Heading words that mark a section as belonging to a category
+_SECTION_KEYWORDS = {
+    "meals": ["food", "meal", "beverage", "dining"],
+    "cab": ["cab", "taxi", "commute"],
+    "travel": ["travel", "trip", "flight", "transport"],
+    "accommodation": ["accommodation", "hotel", "lodging", "stay"],
+}
+
+# Currency amounts in policy text (e.g. "₹2,000 per trip", "Rs. 200") and sentence boundaries around them
+_LIMIT_PATTERN = re.compile(r"(?:₹|\brs\.?|\binr)\s*(\d[\d,]*(?:\.\d+)?)(?:\s+(per\s+[a-z]+))?", re.IGNORECASE)
+_SENTENCE_BOUNDARY = re.compile(r"(?<![Rr][Ss])\.(?=\s|$)|●|\n\s*\n")
+
+
+@dataclass
+class PolicyLimit:
+    """
+    A reimbursement limit for one expense category, as stated in the policy.
+    """
+    category: str
+    amount: float
+    # e.g. "per meal"; empty when the policy does not say
+    unit: str = ""
+
+
+@dataclass
+class PolicyRecord:
+    """
+    A parsed reimbursement policy, identified by the hash of its PDF content.
+    """
+    policy_id: str
+    text: str
+    sections: Dict[str, str] = field(default_factory=dict)
+    created_at: float = field(default_factory=time.time)
+
+
+def compute_policy_id(pdf_bytes: bytes) -> str:
+    """
+    Returns the content-addressed ID of a policy PDF.
+    """
+    return hashlib.sha256(pdf_bytes).hexdigest()[:16]
+
+
+def split_policy_sections(policy_text: str) -> Dict[str, str]:
+    """
+    Splits a policy into a general section and one section per expense category.
+
+    Sections are delimited by numbered headings. A section whose heading names a
+    category (e.g. "5.1 Food and Beverages") goes to that category. Categories
+    without a heading of their own borrow the category sections that mention
+    them (e.g. office cabs inside "Travel Expenses"). Everything else goes to
+    the general section.
+
+    Args:
+        policy_text (str): Full policy text.
+
+    Returns:
+        Dict[str, str]: Section text keyed by "general" or a category name.
+    """
+    matches = list(_HEADING_PATTERN.finditer(policy_text))
+    if not matches:
+        return {GENERAL_SECTION: policy_text}
+
+    # First pass: tag each section by the categories named in its heading
+    tagged = []
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(policy_text)
+        tagged.append((policy_text[match.start():end], _heading_categories(match.group(2))))
+
+    # Second pass: categories without a heading of their own borrow the sections that mention them
+    headed = {c for _, categories in tagged for c in categories}
+    for chunk, categories in tagged:
+        if categories:
+            body = chunk.lower()
+            categories += [
+                c for c, words in _SECTION_KEYWORDS.items()
+                if c not in headed and any(re.search(rf"\b{w}s?\b", body) for w in words)
+            ]
+
+    parts: Dict[str, List[str]] = {GENERAL_SECTION: [policy_text[:matches[0].start()]]}
+    for chunk, categories in tagged:
+        for category in categories or [GENERAL_SECTION]:
+            parts.setdefault(category, []).append(chunk)
+
+    return {name: "".join(chunks).strip() for name, chunks in parts.items() if "".join(chunks).strip()}
+
+
+def _heading_categories(heading: str) -> List[str]:
+    heading = heading.lower()
+    return [c for c, words in _SECTION_KEYWORDS.items() if any(w in heading for w in words)]
+
+
+@lru_cache(maxsize=64)
+def parse_policy_limits(policy_text: str) -> Dict[str, PolicyLimit]:
+    """
+    Extracts the per-category amount limits stated in a policy.
+
+    Each currency amount is assigned to the category of its section heading
+    when the sentence mentions that category (e.g. "5.1 Food and Beverages ...
+    ₹200 per meal"); otherwise to the category named last before the amount in
+    its sentence (e.g. "the allowance for daily office cabs is ₹150" under
+    "5.2 Travel Expenses"); otherwise to the heading's category. The first limit
+    found for a category wins. Results are cached per policy text; do not modify them.
+
+    Args:
+        policy_text (str): Full policy text, or the part of it sent to the LLM.
+
+    Returns:
+        Dict[str, PolicyLimit]: Limits keyed by category.
+    """
+    headings = [(m.start(), _heading_categories(m.group(2))) for m in _HEADING_PATTERN.finditer(policy_text)]
+    heading_starts = [start for start, _ in headings]
+    boundaries = [m.end() for m in _SENTENCE_BOUNDARY.finditer(policy_text)]
+    keyword_patterns = {
+        c: re.compile(r"\b(?:" + "|".join(words) + r")s?\b", re.IGNORECASE) for c, words in _SECTION_KEYWORDS.items()
+    }
+
+    limits: Dict[str, PolicyLimit] = {}
+    for match in _LIMIT_PATTERN.finditer(policy_text):
+        position = bisect.bisect_right(boundaries, match.start())
+        sentence = policy_text[boundaries[position - 1] if position else 0:match.start()]
+        heading = bisect.bisect_right(heading_starts, match.start())
+        section_categories = headings[heading - 1][1] if heading else []
+
+        mentioned = {}
+        for c, pattern in keyword_patterns.items():
+            last = None
+            for last in pattern.finditer(sentence):
+                pass
+            if last is not None:
+                mentioned[c] = last.end()
+
+        category = next((c for c in section_categories if c in mentioned), None)
+        if category is None and mentioned:
+            category = max(mentioned, key=mentioned.get)
+        if category is None and section_categories:
+            category = section_categories[0]
+        if category is None or category in limits:
+            continue
+
+        try:
+            amount = float(match.group(1).replace(",", ""))
+        except ValueError:
+            continue
+        limits[category] = PolicyLimit(category=category, amount=amount, unit=(match.group(2) or "").lower())
+    return limits
+
+
+def build_policy_context(policy: PolicyRecord, invoice_text: str) -> str:
+    """
+    Returns only the parts of a policy that are relevant to an invoice.
+
+    Falls back to the full policy text when the invoice category cannot be
+    determined or the policy has no section for it.
+
+    Args:
+        policy (PolicyRecord): The registered policy.
+        invoice_text (str): Full text content of the invoice.
+
+    Returns:
+        str: Policy text to send to the LLM.
+    """
+    category = detect_invoice_category(invoice_text)
+    section = next((name for name in CATEGORY_SECTIONS.get(category, []) if name in policy.sections), None)
+    if section is None:
+        return policy.text
+
+    names = [GENERAL_SECTION, section] if GENERAL_SECTION in policy.sections else [section]
+    return "\n\n".join(policy.sections[name] for name in names)
+
+
+class PolicyRegistry:
+    """
+    Stores parsed policies in SQLite so each policy PDF is parsed only once.
+    Policies that have been looked up are also kept in memory.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._memory: Dict[str, PolicyRecord] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS policies (
+                    policy_id TEXT PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    sections TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def register_pdf(self, pdf_path: str) -> PolicyRecord:
+        """
+        Registers a policy PDF, parsing it only if its content was not seen before.
+
+        Args:
+            pdf_path (str): Path to the policy PDF.
+
+        Returns:
+            PolicyRecord: The registered policy.
+
+        Raises:
+            ValueError: If the PDF contains no extractable text.
+        """
+        with open(pdf_path, "rb") as f:
+            policy_id = compute_policy_id(f.read())
+
+        existing = self.get(policy_id)
+        if existing is not None:
+            return existing
+
+        text = extract_text_from_pdf(pdf_path)
+        if not text.strip():
+            raise ValueError("The policy PDF appears to be empty or unreadable.")
+
+        record = PolicyRecord(policy_id=policy_id, text=text, sections=split_policy_sections(text))
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO policies (policy_id, text, sections, created_at) VALUES (?, ?, ?, ?)",
+                (record.policy_id, record.text, json.dumps(record.sections), record.created_at)
+            )
+            conn.commit()
+            self._memory[policy_id] = record
+        return record
+
+    def get(self, policy_id: str) -> Optional[PolicyRecord]:
+        """
+        Looks up a registered policy by ID.
+        """
+        with self._lock:
+            if policy_id in self._memory:
+                return self._memory[policy_id]
+
+            row = self._connect().execute(
+                "SELECT text, sections, created_at FROM policies WHERE policy_id = ?", (policy_id,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            record = PolicyRecord(
+                policy_id=policy_id, text=row[0], sections=json.loads(row[1]), created_at=row[2]
+            )
+            self._memory[policy_id] = record
+            return record
+
+    def list(self) -> List[Dict]:
+        """
+        Returns a short summary of every registered policy.
+        """
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT policy_id, sections, created_at FROM policies ORDER BY created_at DESC"
+            ).fetchall()
+        return [
+            {"policy_id": policy_id, "sections": sorted(json.loads(sections)), "created_at": created_at}
+            for policy_id, sections, created_at in rows
+        ]
+
+
+# Shared registry used by the upload endpoints
+policy_registry = PolicyRegistry(os.path.join(CACHE_DIR, "policies.sqlite3"))
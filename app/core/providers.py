@@ -0,0 +1,176 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# Ensure API Key is set
+if not os.environ.get("GOOGLE_API_KEY"):
+    # Replace this with secure key loading in production (e.g., dotenv or secret manager)
+    os.environ["GOOGLE_API_KEY"] = "your-google-api-key-here"
+
+# Models and storage shared by the analyzer, the vector store and the chatbot
+CHAT_MODEL = os.environ.get("CHAT_MODEL", "gemini-2.0-flash")
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "models/embedding-001")
+CHROMA_PERSIST_DIRECTORY = os.environ.get("CHROMA_PERSIST_DIRECTORY", "./chroma_langchain_db")
+INVOICE_COLLECTION = "invoice_analysis"
+
+# Where the vector store lives: "local" (an embedded store in CHROMA_PERSIST_DIRECTORY, for a single
+# process) or "http" (a Chroma server shared by several API workers or hosts, see CHROMA_HOST)
+VECTOR_STORE_BACKEND = os.environ.get("VECTOR_STORE_BACKEND", "local").lower()
+
+# Chroma server used by the "http" backend
+CHROMA_HOST = os.environ.get("CHROMA_HOST", "localhost")
+CHROMA_PORT = int(os.environ.get("CHROMA_PORT", "8000"))
+CHROMA_SSL = os.environ.get("CHROMA_SSL", "false").lower() in ("1", "true", "yes")
+
+# Serve repeated embeddings (queries and documents) from the local embedding cache
+EMBEDDING_CACHE_ENABLED = os.environ.get("EMBEDDING_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Seconds spent importing and constructing each provider, filled in on first use
+startup_timings: Dict[str, float] = {}
+
+_lock = threading.RLock()
+_llm = None
+_embeddings = None
+_chroma_client = None
+_vector_stores: Dict[str, object] = {}
+
+
+@contextmanager
+def _timed(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = round(time.perf_counter() - start, 4)
+
+
+def get_llm():
+    """
+    Returns the shared chat model, creating it on first use.
+    """
+    global _llm
+    if _llm is None:
+        with _lock:
+            if _llm is None:
+                with _timed("llm"):
+                    from langchain.chat_models import init_chat_model
+                    _llm = init_chat_model(CHAT_MODEL, model_provider="google_genai")
+    return _llm
+
+
+def get_embeddings():
+    """
+    Returns the shared embedding model, creating it on first use.
+    Unless EMBEDDING_CACHE_ENABLED is off, it is wrapped in the local embedding cache.
+    """
+    global _embeddings
+    if _embeddings is None:
+        with _lock:
+            if _embeddings is None:
+                with _timed("embeddings"):
+                    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+                    embeddings = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL)
+                    if EMBEDDING_CACHE_ENABLED:
+                        from app.core.embedding_cache import CachedEmbeddings, embedding_cache
+                        embeddings = CachedEmbeddings(embeddings, EMBEDDING_MODEL, embedding_cache)
+                    _embeddings = embeddings
+    return _embeddings
+
+
+def _local_client():
+    import chromadb
+    return chromadb.PersistentClient(path=CHROMA_PERSIST_DIRECTORY)
+
+
+def _http_client():
+    import chromadb
+    return chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT, ssl=CHROMA_SSL)
+
+
+# Chroma client factory per VECTOR_STORE_BACKEND
+VECTOR_STORE_BACKENDS = {"local": _local_client, "http": _http_client}
+
+
+def get_chroma_client():
+    """
+    Returns the single Chroma client for the configured backend (VECTOR_STORE_BACKEND).
+
+    Every collection is opened through this client, so the process never holds
+    two SQLite-backed clients on the same directory. An embedded ("local")
+    store is only visible to the process that opened it; processes that share
+    the invoices (API workers, the ingest writer) use the "http" backend.
+    """
+    global _chroma_client
+    if _chroma_client is None:
+        with _lock:
+            if _chroma_client is None:
+                factory = VECTOR_STORE_BACKENDS.get(VECTOR_STORE_BACKEND)
+                if factory is None:
+                    raise ValueError(
+                        f"VECTOR_STORE_BACKEND must be one of {', '.join(VECTOR_STORE_BACKENDS)}, "
+                        f"not '{VECTOR_STORE_BACKEND}'."
+                    )
+                with _timed("chroma_client"):
+                    _chroma_client = factory()
+    return _chroma_client
+
+
+def get_vector_store(collection_name: str = INVOICE_COLLECTION):
+    """
+    Returns the shared LangChain Chroma wrapper for a collection, creating it on first use.
+    """
+    store = _vector_stores.get(collection_name)
+    if store is None:
+        with _lock:
+            store = _vector_stores.get(collection_name)
+            if store is None:
+                client = get_chroma_client()
+                embeddings = get_embeddings()
+                with _timed(f"vector_store:{collection_name}"):
+                    from langchain_chroma import Chroma
+                    store = Chroma(
+                        client=client,
+                        collection_name=collection_name,  # Logical name for grouping
+                        embedding_function=embeddings      # Embedding model
+                    )
+                _vector_stores[collection_name] = store
+    return store
+
+
+def set_llm(llm):
+    """
+    Replaces the shared chat model (e.g. with a local stand-in for tests and benchmarks).
+    """
+    global _llm
+    with _lock:
+        _llm = llm
+
+
+def set_embeddings(embeddings):
+    """
+    Replaces the shared embedding model. Vector store wrappers are rebuilt on next use.
+    """
+    global _embeddings
+    with _lock:
+        _embeddings = embeddings
+        _vector_stores.clear()
+
+
+def warm_up(collections: Optional[list] = None) -> Dict[str, float]:
+    """
+    Creates every provider up front so the first request does not pay for it.
+    Intended for the FastAPI lifespan.
+
+    Args:
+        collections (list, optional): Collections to open. Defaults to the invoice collection.
+
+    Returns:
+        Dict[str, float]: Seconds spent per provider (see startup_timings).
+    """
+    with _timed("warm_up"):
+        get_llm()
+        for collection_name in collections or [INVOICE_COLLECTION]:
+            get_vector_store(collection_name)
+    return dict(startup_timings)
@@ -1,79 +1,174 @@
 import os
-from typing import Optional, Dict, List
-from langchain.chat_models import init_chat_model
+import re
+import asyncio
+import calendar
+from typing import AsyncIterator, Optional, Dict, List, Tuple
 from langchain.prompts import ChatPromptTemplate
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_chroma import Chroma
 from langchain_core.documents import Document
+from app.core.providers import get_embeddings, get_vector_store
+from app.core.llm_client import llm_client
+from app.core.invoice_index import invoice_index, INVOICE_INDEX_LIST_LIMIT
+from app.core.answer_cache import answer_cache
+from app.core.lexical_index import lexical_index, find_identifiers, LEXICAL_SEARCH_ENABLED
+from app.core.rag_context import build_context, reciprocal_rank_fusion, RAG_FETCH_K
+from app.core.metrics import span
 
-# Load Google API key
-if not os.environ.get("GOOGLE_API_KEY"):
-    os.environ["GOOGLE_API_KEY"] = "your-google-api-key-here"  # Replace with secure method in production
+# Answer counting/listing questions from the structured invoice index instead of a top-k vector search
+INDEX_ROUTING_ENABLED = os.environ.get("INDEX_ROUTING_ENABLED", "true").lower() in ("1", "true", "yes")
 
-# Initialize LLM and Embeddings
-llm = init_chat_model("gemini-2.0-flash", model_provider="google_genai")
-embedding_fn = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+# Reuse answers to near-identical questions asked with the same filters (see app.core.answer_cache)
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
 
-
-# Initialize Vector Store
-vector_store = Chroma(
-    collection_name="invoice_analysis",
-    embedding_function=embedding_fn,
-    persist_directory="./chroma_langchain_db"
+# Questions asking to count, sum or list all invoices; questions asking why, and lookups of a single
+# invoice ("show me Rahul's cab invoice", "the total on receipt 5689"), go to the search and the LLM
+_AGGREGATION_PATTERN = re.compile(
+    r"\b(how many|count|number of|sum of|total (?:amount|spent|spend)|in total|"
+    r"(?:list|show) (?:all|every)|all (?:of )?(?:the |my |his |her |their )?invoices)\b",
+    re.IGNORECASE
+)
+_EXPLANATION_PATTERN = re.compile(r"\b(why|explain|reason|reasons)\b", re.IGNORECASE)
+_STATUS_PATTERNS = {
+    "Fully Reimbursed": re.compile(r"\bfully\s+reimbursed\b", re.IGNORECASE),
+    "Partially Reimbursed": re.compile(r"\bpartially\s+reimbursed\b", re.IGNORECASE),
+    "Declined": re.compile(r"\b(declined|rejected)\b", re.IGNORECASE),
+}
+_MONTHS = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+_MONTH_PATTERN = re.compile(
+    r"\b(?:in|during|for|of|from)\s+(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?(?:\s+(\d{4}))?\b",
+    re.IGNORECASE
 )
+_YEAR_PATTERN = re.compile(r"\b(?:in|during|for|of)\s+(\d{4})\b", re.IGNORECASE)
+
 
 # Build filter for metadata search
 def build_metadata_filter(filters: Dict[str, Optional[str]]) -> Dict:
     """
     Constructs a MongoDB-style filter dictionary for Chroma search based on provided metadata.
+    date_from/date_to (YYYY-MM-DD) become a range on the numeric date_int field.
     """
     conditions = []
     for key, value in filters.items():
-        if value:
+        if not value:
+            continue
+        if key == "date_from":
+            conditions.append({"date_int": {"$gte": int(value.replace("-", ""))}})
+        elif key == "date_to":
+            conditions.append({"date_int": {"$lte": int(value.replace("-", ""))}})
+        else:
             conditions.append({key: {"$eq": value}})
     
     if not conditions:
         return {}
+
+    # Chroma requires at least two conditions inside $and
+    if len(conditions) == 1:
+        return conditions[0]
     
     return {"$and": conditions}
 
-# Generate RAG response based on vector search
-def get_rag_response(query: str, filters: Dict[str, Optional[str]]) -> str:
+
+def parse_aggregation_query(query: str, filters: Dict[str, Optional[str]]) -> Optional[Dict]:
     """
-    Performs a similarity search on vector DB and queries LLM for a final answer.
+    Decides whether a question can be answered from the invoice index alone.
+
+    Status, month/year and employee names mentioned in the question are turned
+    into index filters; filters passed explicitly take precedence. Questions
+    naming an invoice number, amount or date are left to the keyword and
+    vector search, which can match them exactly.
 
     Args:
-        query (str): User's question
-        filters (dict): Optional metadata filters like employee_name, status, etc.
+        query (str): User's question.
+        filters (dict): Filters given with the request.
 
     Returns:
-        str: LLM-generated response
+        Optional[dict]: Index filters for an aggregation question, or None if the
+        question needs the vector search and the LLM.
     """
-    try:
-        metadata_filter = build_metadata_filter(filters)
+    if not _AGGREGATION_PATTERN.search(query) or _EXPLANATION_PATTERN.search(query):
+        return None
+    if find_identifiers(query):
+        return None
 
-        # Search documents with or without filters
-        if metadata_filter:
-            docs: List[Document] = vector_store.similarity_search(
-                query=query,
-                k=5,
-                filter=metadata_filter
-            )
-        else:
-            docs: List[Document] = vector_store.similarity_search(
-                query=query,
-                k=5
-            )
+    index_filters = {key: value for key, value in filters.items() if value}
+
+    if "status" not in index_filters:
+        for status, pattern in _STATUS_PATTERNS.items():
+            if pattern.search(query):
+                index_filters["status"] = status
+                break
+
+    if not any(key in index_filters for key in ("date", "date_from", "date_to")):
+        month = _MONTH_PATTERN.search(query)
+        year = _YEAR_PATTERN.search(query)
+        if month:
+            number = f"{_MONTHS.index(month.group(1).lower()[:3]) + 1:02d}"
+            if month.group(2):
+                index_filters["date_from"] = f"{month.group(2)}-{number}-01"
+                last_day = calendar.monthrange(int(month.group(2)), int(number))[1]
+                index_filters["date_to"] = f"{month.group(2)}-{number}-{last_day:02d}"
+            else:
+                index_filters["month"] = number
+        elif year:
+            index_filters["date_from"] = f"{year.group(1)}-01-01"
+            index_filters["date_to"] = f"{year.group(1)}-12-31"
+
+    if "employee_name" not in index_filters:
+        lowered = query.lower()
+        for name in sorted(invoice_index.employee_names(), key=len, reverse=True):
+            if re.search(r"\b" + re.escape(name.lower()) + r"\b", lowered):
+                index_filters["employee_name"] = name
+                break
+
+    return index_filters
+
+
+def answer_from_index(query: str, filters: Dict[str, Optional[str]]) -> Optional[str]:
+    """
+    Answers counting, summing and listing questions with SQL over every matching invoice.
+
+    Args:
+        query (str): User's question.
+        filters (dict): Filters given with the request.
+
+    Returns:
+        Optional[str]: Markdown answer, or None if the question is not an aggregation
+        question or the index is empty.
+    """
+    index_filters = parse_aggregation_query(query, filters)
+    if index_filters is None or invoice_index.is_empty():
+        return None
+
+    described = ", ".join(f"{key.replace('_', ' ')}: {value}" for key, value in index_filters.items())
+    summary = invoice_index.aggregate(index_filters)
+    if summary["count"] == 0:
+        return f"No invoices match ({described or 'no filters'})."
+
+    lines = [f"**{summary['count']} invoice(s)** match ({described or 'no filters'})."]
+    total_line = f"**Total amount:** {summary['total_amount']:,.2f}"
+    if summary["count_without_amount"]:
+        total_line += f" ({summary['count_without_amount']} invoice(s) without a detected amount)"
+    lines += [total_line, "", "| Status | Invoices | Amount |", "|---|---|---|"]
+    for status, counts in sorted(summary["by_status"].items()):
+        lines.append(f"| {status} | {counts['count']} | {counts['total_amount']:,.2f} |")
 
-        # If no documents found, return informative message
-        if not docs:
-            return "No relevant documents found for your query. Please refine your search."
+    rows = invoice_index.query(index_filters, limit=INVOICE_INDEX_LIST_LIMIT)
+    lines += ["", "| Invoice | Employee | Vendor | Date | Status | Amount |", "|---|---|---|---|---|---|"]
+    for row in rows:
+        amount = f"{row['amount']:,.2f}" if row["amount"] is not None else "-"
+        lines.append(
+            f"| {row['invoice_file']} | {row['employee_name']} | {row['vendor'] or '-'} | {row['date'] or '-'} "
+            f"| {row['status']} | {amount} |"
+        )
+    if summary["count"] > len(rows):
+        lines.append(f"\n_... and {summary['count'] - len(rows)} more._")
 
-        # Prepare combined context from top documents
-        context = "\n\n---\n\n".join([doc.page_content for doc in docs])
+    return "\n".join(lines)
 
-        # Prepare system prompt using invoice data and user query
-        prompt_template = ChatPromptTemplate.from_template("""
+# Returned when the vector search finds nothing
+NO_DOCUMENTS_MESSAGE = "No relevant documents found for your query. Please refine your search."
+
+# Prepare system prompt using invoice data and user query
+RAG_PROMPT = ChatPromptTemplate.from_template("""
 You are a helpful assistant specialized in employee reimbursement queries.
 Use the following invoice analysis data to answer the user's question.
 
@@ -86,11 +181,259 @@ Use the following invoice analysis data to answer the user's question.
 Respond in clear and concise markdown format.
 """)
 
-        messages = prompt_template.format_messages(context=context, query=query)
-        response = llm.invoke(messages)
 
-        return response.content.strip()
+def find_exact_matches(query: str, filters: Dict[str, Optional[str]]) -> Optional[List[Document]]:
+    """
+    Looks up the documents naming every invoice number, amount or date in the
+    question in the keyword index. No embedding call is made.
+
+    Returns:
+        Optional[List[Document]]: The matching documents, or None if the question
+        names no identifier, nothing matches or keyword search is disabled.
+    """
+    if not LEXICAL_SEARCH_ENABLED:
+        return None
+    with span("lexical_lookup"):
+        return lexical_index.exact_matches(query, filters, RAG_FETCH_K)
+
+
+def build_rag_messages(
+    query: str,
+    filters: Dict[str, Optional[str]],
+    docs: Optional[List[Document]] = None,
+    query_vector: Optional[List[float]] = None
+) -> Optional[List]:
+    """
+    Runs the hybrid search and builds the LLM prompt from the best documents
+    that fit in the context budget (see app.core.rag_context.build_context).
+
+    Vector search results are fused with keyword (BM25) matches by reciprocal
+    rank fusion, so exact invoice numbers, vendor names and amounts are found
+    even when the embeddings miss them.
+
+    Args:
+        query (str): User's question
+        filters (dict): Optional metadata filters like employee_name, status, etc.
+        docs (List[Document], optional): Documents already found (see find_exact_matches);
+            the search is skipped when given.
+        query_vector (List[float], optional): The question's embedding, if already computed.
+
+    Returns:
+        Optional[list]: Chat messages for the LLM, or None if no documents were found.
+    """
+    if docs is None:
+        metadata_filter = build_metadata_filter(filters)
+        vector_store = get_vector_store()
+
+        # Search documents with or without filters
+        with span("vector_search"):
+            if query_vector is not None:
+                docs: List[Document] = vector_store.similarity_search_by_vector(
+                    embedding=query_vector,
+                    k=RAG_FETCH_K,
+                    filter=metadata_filter or None
+                )
+            elif metadata_filter:
+                docs: List[Document] = vector_store.similarity_search(
+                    query=query,
+                    k=RAG_FETCH_K,
+                    filter=metadata_filter
+                )
+            else:
+                docs: List[Document] = vector_store.similarity_search(
+                    query=query,
+                    k=RAG_FETCH_K
+                )
+
+        if LEXICAL_SEARCH_ENABLED:
+            with span("lexical_search"):
+                keyword_docs = lexical_index.search(query, filters, RAG_FETCH_K)
+            docs = reciprocal_rank_fusion([docs, keyword_docs])[:RAG_FETCH_K]
+
+    # If no documents found, there is nothing to answer from
+    if not docs:
+        return None
+
+    # Rerank, drop near-duplicates and fit the rest into the token budget
+    with span("context_build"):
+        context = build_context(query, docs)
+    return RAG_PROMPT.format_messages(context=context, query=query)
+
+
+def lookup_cached_answer(query: str, filters: Dict[str, Optional[str]]) -> Tuple[Optional[str], Optional[List[float]]]:
+    """
+    Looks up an answer to a similar earlier question with the same filters.
+
+    Returns:
+        Tuple: The cached answer (or None) and the query embedding to store a new answer
+        under (None when the answer cache is disabled).
+    """
+    if not ANSWER_CACHE_ENABLED:
+        return None, None
+    query_vector = get_embeddings().embed_query(query)
+    return answer_cache.get(filters, query_vector), query_vector
+
+
+async def alookup_cached_answer(
+    query: str, filters: Dict[str, Optional[str]]
+) -> Tuple[Optional[str], List[float]]:
+    """
+    Async variant of lookup_cached_answer. The question is embedded with
+    aembed_query even when the answer cache is disabled, since the vector
+    search needs the embedding too.
+
+    Returns:
+        Tuple: The cached answer (or None) and the query embedding.
+    """
+    query_vector = await get_embeddings().aembed_query(query)
+    if not ANSWER_CACHE_ENABLED:
+        return None, query_vector
+    return await asyncio.to_thread(answer_cache.get, filters, query_vector), query_vector
+
+
+# Generate RAG response based on vector search
+def get_rag_response(query: str, filters: Dict[str, Optional[str]]) -> str:
+    """
+    Performs a similarity search on vector DB and queries LLM for a final answer.
+    Counting and listing questions are answered from the invoice index instead
+    (see answer_from_index), and answers to near-identical questions with the
+    same filters come from the answer cache. Questions naming an invoice
+    number or amount are answered from its keyword matches, without embedding
+    the question (see find_exact_matches).
+
+    Args:
+        query (str): User's question
+        filters (dict): Optional metadata filters like employee_name, status, etc.
+
+    Returns:
+        str: LLM-generated response
+    """
+    with span("rag_response"):
+        return _get_rag_response(query, filters)
+
+
+def _get_rag_response(query: str, filters: Dict[str, Optional[str]]) -> str:
+    try:
+        # Aggregation questions cover every matching invoice, not just the top 5
+        if INDEX_ROUTING_ENABLED:
+            answer = answer_from_index(query, filters)
+            if answer is not None:
+                return answer
+
+        exact_docs = find_exact_matches(query, filters)
+        query_vector = None
+        if exact_docs is None:
+            cached, query_vector = lookup_cached_answer(query, filters)
+            if cached is not None:
+                return cached
+
+        messages = build_rag_messages(query, filters, exact_docs, query_vector)
+        if messages is None:
+            return NO_DOCUMENTS_MESSAGE
+
+        response = llm_client.invoke(messages, operation="chat")
+        answer = response.content.strip()
+
+        if query_vector is not None:
+            answer_cache.put(filters, query, query_vector, answer)
+        return answer
+
+    except Exception as e:
+        # Handle unexpected failures gracefully
+        return f"An error occurred while generating a response: {str(e)}"
+
+
+async def aget_rag_response(query: str, filters: Dict[str, Optional[str]]) -> str:
+    """
+    Async variant of get_rag_response, used by the API. The question is
+    embedded with aembed_query and the answer comes from the LLM's ainvoke;
+    index, cache and vector store lookups run in worker threads. A slow LLM
+    call therefore never holds up other requests.
+
+    Args:
+        query (str): User's question
+        filters (dict): Optional metadata filters like employee_name, status, etc.
+
+    Returns:
+        str: LLM-generated response
+    """
+    with span("rag_response"):
+        try:
+            answer, messages, query_vector = await _prepare_rag(query, filters)
+            if answer is not None:
+                return answer
+
+            response = await llm_client.ainvoke(messages, operation="chat")
+            answer = response.content.strip()
+
+            if query_vector is not None and ANSWER_CACHE_ENABLED:
+                await asyncio.to_thread(answer_cache.put, filters, query, query_vector, answer)
+            return answer
+
+        except Exception as e:
+            # Handle unexpected failures gracefully
+            return f"An error occurred while generating a response: {str(e)}"
+
+
+async def _prepare_rag(
+    query: str, filters: Dict[str, Optional[str]]
+) -> Tuple[Optional[str], Optional[List], Optional[List[float]]]:
+    """
+    Runs the steps before the LLM call without blocking the event loop.
+
+    Returns:
+        Tuple: The final answer if no LLM call is needed (index-answered, cached
+        or no documents), otherwise the LLM messages; and the query embedding
+        (None for exact-identifier lookups).
+    """
+    if INDEX_ROUTING_ENABLED:
+        answer = await asyncio.to_thread(answer_from_index, query, filters)
+        if answer is not None:
+            return answer, None, None
+
+    exact_docs = await asyncio.to_thread(find_exact_matches, query, filters)
+    query_vector = None
+    if exact_docs is None:
+        cached, query_vector = await alookup_cached_answer(query, filters)
+        if cached is not None:
+            return cached, None, query_vector
+
+    messages = await asyncio.to_thread(build_rag_messages, query, filters, exact_docs, query_vector)
+    if messages is None:
+        return NO_DOCUMENTS_MESSAGE, None, query_vector
+    return None, messages, query_vector
+
+
+async def stream_rag_response(query: str, filters: Dict[str, Optional[str]]) -> AsyncIterator[str]:
+    """
+    Streaming variant of get_rag_response: yields the answer in chunks as the LLM generates it.
+
+    The search runs as in aget_rag_response and the answer comes from the
+    LLM's async astream, so the event loop is never blocked. Index-answered,
+    cached and error responses are yielded as a single chunk.
+
+    Args:
+        query (str): User's question
+        filters (dict): Optional metadata filters like employee_name, status, etc.
+
+    Yields:
+        str: Consecutive pieces of the markdown answer.
+    """
+    try:
+        answer, messages, query_vector = await _prepare_rag(query, filters)
+        if answer is not None:
+            yield answer
+            return
+
+        chunks = []
+        async for chunk in llm_client.astream(messages, operation="chat"):
+            if chunk.content:
+                chunks.append(chunk.content)
+                yield chunk.content
+
+        if query_vector is not None and ANSWER_CACHE_ENABLED:
+            await asyncio.to_thread(answer_cache.put, filters, query, query_vector, "".join(chunks).strip())
 
     except Exception as e:
         # Handle unexpected failures gracefully
-        return f"An error occurred while generating a response: {str(e)}"
\ No newline at end of file
+        yield f"An error occurred while generating a response: {str(e)}"
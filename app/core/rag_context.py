@@ -0,0 +1,164 @@
+import os
+import re
+from typing import Dict, List, Set, Tuple
+from langchain_core.documents import Document
+from app.core.llm_client import estimate_tokens
+from app.core.vector_store import DOC_TYPE_CHUNK
+from app.core.lexical_index import STOP_WORDS
+
+# Documents fetched from the vector search before reranking and budgeting
+RAG_FETCH_K = int(os.environ.get("RAG_FETCH_K", "20"))
+
+# Token budget for the retrieved context in a chatbot prompt
+RAG_CONTEXT_TOKENS = int(os.environ.get("RAG_CONTEXT_TOKENS", "1500"))
+
+# Weight of query-term overlap against vector search rank when reranking (0 = vector rank only)
+RAG_LEXICAL_WEIGHT = float(os.environ.get("RAG_LEXICAL_WEIGHT", "0.3"))
+
+# Documents sharing at least this fraction of their word trigrams with a selected document are dropped
+RAG_DUPLICATE_OVERLAP = float(os.environ.get("RAG_DUPLICATE_OVERLAP", "0.9"))
+
+# A document that does not fit is cut to the remaining budget only if at least this many tokens remain
+RAG_MIN_TRUNCATED_TOKENS = 100
+
+# Rank offset in reciprocal rank fusion; larger values weigh top ranks less heavily
+RRF_K = 60
+
+# Separator between documents in the prompt context
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+_WORD_PATTERN = re.compile(r"[a-z0-9₹.]+")
+
+
+def _words(text: str) -> List[str]:
+    return _WORD_PATTERN.findall(text.lower())
+
+
+def _shingles(words: List[str]) -> Set[Tuple[str, ...]]:
+    if len(words) < 3:
+        return {tuple(words)}
+    return {tuple(words[i:i + 3]) for i in range(len(words) - 2)}
+
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], k: int = RRF_K) -> List[Document]:
+    """
+    Merges ranked result lists (e.g. vector and keyword search) into one.
+
+    Each document scores 1 / (k + rank) in every list it appears in; documents
+    are identified by their vector store ID. Only ranks are used, so the
+    lists' scores (distances, BM25) need not be comparable.
+
+    Args:
+        rankings (List[List[Document]]): Result lists, each best first.
+        k (int): Rank offset.
+
+    Returns:
+        List[Document]: Every document once, best fused score first.
+    """
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = doc.id or doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1 / (k + rank)
+            documents.setdefault(key, doc)
+    return [documents[key] for key in sorted(scores, key=lambda key: -scores[key])]
+
+
+def rerank(query: str, docs: List[Document]) -> List[Document]:
+    """
+    Reorders vector search results by a blend of their search rank and how
+    many of the query's terms they contain. Cheap enough to run on every
+    query: no model call, just word sets.
+
+    Args:
+        query (str): User's question.
+        docs (List[Document]): Search results, most similar first.
+
+    Returns:
+        List[Document]: The same documents, best first.
+    """
+    terms = {word for word in _words(query) if len(word) > 2 and word not in STOP_WORDS}
+
+    def score(position: int, doc: Document) -> float:
+        vector_score = 1 - position / len(docs)
+        if not terms:
+            return vector_score
+        coverage = len(terms & set(_words(doc.page_content))) / len(terms)
+        return (1 - RAG_LEXICAL_WEIGHT) * vector_score + RAG_LEXICAL_WEIGHT * coverage
+
+    scored = [(score(position, doc), position, doc) for position, doc in enumerate(docs)]
+    return [doc for _, _, doc in sorted(scored, key=lambda item: (-item[0], item[1]))]
+
+
+def _chunk_header(metadata: Dict) -> str:
+    """
+    One line standing in for the summary of the invoice a chunk belongs to.
+    """
+    parts = [metadata.get("invoice_file"), metadata.get("employee_name"), metadata.get("status")]
+    header = " | ".join(str(part) for part in parts if part)
+    if metadata.get("reason"):
+        header += f"\nLLM Decision: {metadata['reason']}"
+    return header
+
+
+def build_context(query: str, docs: List[Document], budget_tokens: int = RAG_CONTEXT_TOKENS) -> str:
+    """
+    Fits vector search results into the prompt's context budget.
+
+    Results are reranked (see rerank), near-duplicates of an already selected
+    document of the same invoice (e.g. a chunk repeating its summary) are
+    dropped, and documents are added best first while they fit
+    in budget_tokens; the first one that does not fit is cut to the remaining
+    budget. A chunk of an invoice not yet in the context is preceded by a
+    short header with the invoice's name, status and decision. The prompt
+    therefore stays the same size however long the stored invoices are.
+
+    Args:
+        query (str): User's question.
+        docs (List[Document]): Search results, most similar first.
+        budget_tokens (int): Maximum (estimated) tokens of context.
+
+    Returns:
+        str: The context for the prompt.
+    """
+    selected: List[str] = []
+    # Shingles of the selected documents, per invoice: templated bills of different
+    # invoices (e.g. two passengers' tickets) share most of their text but are not duplicates
+    selected_shingles: Dict[Tuple, List[Set[Tuple[str, ...]]]] = {}
+    described: Set[Tuple] = set()
+    remaining = budget_tokens
+
+    for doc in rerank(query, docs):
+        metadata = doc.metadata or {}
+        # Summaries and chunks of the same invoice share these fields
+        invoice = (metadata.get("employee_name"), metadata.get("invoice_file"), metadata.get("content_hash"))
+        if not any(invoice):
+            invoice = (doc.id or doc.page_content,)
+
+        shingles = _shingles(_words(doc.page_content))
+        if any(
+            len(shingles & other) >= RAG_DUPLICATE_OVERLAP * min(len(shingles), len(other))
+            for other in selected_shingles.get(invoice, [])
+        ):
+            continue
+
+        text = doc.page_content
+        if metadata.get("doc_type") == DOC_TYPE_CHUNK and invoice not in described:
+            text = f"{_chunk_header(metadata)}\n{text}"
+
+        cost = estimate_tokens([text + CONTEXT_SEPARATOR])
+        if cost > remaining:
+            if remaining < RAG_MIN_TRUNCATED_TOKENS:
+                continue
+            text = text[:(remaining - 1) * 4].rsplit("\n", 1)[0] + "\n..."
+            cost = remaining
+
+        selected.append(text)
+        selected_shingles.setdefault(invoice, []).append(shingles)
+        described.add(invoice)
+        remaining -= cost
+        if remaining < RAG_MIN_TRUNCATED_TOKENS:
+            break
+
+    return CONTEXT_SEPARATOR.join(selected)
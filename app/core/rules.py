@@ -0,0 +1,88 @@
+import os
+import re
+from typing import Optional
+from app.utils.pdf_parser import extract_invoice_fields
+from app.core.policy_registry import CATEGORY_SECTIONS, parse_policy_limits
+
+# Classify clear-cut invoices with rules instead of the LLM
+RULES_ENABLED = os.environ.get("RULES_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# How far an amount must be from the policy limit (as a fraction of it) for a rule verdict
+RULES_MARGIN = float(os.environ.get("RULES_MARGIN", "0.1"))
+
+# Items that policies restrict regardless of amount; itemised bills listing them need the LLM's judgement
+# (tickets are not checked: their terms often mention e.g. liquor in the luggage rules)
+_ITEMISED_CATEGORIES = ("meals", "accommodation")
+_RESTRICTED_ITEMS = re.compile(
+    r"\b(?:alcohol\w*|whisk(?:e)?y|whiskies|beer|wine|vodka|rum|gin|brandy|brandies|liquor|tobacco|cigarette)s?\b",
+    re.IGNORECASE
+)
+
+
+# Limits that apply to a whole invoice; other units (per meal, per night, per day, ...) need the
+# quantity on the bill, which is not extracted, so those invoices are left to the LLM
+_INVOICE_UNITS = ("", "per invoice", "per bill", "per receipt", "per claim")
+
+# Currency of the limits read from the policy (see parse_policy_limits)
+POLICY_CURRENCY = "INR"
+
+
+def _rupees(amount: float) -> str:
+    return f"₹{amount:,.2f}".replace(".00", "")
+
+
+def pre_classify(policy_text: str, invoice_text: str) -> Optional[dict]:
+    """
+    Classifies an invoice without the LLM when the outcome is clear from its amount.
+
+    The invoice's category, total and date are extracted from its text and the
+    total is compared with the policy's limit for that category. A verdict is
+    returned only when the category is unambiguous, the total is in rupees,
+    an itemised bill lists no restricted items (e.g. alcohol), the limit
+    applies to the whole invoice (not per meal, night, day, ...) and the total
+    is at least RULES_MARGIN below the limit (Fully Reimbursed) or above it
+    (Partially Reimbursed, up to the limit).
+
+    Args:
+        policy_text (str): The reimbursement policy text (or the sections relevant to the invoice).
+        invoice_text (str): The content of the invoice.
+
+    Returns:
+        Optional[dict]: Status and reason, or None when the LLM should decide.
+    """
+    if not RULES_ENABLED:
+        return None
+
+    fields = extract_invoice_fields(invoice_text)
+    if not fields.category_confident or fields.amount is None:
+        return None
+    if fields.currency and fields.currency != POLICY_CURRENCY:
+        return None
+    if fields.category in _ITEMISED_CATEGORIES and _RESTRICTED_ITEMS.search(invoice_text):
+        return None
+
+    limits = parse_policy_limits(policy_text)
+    limit = next((limits[name] for name in CATEGORY_SECTIONS.get(fields.category, []) if name in limits), None)
+    if limit is None or limit.amount <= 0 or limit.unit not in _INVOICE_UNITS:
+        return None
+
+    unit = f" {limit.unit}" if limit.unit else ""
+    on_date = f" dated {fields.date}" if fields.date else ""
+    if fields.amount <= limit.amount * (1 - RULES_MARGIN):
+        return {
+            "status": "Fully Reimbursed",
+            "reason": (
+                f"The {fields.category} invoice{on_date} totals {_rupees(fields.amount)}, "
+                f"within the policy limit of {_rupees(limit.amount)}{unit}."
+            )
+        }
+    if fields.amount >= limit.amount * (1 + RULES_MARGIN):
+        return {
+            "status": "Partially Reimbursed",
+            "reason": (
+                f"The {fields.category} invoice{on_date} totals {_rupees(fields.amount)}, "
+                f"above the policy limit of {_rupees(limit.amount)}{unit}; "
+                f"only {_rupees(limit.amount)} is reimbursable."
+            )
+        }
+    return None
@@ -0,0 +1,401 @@
+import os
+import time
+import shutil
+import socket
+import asyncio
+import sqlite3
+import threading
+from uuid import uuid4
+from typing import Dict, List, Optional, Set
+from app.core.config import CACHE_DIR
+from app.core.metrics import upload_storage_bytes, upload_sessions_removed
+
+# Directory holding one folder per upload session, plus the deduplicated files
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", "tmp_uploads")
+
+# Sessions left behind (e.g. by a crash) are removed after this long without use
+UPLOAD_SESSION_TTL_SECONDS = float(os.environ.get("UPLOAD_SESSION_TTL_SECONDS", str(24 * 3600)))
+
+# Disk space allowed for uploads; idle sessions are evicted (least recently used first) above it
+UPLOAD_STORAGE_MAX_BYTES = int(os.environ.get("UPLOAD_STORAGE_MAX_BYTES", str(10 * 1024 ** 3)))
+
+# How often the background sweeper removes expired sessions
+UPLOAD_SWEEP_INTERVAL_SECONDS = float(os.environ.get("UPLOAD_SWEEP_INTERVAL_SECONDS", "300"))
+
+# Store identical uploaded files once, named by their SHA-256
+UPLOAD_DEDUP_ENABLED = os.environ.get("UPLOAD_DEDUP_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Folder of UPLOAD_DIR holding the deduplicated files
+BLOB_DIR_NAME = "blobs"
+
+
+def _process_id() -> str:
+    # Recorded as the holder of the sessions this process uses
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _holder_alive(holder: Optional[str]) -> bool:
+    """
+    Whether the process recorded as a session's holder is still running.
+    Processes on other hosts (sharing the upload directory) cannot be checked
+    and count as running. On Windows, where a single process uses the storage,
+    other holders are from earlier runs.
+    """
+    if not holder or os.name == "nt":
+        return False
+    host, _, pid = holder.rpartition(":")
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except (ProcessLookupError, ValueError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class StorageQuotaError(RuntimeError):
+    """
+    Raised when an upload does not fit in the storage quota, even after evicting idle sessions.
+    """
+
+
+class UploadStorage:
+    """
+    Tracks upload sessions (the policy PDF and invoice ZIP of one upload) in a
+    SQLite index, so cleanup never has to walk the upload directory.
+
+    A session is in use from create_session() until finish(), which deletes
+    its files. Sessions that are never finished are removed by the sweeper
+    once they have been idle for the TTL, and idle sessions are evicted, least
+    recently used first, while uploads take more than the size quota. With
+    dedup enabled, identical files are stored once and shared between
+    sessions; a shared file is deleted with the last session that uses it.
+
+    Several processes (API workers and the ingest writer) may share the
+    storage: each session records the process holding it, and a session held
+    by a running process is never swept or evicted by another one.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        index_path: str,
+        ttl_seconds: float = UPLOAD_SESSION_TTL_SECONDS,
+        max_bytes: int = UPLOAD_STORAGE_MAX_BYTES,
+        dedup: bool = UPLOAD_DEDUP_ENABLED
+    ):
+        self.root = root
+        self.index_path = index_path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.dedup = dedup
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._in_use: Set[str] = set()
+        self._sweeper: Optional[asyncio.Task] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.index_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    holder TEXT
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    session_id TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    PRIMARY KEY (session_id, path)
+                )
+            """)
+            # Databases created before sessions recorded the process holding them
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(sessions)")]
+            if "holder" not in columns:
+                conn.execute("ALTER TABLE sessions ADD COLUMN holder TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_last_used ON sessions (last_used)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_files_path ON files (path)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def create_session(self) -> str:
+        """
+        Registers a new session (in use until finish()) and returns its ID.
+        """
+        session_id = str(uuid4())
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT INTO sessions (session_id, created_at, last_used, holder) VALUES (?, ?, ?, ?)",
+                (session_id, now, now, _process_id())
+            )
+            conn.commit()
+            self._in_use.add(session_id)
+        return session_id
+
+    def session_path(self, session_id: str, filename: str) -> str:
+        """
+        Returns where to write an uploaded file of a session, creating the session folder.
+        """
+        session_dir = os.path.join(self.root, session_id)
+        os.makedirs(session_dir, exist_ok=True)
+        return os.path.join(session_dir, os.path.basename(filename))
+
+    def add_file(self, session_id: str, path: str, digest: Optional[str] = None) -> str:
+        """
+        Records a file written to session_path() and returns the path to read it from.
+
+        With dedup enabled and a digest given, the file is moved to the shared
+        blob store (or dropped, if an identical file is already there).
+
+        Args:
+            session_id (str): The session the file belongs to.
+            path (str): Where the file was written.
+            digest (str, optional): Hex SHA-256 of the content.
+
+        Returns:
+            str: Path of the stored file.
+
+        Raises:
+            StorageQuotaError: If uploads exceed the quota even after evicting idle sessions.
+        """
+        size = os.path.getsize(path)
+        with self._lock:
+            conn = self._connect()
+            # Hold the database write lock from the blob check to the commit, so another
+            # process cannot delete the shared file in between (see _remove)
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                if self.dedup and digest:
+                    blob_dir = os.path.join(self.root, BLOB_DIR_NAME, digest[:2])
+                    os.makedirs(blob_dir, exist_ok=True)
+                    blob_path = os.path.join(blob_dir, digest + os.path.splitext(path)[1].lower())
+                    if os.path.exists(blob_path):
+                        os.remove(path)
+                    else:
+                        os.replace(path, blob_path)
+                    path = blob_path
+
+                conn.execute(
+                    "INSERT OR REPLACE INTO files (session_id, path, bytes) VALUES (?, ?, ?)",
+                    (session_id, path, size)
+                )
+                conn.execute("UPDATE sessions SET last_used = ? WHERE session_id = ?", (time.time(), session_id))
+
+            usage = self._evict_for_quota(conn, self._usage(conn))
+            upload_storage_bytes.set(usage)
+        if usage > self.max_bytes:
+            raise StorageQuotaError(
+                f"Upload storage is full ({usage} of {self.max_bytes} bytes in use); try again later."
+            )
+        return path
+
+    def acquire(self, session_id: str):
+        """
+        Marks an existing session as in use by this process (e.g. the job it
+        belongs to resumed after a restart, or was queued by another worker).
+        """
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "UPDATE sessions SET last_used = ?, holder = ? WHERE session_id = ?",
+                (time.time(), _process_id(), session_id)
+            )
+            conn.commit()
+            self._in_use.add(session_id)
+
+    def release(self, session_id: str):
+        """
+        Stops tracking a session handed over to another process (which acquires it).
+        Its files are kept; the session still records this process as its holder.
+        """
+        with self._lock:
+            self._in_use.discard(session_id)
+
+    def finish(self, session_id: str):
+        """
+        Deletes a session's files once the upload has been processed.
+        """
+        with self._lock:
+            conn = self._connect()
+            self._remove(conn, session_id, "finished")
+            conn.commit()
+            upload_storage_bytes.set(self._usage(conn))
+
+    def sweep(self) -> Dict[str, int]:
+        """
+        Removes idle sessions older than the TTL, then evicts idle sessions
+        (least recently used first) until uploads fit in the quota.
+
+        Returns:
+            dict: Sessions removed for each reason and the bytes still in use.
+        """
+        with self._lock:
+            conn = self._connect()
+            expired = conn.execute(
+                "SELECT session_id, holder FROM sessions WHERE last_used < ?", (time.time() - self.ttl_seconds,)
+            ).fetchall()
+            removed_ttl = 0
+            for session_id, holder in expired:
+                if not self._held(session_id, holder):
+                    self._remove(conn, session_id, "ttl")
+                    removed_ttl += 1
+            conn.commit()
+
+            usage = self._usage(conn)
+            before = upload_sessions_removed.value(reason="quota")
+            usage = self._evict_for_quota(conn, usage)
+            upload_storage_bytes.set(usage)
+        return {
+            "expired": removed_ttl,
+            "evicted": int(upload_sessions_removed.value(reason="quota") - before),
+            "bytes": usage
+        }
+
+    def adopt_orphans(self) -> int:
+        """
+        Registers session folders that are not in the index (e.g. written before
+        it existed) as idle sessions last used at their modification time, and
+        deletes shared files no session refers to. Scans the upload directory
+        once; call at start-up.
+
+        Returns:
+            int: Number of folders adopted.
+        """
+        if not os.path.isdir(self.root):
+            return 0
+        with self._lock:
+            conn = self._connect()
+            known = {row[0] for row in conn.execute("SELECT session_id FROM sessions")}
+            adopted = 0
+            for entry in os.scandir(self.root):
+                if not entry.is_dir() or entry.name == BLOB_DIR_NAME or entry.name in known:
+                    continue
+                files = [
+                    os.path.join(folder, name) for folder, _, names in os.walk(entry.path) for name in names
+                ]
+                mtime = entry.stat().st_mtime
+                conn.execute(
+                    "INSERT INTO sessions (session_id, created_at, last_used) VALUES (?, ?, ?)",
+                    (entry.name, mtime, mtime)
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO files (session_id, path, bytes) VALUES (?, ?, ?)",
+                    [(entry.name, path, os.path.getsize(path)) for path in files]
+                )
+                adopted += 1
+
+            blob_root = os.path.join(self.root, BLOB_DIR_NAME)
+            if os.path.isdir(blob_root):
+                referenced = {row[0] for row in conn.execute("SELECT DISTINCT path FROM files")}
+                for folder, _, names in os.walk(blob_root):
+                    for name in names:
+                        path = os.path.join(folder, name)
+                        if path not in referenced:
+                            os.remove(path)
+            conn.commit()
+            upload_storage_bytes.set(self._usage(conn))
+        return adopted
+
+    def stats(self) -> Dict:
+        """
+        Returns the number of sessions, how many this process is using and the bytes stored.
+        """
+        with self._lock:
+            conn = self._connect()
+            sessions = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            return {"sessions": sessions, "in_use": len(self._in_use), "bytes": self._usage(conn)}
+
+    async def start(self, adopt: bool = True):
+        """
+        Adopts leftover session folders and starts the background sweeper. Call from the app lifespan.
+
+        Args:
+            adopt (bool): Scan for leftover folders; only one of the processes sharing the storage should.
+        """
+        if adopt:
+            try:
+                adopted = await asyncio.to_thread(self.adopt_orphans)
+                if adopted:
+                    print(f"Adopted {adopted} upload folder(s) left from earlier runs; idle ones will be swept.")
+            except Exception as e:
+                print(f"Warning: Could not scan the upload directory: {e}")
+        self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        """
+        Stops the background sweeper.
+        """
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                print(f"Warning: Upload storage sweep failed: {e}")
+            await asyncio.sleep(UPLOAD_SWEEP_INTERVAL_SECONDS)
+
+    def _usage(self, conn: sqlite3.Connection) -> int:
+        # Shared files count once
+        return conn.execute(
+            "SELECT COALESCE(SUM(bytes), 0) FROM (SELECT MAX(bytes) AS bytes FROM files GROUP BY path)"
+        ).fetchone()[0]
+
+    def _evict_for_quota(self, conn: sqlite3.Connection, usage: int) -> int:
+        if usage <= self.max_bytes:
+            return usage
+        for session_id, holder in conn.execute(
+            "SELECT session_id, holder FROM sessions ORDER BY last_used"
+        ).fetchall():
+            if usage <= self.max_bytes:
+                break
+            if not self._held(session_id, holder):
+                usage -= self._remove(conn, session_id, "quota")
+        conn.commit()
+        return usage
+
+    def _held(self, session_id: str, holder: Optional[str]) -> bool:
+        # In use by this process, or by another one that is still running
+        if session_id in self._in_use:
+            return True
+        return holder != _process_id() and _holder_alive(holder)
+
+    def _remove(self, conn: sqlite3.Connection, session_id: str, reason: str) -> int:
+        """
+        Deletes a session and the files no other session shares. Returns the bytes freed.
+        """
+        files: List = conn.execute("SELECT path, bytes FROM files WHERE session_id = ?", (session_id,)).fetchall()
+        conn.execute("DELETE FROM files WHERE session_id = ?", (session_id,))
+        deleted = conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount
+        self._in_use.discard(session_id)
+
+        freed = 0
+        for path, size in files:
+            if conn.execute("SELECT 1 FROM files WHERE path = ? LIMIT 1", (path,)).fetchone() is None:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                freed += size
+        shutil.rmtree(os.path.join(self.root, session_id), ignore_errors=True)
+        if deleted:
+            upload_sessions_removed.inc(reason=reason)
+        return freed
+
+
+# Shared storage for the API's upload sessions
+upload_storage = UploadStorage(UPLOAD_DIR, os.path.join(CACHE_DIR, "uploads.sqlite3"))
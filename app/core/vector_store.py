@@ -1,22 +1,211 @@
 import os
-from typing import Dict
-from langchain_chroma import Chroma
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+import sys
+import time
+import asyncio
+import hashlib
+import argparse
+from typing import Dict, List, Optional, Set, Tuple
 from langchain_core.documents import Document
+from app.core.providers import INVOICE_COLLECTION, get_chroma_client, get_vector_store
+from app.core.invoice_index import invoice_index
+from app.core.lexical_index import lexical_index
+from app.core.answer_cache import answer_cache
+from app.core.ingest_writer import require_writer
+from app.core.metrics import span
 
-# Ensure Google API Key is set
-if not os.environ.get("GOOGLE_API_KEY"):
-    # Replace this with secure key loading in production (e.g., dotenv or secret manager)
-    os.environ["GOOGLE_API_KEY"] = "your-google-api-key-here"
+# Batch limits for ingest writes: flush once a batch is full or its oldest entry has waited this long
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "32"))
+INGEST_BATCH_WAIT_SECONDS = float(os.environ.get("INGEST_BATCH_WAIT_SECONDS", "0.05"))
 
-# Initialize Embeddings and Chroma Vector Store
-embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+# Separator between the invoice text and the LLM reasoning in stored documents
+DECISION_SEPARATOR = "\n\nLLM Decision: "
+
+# Documents read per page while compacting the vector store
+COMPACT_PAGE_SIZE = 1000
+
+# Invoice text included in an invoice's summary document; longer invoices are also stored as chunks
+INVOICE_SUMMARY_EXCERPT_CHARS = int(os.environ.get("INVOICE_SUMMARY_EXCERPT_CHARS", "600"))
+
+# Size of the chunk documents of long invoices, and how much consecutive chunks overlap
+INVOICE_CHUNK_CHARS = int(os.environ.get("INVOICE_CHUNK_CHARS", "1000"))
+INVOICE_CHUNK_OVERLAP_CHARS = int(os.environ.get("INVOICE_CHUNK_OVERLAP_CHARS", "150"))
+
+# Kinds of invoice documents (metadata "doc_type"); documents stored before chunking have none
+DOC_TYPE_SUMMARY = "summary"
+DOC_TYPE_CHUNK = "chunk"
+
+
+def hash_invoice_text(invoice_text: str) -> str:
+    """
+    Returns the content hash of an invoice's extracted text.
+    """
+    return hashlib.sha256(invoice_text.strip().encode("utf-8")).hexdigest()[:16]
+
+
+def make_invoice_doc_id(employee_name: str, content_hash: str, policy_id: str) -> str:
+    """
+    Returns the deterministic vector store ID of an analyzed invoice.
+
+    The same employee, invoice content and policy always map to the same ID, so
+    storing an invoice again replaces its document instead of adding a duplicate.
+
+    Args:
+        employee_name (str): Employee the invoice belongs to (case-insensitive).
+        content_hash (str): See hash_invoice_text.
+        policy_id (str): Content hash of the policy the invoice was analyzed against.
+
+    Returns:
+        str: A 32-character hex ID.
+    """
+    key = f"{(employee_name or '').strip().lower()}\x00{content_hash}\x00{policy_id or ''}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+def doc_id_for(text: str, metadata: Dict) -> str:
+    """
+    Returns the deterministic ID of a stored document from its text and metadata.
+    Documents stored without a content_hash (older ingests) are hashed from their invoice text.
+    """
+    content_hash = metadata.get("content_hash") or hash_invoice_text(text.split(DECISION_SEPARATOR, 1)[0])
+    return make_invoice_doc_id(metadata.get("employee_name", ""), content_hash, metadata.get("policy_id", ""))
+
+
+def split_invoice_text(
+    invoice_text: str, chunk_chars: int = INVOICE_CHUNK_CHARS, overlap_chars: int = INVOICE_CHUNK_OVERLAP_CHARS
+) -> List[str]:
+    """
+    Splits invoice text into chunks of at most chunk_chars, breaking between
+    lines where possible. Each chunk repeats the last lines of the previous one
+    (up to overlap_chars), so a table row is never only split across chunks.
+    """
+    chunk_chars = max(1, chunk_chars)
+    lines = []
+    for line in invoice_text.splitlines():
+        line = line.strip()
+        # Lines longer than a chunk are cut into pieces
+        lines.extend(line[start:start + chunk_chars] for start in range(0, len(line), chunk_chars))
+
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for line in lines:
+        if current and size + len(line) + 1 > chunk_chars:
+            chunks.append("\n".join(current))
+            carried: List[str] = []
+            carried_size = 0
+            for previous in reversed(current):
+                if carried_size + len(previous) + 1 > overlap_chars:
+                    break
+                carried.insert(0, previous)
+                carried_size += len(previous) + 1
+            current, size = carried, carried_size
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def build_invoice_documents(text: str, metadata: Dict, parent_id: str) -> List[Tuple[str, str, Dict]]:
+    """
+    Turns an analyzed invoice into the documents stored for it.
+
+    The summary document (stored under the invoice's deterministic ID) holds
+    the invoice's key fields, the LLM decision and the start of its text, so
+    it stays small however long the invoice is. Invoices longer than
+    INVOICE_SUMMARY_EXCERPT_CHARS are also stored as chunk documents, which
+    link back to the summary through their parent_id metadata.
+
+    Args:
+        text (str): Invoice content + LLM reasoning (see DECISION_SEPARATOR).
+        metadata (dict): Metadata of the invoice.
+        parent_id (str): The invoice's deterministic ID (see doc_id_for).
+
+    Returns:
+        List[Tuple[str, str, dict]]: ID, text and metadata of each document, summary first.
+    """
+    invoice_text, _, decision = text.partition(DECISION_SEPARATOR)
+    invoice_text = "\n".join(line.strip() for line in invoice_text.splitlines() if line.strip())
+    chunks = split_invoice_text(invoice_text) if len(invoice_text) > INVOICE_SUMMARY_EXCERPT_CHARS else []
+
+    amount = metadata.get("amount")
+    fields = [
+        ("Invoice", metadata.get("invoice_file")),
+        ("Invoice No", metadata.get("invoice_number")),
+        ("Vendor", metadata.get("vendor")),
+        ("Employee", metadata.get("employee_name")),
+        ("Category", metadata.get("category")),
+        ("Date", (metadata.get("date") or "")[:10]),
+        ("Amount", f"{amount} {metadata.get('currency') or ''}".strip() if amount is not None else None),
+        ("Status", metadata.get("status")),
+    ]
+    excerpt = invoice_text[:INVOICE_SUMMARY_EXCERPT_CHARS] + (" ..." if chunks else "")
+    summary = "\n".join(f"{label}: {value}" for label, value in fields if value not in (None, ""))
+    summary += f"\n\n{excerpt}{DECISION_SEPARATOR}{decision or metadata.get('reason', '')}"
+
+    documents = [(parent_id, summary, {**metadata, "doc_type": DOC_TYPE_SUMMARY, "chunks": len(chunks)})]
+    for index, chunk in enumerate(chunks):
+        header = f"Invoice {metadata.get('invoice_file', '')}, part {index + 1} of {len(chunks)}:"
+        documents.append((
+            f"{parent_id}-{index}",
+            f"{header}\n{chunk}",
+            {**metadata, "doc_type": DOC_TYPE_CHUNK, "parent_id": parent_id, "chunk_index": index}
+        ))
+    return documents
+
+
+# Store a batch of invoice analysis texts and metadata
+def store_invoice_embeddings(texts: List[str], metadatas: List[Dict]):
+    """
+    Embeds a batch of texts and stores them in the Chroma vector store.
+
+    Each invoice is stored as a summary document plus, if it is long, chunk
+    documents (see build_invoice_documents). The whole batch is embedded with
+    a single embed_documents call and written with a single add_texts call
+    (one round-trip and one commit per batch). Documents are upserted under
+    IDs derived from the invoice's deterministic ID (see doc_id_for), so
+    storing the same invoice again replaces it instead of adding a duplicate.
+    The metadata is also recorded in the structured invoice index, the
+    documents are added to the keyword index, and cached chatbot answers whose
+    filters match the new invoices are invalidated.
+
+    Args:
+        texts (List[str]): Invoice contents + LLM reasoning.
+        metadatas (List[dict]): Metadata for each text, in the same order.
+    """
+    if len(texts) != len(metadatas):
+        raise ValueError("texts and metadatas must have the same length.")
+    if not texts:
+        return
+
+    # One document per ID: the same invoice twice in a batch is written once (last one wins)
+    invoices = {doc_id_for(text, metadata): (text, metadata) for text, metadata in zip(texts, metadatas)}
+    # The ID is also kept in the metadata, so the invoice index can be keyed on it
+    invoices = {doc_id: (text, {**metadata, "doc_id": doc_id}) for doc_id, (text, metadata) in invoices.items()}
+    metadatas = [metadata for _, metadata in invoices.values()]
+    documents = [
+        document
+        for parent_id, (text, metadata) in invoices.items()
+        for document in build_invoice_documents(text, metadata, parent_id)
+    ]
+
+    try:
+        with span("store_invoice_embeddings"):
+            # Embedding time is also reported on its own (span "embedding")
+            ids = [doc_id for doc_id, _, _ in documents]
+            texts = [text for _, text, _ in documents]
+            document_metadatas = [metadata for _, _, metadata in documents]
+            with span("vector_store_write"):
+                get_vector_store().add_texts(texts, metadatas=document_metadatas, ids=ids)
+            invoice_index.add_many(metadatas)
+            lexical_index.add_many(ids, texts, document_metadatas)
+            # Cached chatbot answers that could include these invoices are now stale
+            answer_cache.invalidate(metadatas)
+
+    except Exception as e:
+        # Handle unexpected errors
+        raise RuntimeError(f"Failed to store embedding: {str(e)}")
 
-vector_store = Chroma(
-    collection_name="invoice_analysis",              # Logical name for grouping
-    embedding_function=embeddings,                   # Embedding model
-    persist_directory="./chroma_langchain_db"        # Persistent storage location
-)
 
 # Store invoice analysis text and metadata
 def store_invoice_embedding(text: str, metadata: Dict):
@@ -27,10 +216,261 @@ def store_invoice_embedding(text: str, metadata: Dict):
         text (str): The full invoice content + LLM reasoning.
         metadata (dict): Information about employee, status, date, etc.
     """
-    try:
-        # Add to vector store
-        vector_store.add_texts([text], metadatas=[metadata])
+    store_invoice_embeddings([text], [metadata])
 
-    except Exception as e:
-        # Handle unexpected errors
-        raise RuntimeError(f"Failed to store embedding: {str(e)}")
\ No newline at end of file
+
+def find_stored_invoices(ids: List[str]) -> Dict[str, Dict]:
+    """
+    Looks up invoices already in the vector store by ID.
+
+    Args:
+        ids (List[str]): Deterministic invoice IDs (see make_invoice_doc_id).
+
+    Returns:
+        Dict[str, dict]: Metadata of each ID that is stored; missing IDs are left out.
+    """
+    if not ids:
+        return {}
+    with span("vector_store_lookup"):
+        found = get_vector_store().get(ids=list(dict.fromkeys(ids)), include=["metadatas"])
+    return {doc_id: metadata or {} for doc_id, metadata in zip(found["ids"], found["metadatas"])}
+
+
+def compact_invoice_store(dry_run: bool = False, page_size: int = COMPACT_PAGE_SIZE) -> Dict:
+    """
+    Removes duplicate invoice documents from the vector store and moves the
+    remaining ones to their deterministic IDs.
+
+    Documents are duplicates when they have the same employee, invoice content
+    and policy. The copy already under the deterministic ID is kept; otherwise
+    the most recently written copy is kept and re-stored under that ID with its
+    existing embedding (nothing is re-embedded). Chunk documents whose summary
+    is gone, or that are left over from a different chunk size, are removed
+    too. Cached chatbot answers are cleared afterwards, since search results
+    change.
+
+    Should be run while the API is stopped.
+
+    Args:
+        dry_run (bool): Only count what would change.
+        page_size (int): Documents read per page.
+
+    Returns:
+        dict: Documents scanned, duplicates removed, documents moved to their
+        deterministic ID and orphaned chunks removed.
+    """
+    collection = get_chroma_client().get_or_create_collection(INVOICE_COLLECTION)
+
+    # Pass 1: group invoice document IDs (in write order) by their deterministic ID
+    groups: Dict[str, List[str]] = {}
+    chunk_counts: Dict[str, int] = {}
+    chunks: List[Tuple[str, str, int]] = []
+    scanned = 0
+    while True:
+        page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=scanned)
+        if not page["ids"]:
+            break
+        for doc_id, text, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+            metadata = metadata or {}
+            if metadata.get("doc_type") == DOC_TYPE_CHUNK:
+                chunks.append((doc_id, metadata.get("parent_id"), metadata.get("chunk_index", 0)))
+                continue
+            groups.setdefault(doc_id_for(text or "", metadata), []).append(doc_id)
+            chunk_counts[doc_id] = metadata.get("chunks", 0)
+        scanned += len(page["ids"])
+
+    # Pass 2: pick the copy to keep in each group
+    to_delete: List[str] = []
+    to_move: Dict[str, str] = {}
+    for target_id, doc_ids in groups.items():
+        keep = target_id if target_id in doc_ids else doc_ids[-1]
+        to_delete.extend(doc_id for doc_id in doc_ids if doc_id != keep)
+        if keep != target_id:
+            to_move[keep] = target_id
+        chunk_counts[target_id] = chunk_counts[keep]
+
+    orphans = [
+        doc_id for doc_id, parent_id, index in chunks
+        if parent_id not in groups or index >= chunk_counts[parent_id]
+    ]
+    to_delete.extend(orphans)
+
+    if not dry_run:
+        moved_ids = list(to_move)
+        for start in range(0, len(moved_ids), page_size):
+            batch = collection.get(
+                ids=moved_ids[start:start + page_size], include=["documents", "metadatas", "embeddings"]
+            )
+            collection.upsert(
+                ids=[to_move[doc_id] for doc_id in batch["ids"]],
+                documents=batch["documents"],
+                metadatas=batch["metadatas"],
+                embeddings=batch["embeddings"]
+            )
+            lexical_index.add_many(
+                [to_move[doc_id] for doc_id in batch["ids"]], batch["documents"], batch["metadatas"]
+            )
+        stale = to_delete + moved_ids
+        for start in range(0, len(stale), page_size):
+            collection.delete(ids=stale[start:start + page_size])
+            lexical_index.delete(stale[start:start + page_size])
+        if stale:
+            answer_cache.clear()
+
+    return {
+        "documents": scanned,
+        "duplicates_removed": len(to_delete) - len(orphans),
+        "ids_migrated": len(to_move),
+        "orphan_chunks_removed": len(orphans)
+    }
+
+
+def backfill_invoice_index(page_size: int = COMPACT_PAGE_SIZE) -> int:
+    """
+    Fills an empty invoice index from the metadata already in the vector store
+    (e.g. invoices stored before the index existed).
+
+    Returns:
+        int: Number of invoices read from the vector store (0 if the index was not empty).
+    """
+    if not invoice_index.is_empty():
+        return 0
+    collection = get_chroma_client().get_or_create_collection(INVOICE_COLLECTION)
+    scanned = indexed = 0
+    while True:
+        page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=scanned)
+        if not page["ids"]:
+            break
+        metadatas = [
+            # Invoices stored before the ID was kept in the metadata
+            {**metadata, "doc_id": metadata.get("doc_id") or doc_id_for(text or "", metadata)}
+            for text, metadata in zip(page["documents"], page["metadatas"])
+            if metadata and metadata.get("doc_type") != DOC_TYPE_CHUNK
+        ]
+        invoice_index.add_many(metadatas)
+        indexed += len(metadatas)
+        scanned += len(page["ids"])
+    return indexed
+
+
+def backfill_lexical_index(page_size: int = COMPACT_PAGE_SIZE) -> int:
+    """
+    Fills an empty keyword index from the documents already in the vector store
+    (e.g. stored before the keyword index existed).
+
+    Returns:
+        int: Number of documents indexed (0 if the index was not empty).
+    """
+    if lexical_index.count() > 0:
+        return 0
+    collection = get_chroma_client().get_or_create_collection(INVOICE_COLLECTION)
+    indexed = 0
+    while True:
+        page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=indexed)
+        if not page["ids"]:
+            break
+        lexical_index.add_many(
+            page["ids"], [text or "" for text in page["documents"]], [metadata or {} for metadata in page["metadatas"]]
+        )
+        indexed += len(page["ids"])
+    return indexed
+
+
+class IngestBatcher:
+    """
+    Collects texts from any number of concurrent uploads into size- and
+    time-bounded batches and writes each batch with store_invoice_embeddings.
+
+    Callers await submit(), which resolves once their text has been stored
+    (or raises if the batch it was part of failed).
+    """
+
+    def __init__(self, max_batch_size: int = INGEST_BATCH_SIZE, max_wait: float = INGEST_BATCH_WAIT_SECONDS):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self._pending: List[Tuple[str, Dict, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._writes: Set[asyncio.Task] = set()
+
+    async def submit(self, text: str, metadata: Dict):
+        """
+        Queues one text for the next batch and waits until it has been stored.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, metadata, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush_pending()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush_pending)
+
+        await future
+
+    async def flush(self):
+        """
+        Writes any pending texts immediately and waits for all in-progress batches.
+        """
+        self._flush_pending()
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+    def _flush_pending(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._write(batch))
+            self._writes.add(task)
+            task.add_done_callback(self._writes.discard)
+
+    async def _write(self, batch: List[Tuple[str, Dict, asyncio.Future]]):
+        texts = [text for text, _, _ in batch]
+        metadatas = [metadata for _, metadata, _ in batch]
+        try:
+            await asyncio.to_thread(store_invoice_embeddings, texts, metadatas)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_result(None)
+
+
+# Shared batcher so concurrent uploads are written together
+ingest_batcher = IngestBatcher()
+
+
+def main(argv: Optional[list] = None):
+    """
+    Command-line entry point for vector store maintenance.
+
+    Example:
+        python -m app.core.vector_store compact --dry-run
+    """
+    parser = argparse.ArgumentParser(description="Maintain the invoice vector store.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    compact = commands.add_parser("compact", help="Remove duplicate invoice documents and orphaned chunks")
+    compact.add_argument("--dry-run", action="store_true", help="Only report what would be removed")
+    args = parser.parse_args(argv)
+
+    if not args.dry_run:
+        require_writer("compact")
+    start = time.perf_counter()
+    result = compact_invoice_store(dry_run=args.dry_run)
+    action = "Would remove" if args.dry_run else "Removed"
+    print(
+        f"Scanned {result['documents']} document(s) in {time.perf_counter() - start:.2f}s. "
+        f"{action} {result['duplicates_removed']} duplicate(s), "
+        f"{result['ids_migrated']} document(s) {'to move' if args.dry_run else 'moved'} to deterministic IDs, "
+        f"{result['orphan_chunks_removed']} orphaned chunk(s).",
+        file=sys.stderr
+    )
+
+
+if __name__ == "__main__":
+    main()
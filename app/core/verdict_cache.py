@@ -0,0 +1,160 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Dict, Optional
+from app.core.config import CACHE_DIR
+
+# Eviction limits for stored verdicts
+VERDICT_CACHE_MAX_ENTRIES = int(os.environ.get("VERDICT_CACHE_MAX_ENTRIES", "10000"))
+VERDICT_CACHE_TTL_SECONDS = float(os.environ.get("VERDICT_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+
+def normalize_text(text: str) -> str:
+    """
+    Collapses whitespace so that trivially different extractions hash the same.
+    """
+    return " ".join(text.split())
+
+
+def make_verdict_key(policy_text: str, invoice_text: str, prompt_version: str) -> str:
+    """
+    Builds a content-addressed cache key for an (policy, invoice, prompt) triple.
+
+    Args:
+        policy_text (str): The reimbursement policy text sent to the LLM.
+        invoice_text (str): The invoice text sent to the LLM.
+        prompt_version (str): Version of the prompt template used.
+
+    Returns:
+        str: Hex SHA-256 digest identifying the verdict.
+    """
+    digest = hashlib.sha256()
+    for part in (prompt_version, normalize_text(policy_text), normalize_text(invoice_text)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class VerdictCache:
+    """
+    Persistent SQLite cache of LLM reimbursement verdicts.
+
+    Entries expire after ttl_seconds and the least recently used entries are
+    evicted once more than max_entries are stored. Hit/miss counters are kept
+    in memory for the lifetime of the process.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = VERDICT_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = VERDICT_CACHE_TTL_SECONDS
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS verdicts (
+                    key TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    reason TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_verdicts_last_used ON verdicts (last_used)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[Dict]:
+        """
+        Returns the cached verdict for a key, or None on a miss or expired entry.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT status, reason, created_at FROM verdicts WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            status, reason, created_at = row
+            if now - created_at > self.ttl_seconds:
+                conn.execute("DELETE FROM verdicts WHERE key = ?", (key,))
+                conn.commit()
+                self.evictions += 1
+                self.misses += 1
+                return None
+
+            conn.execute("UPDATE verdicts SET last_used = ? WHERE key = ?", (now, key))
+            conn.commit()
+            self.hits += 1
+            return {"status": status, "reason": reason}
+
+    def put(self, key: str, verdict: Dict):
+        """
+        Stores a verdict and evicts expired / least recently used entries if needed.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO verdicts (key, status, reason, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, verdict["status"], verdict["reason"], now, now)
+            )
+            self.evictions += conn.execute(
+                "DELETE FROM verdicts WHERE created_at < ?", (now - self.ttl_seconds,)
+            ).rowcount
+
+            overflow = conn.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self.evictions += conn.execute(
+                    "DELETE FROM verdicts WHERE key IN (SELECT key FROM verdicts ORDER BY last_used LIMIT ?)",
+                    (overflow,)
+                ).rowcount
+            conn.commit()
+
+    def clear(self):
+        """
+        Removes every cached verdict.
+        """
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM verdicts")
+            conn.commit()
+
+    def stats(self) -> Dict:
+        """
+        Returns hit/miss/eviction counters and the number of stored entries.
+        """
+        with self._lock:
+            entries = self._connect().execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+# Shared cache used by the invoice analyzer
+verdict_cache = VerdictCache(os.path.join(CACHE_DIR, "verdicts.sqlite3"))
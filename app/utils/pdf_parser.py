@@ -2,8 +2,30 @@ import fitz  # PyMuPDF - used for working with PDF files
 import zipfile
 import os
 import re
-from typing import List, Optional
-from datetime import datetime
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+from datetime import date
+from app.core.metrics import span
+
+
+def extract_text_and_page_count(source: Union[str, bytes]) -> Tuple[str, int]:
+    """
+    Extracts all text content and the page count from a PDF file or in-memory PDF.
+
+    Args:
+        source (str | bytes): Path to the PDF file, or its raw content.
+
+    Returns:
+        Tuple[str, int]: The extracted text from all pages, and the number of pages.
+
+    Raises:
+        Exception: Whatever PyMuPDF raises for unreadable documents.
+    """
+    doc = fitz.open(stream=source, filetype="pdf") if isinstance(source, bytes) else fitz.open(source)
+    with doc:
+        # Join once instead of repeated string concatenation
+        return "".join(page.get_text() for page in doc), doc.page_count
 
 
 def extract_text_from_pdf(pdf_path: str) -> str:
@@ -18,15 +40,84 @@ def extract_text_from_pdf(pdf_path: str) -> str:
     """
     text = ""
     try:
-        with fitz.open(pdf_path) as doc:
-            for page in doc:
-                text += page.get_text()
+        with span("pdf_parse"):
+            text, _ = extract_text_and_page_count(pdf_path)
     except Exception as e:
         # Catching unexpected issues during PDF reading
         print(f"Error reading PDF file '{pdf_path}': {e}")
     return text
 
 
+def extract_text_from_pdf_bytes(data: bytes, name: str = "<memory>") -> str:
+    """
+    Extracts all text content from a PDF held in memory (e.g. a ZIP member).
+
+    Args:
+        data (bytes): Raw PDF content.
+        name (str): Name used in error messages.
+
+    Returns:
+        str: The extracted text from all pages of the PDF.
+    """
+    text = ""
+    try:
+        with span("pdf_parse"):
+            text, _ = extract_text_and_page_count(data)
+    except Exception as e:
+        print(f"Error reading PDF file '{name}': {e}")
+    return text
+
+
+def iter_pdf_members(zip_ref: zipfile.ZipFile, max_member_bytes: Optional[int] = None) -> Iterator[zipfile.ZipInfo]:
+    """
+    Lazily yields the PDF members of an open ZIP archive, including those in sub-folders.
+
+    Members larger than max_member_bytes (uncompressed) are skipped with a warning.
+
+    Args:
+        zip_ref (zipfile.ZipFile): An open ZIP archive.
+        max_member_bytes (int, optional): Maximum uncompressed size of one PDF.
+
+    Yields:
+        zipfile.ZipInfo: One entry per PDF member.
+    """
+    for info in zip_ref.infolist():
+        name = info.filename
+        if info.is_dir() or not name.lower().endswith(".pdf"):
+            continue
+        if name.startswith("__MACOSX/") or os.path.basename(name).startswith("._"):
+            continue  # macOS resource forks, not real PDFs
+        if max_member_bytes is not None and info.file_size > max_member_bytes:
+            print(f"Warning: Skipping '{name}' ({info.file_size} bytes exceeds the per-invoice limit).")
+            continue
+        yield info
+
+
+def read_zip_member(zip_ref: zipfile.ZipFile, info: zipfile.ZipInfo, max_bytes: Optional[int] = None) -> bytes:
+    """
+    Reads one ZIP member into memory without extracting it to disk.
+
+    Args:
+        zip_ref (zipfile.ZipFile): An open ZIP archive.
+        info (zipfile.ZipInfo): The member to read.
+        max_bytes (int, optional): Maximum number of bytes to decompress.
+
+    Returns:
+        bytes: The member content.
+
+    Raises:
+        ValueError: If the member decompresses to more than max_bytes.
+    """
+    with zip_ref.open(info) as member:
+        if max_bytes is None:
+            return member.read()
+        # Read one byte past the limit so a lying size header cannot inflate unchecked
+        data = member.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise ValueError(f"'{info.filename}' exceeds the per-invoice size limit of {max_bytes} bytes.")
+    return data
+
+
 def extract_pdfs_from_zip(zip_path: str, extract_dir: str) -> List[str]:
     """
     Extracts all PDF files from a ZIP archive to a specified directory.
@@ -65,6 +156,196 @@ def extract_pdfs_from_zip(zip_path: str, extract_dir: str) -> List[str]:
     return pdf_files
 
 
+# Receipt layouts that print a column of labels after the column of values they belong to
+_STACKED_LABEL_LINE = re.compile(r"^[A-Za-z][A-Za-z ]*:\s*(?:\d+(?:\.\d+)?\s*%)?$")
+_STACKED_VALUE_LINE = re.compile(r"^(?:₹|rs\.?|inr)?\s*(\d[\d,]*\.\d{2})$", re.IGNORECASE)
+_STACKED_TOTAL_LABELS = {"total:", "grand total:", "total amount:", "amount payable:"}
+
+
+def _stacked_total(text: str) -> Optional[float]:
+    """
+    Finds the total in receipts whose labels ("Sub Total:", "CGST: 5%", "Total:")
+    follow the values they belong to, pairing the labels with the values above them.
+    """
+    lines = [line.strip() for line in text.splitlines()]
+    for index, line in enumerate(lines):
+        if line.lower() not in _STACKED_TOTAL_LABELS:
+            continue
+        first = index
+        while first > 0 and _STACKED_LABEL_LINE.match(lines[first - 1]):
+            first -= 1
+        last = index
+        while last + 1 < len(lines) and _STACKED_LABEL_LINE.match(lines[last + 1]):
+            last += 1
+
+        values = []
+        cursor = first - 1
+        while cursor >= 0 and _STACKED_VALUE_LINE.match(lines[cursor]):
+            values.insert(0, _STACKED_VALUE_LINE.match(lines[cursor]).group(1))
+            cursor -= 1
+
+        labels = last - first + 1
+        if len(values) >= labels:
+            return float(values[len(values) - labels + (index - first)].replace(",", ""))
+    return None
+
+
+# === Single-pass field scan ===
+
+_MONTHS = {
+    name: number
+    for number, names in enumerate(
+        [("jan", "january"), ("feb", "february"), ("mar", "march"), ("apr", "april"), ("may", "may"),
+         ("jun", "june"), ("jul", "july"), ("aug", "august"), ("sep", "september"), ("oct", "october"),
+         ("nov", "november"), ("dec", "december")],
+        start=1
+    )
+    for name in names
+}
+_MONTH_NAME = r"(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]{0,6}"
+
+# Date layouts, most trusted first: the first valid date of the best layout wins
+# (DD/MM/YYYY, DD-MM-YYYY, YYYY-MM-DD, YYYY/MM/DD, DD.MM.YYYY, "25 Jul 2024", "Dec 3, 2024")
+_DMY_RANKS = {"/": 0, "-": 1, ".": 4}
+_YMD_RANKS = {"-": 2, "/": 3}
+_DAY_MONTH_RANK = 5
+_MONTH_DAY_RANK = 6
+
+# Labels of the payable total, most specific first; "Sub Total" is not a total
+_AMOUNT_LABELS = ["grand total", "total amount", "total fare", "amount payable", "total", "net amount"]
+
+# Labels of the invoice number, most specific first
+_NUMBER_LABELS = ["invoice", "bill", "receipt", "order", "booking", "ticket", "pnr"]
+
+# Currency symbols and codes, as ISO 4217 codes
+_CURRENCIES = {"₹": "INR", "rs": "INR", "rs.": "INR", "inr": "INR", "$": "USD", "usd": "USD",
+               "€": "EUR", "eur": "EUR", "£": "GBP", "gbp": "GBP"}
+
+# Every field is an alternative of one pattern, so the text is scanned once. Labels and
+# currency codes start at a word boundary, so positions inside words are rejected early;
+# "Sub Total" is matched (and ignored) so that its value is not read as the total.
+_FIELD_PATTERN = re.compile(
+    r"\b(?:"
+    r"(?P<amount>(?i:(?P<amount_label>sub ?total|"
+    + "|".join(re.escape(label).replace(r"\ ", r"\s+") for label in _AMOUNT_LABELS)
+    + r")\b\s*(?:\(₹\))?\s*[:\-]?\s*(?P<amount_currency>₹|rs\.?|inr|\$)?\s*(?P<amount_value>\d[\d,]*(?:\.\d{1,2})?)))"
+    r"|(?P<number>(?i:(?P<number_label>" + "|".join(_NUMBER_LABELS) + r")\s*"
+    r"(?:(?:number|no|id)\b\.?|#)\s*[:#\-]?\s*)(?P<number_value>[A-Za-z0-9][A-Za-z0-9/\-]*\d[A-Za-z0-9/\-]*))"
+    r"|(?P<vendor>(?i:(?:vendor|merchant|seller|supplier|sold\s+by|billed\s+by)\s*[:\-]\s*)"
+    r"(?P<vendor_value>[^\n]{2,60}))"
+    r"|(?P<code>(?i:rs|inr|usd|eur|gbp)\b))"
+    r"|(?P<dmy>\d{2}(?P<dmy_sep>[/.\-])\d{2}(?P=dmy_sep)\d{4})"
+    r"|(?P<ymd>\d{4}(?P<ymd_sep>[/\-])\d{2}(?P=ymd_sep)\d{2})"
+    r"|(?P<day_month>(?P<dm_day>\d{1,2}) ?(?P<dm_month>" + _MONTH_NAME + r") (?P<dm_year>\d{4}))"
+    r"|(?P<month_day>(?P<md_month>" + _MONTH_NAME + r") (?P<md_day>\d{1,2}), (?P<md_year>\d{4}))"
+    r"|(?P<symbol>[₹$€£])"
+)
+
+# First lines that are document titles, greetings or boilerplate rather than the issuer's name
+_HEADING_SKIP = re.compile(
+    r"\d|[:?!@]|invoice|receipt|ticket|bill|\b(?:welcome|original|customer|tax|copy|statement|to)\b",
+    re.IGNORECASE
+)
+_HEADING_LINES = 5
+
+
+def _iso_date(year: int, month: Optional[int], day: int) -> Optional[str]:
+    if month is None:
+        return None
+    try:
+        return date(year, month, day).isoformat()
+    except ValueError:
+        return None
+
+
+def _heading(text: str) -> Optional[str]:
+    """
+    Returns the issuer's name printed at the top of an invoice ("WEST HOLLYWOOD",
+    "Bangalore Food Place"): the first short line that is not a title, greeting or
+    field, among the first few non-empty lines.
+    """
+    lines = [line.strip() for line in text[:1000].splitlines() if line.strip()][:_HEADING_LINES]
+    for line in lines:
+        if 3 <= len(line) <= 40 and not _HEADING_SKIP.search(line):
+            return line
+    return None
+
+
+def scan_invoice_text(text: str) -> Dict[str, Any]:
+    """
+    Extracts the date, total amount, currency, vendor and invoice number of an
+    invoice in a single pass over its text.
+
+    All fields are alternatives of one precompiled pattern; each match is ranked
+    (more specific labels and trusted date layouts first) and the best one of each
+    field is kept. Dates are validated without strptime. Receipts that print their
+    labels below a column of values fall back to _stacked_total.
+
+    Args:
+        text (str): Full text content of an invoice.
+
+    Returns:
+        dict: date (YYYY-MM-DD), amount (float), currency (ISO code), vendor and
+        invoice_number, each None if not found.
+    """
+    best_date, date_rank = None, _MONTH_DAY_RANK + 1
+    amount, amount_rank, amount_currency = None, len(_AMOUNT_LABELS), None
+    number, number_rank = None, len(_NUMBER_LABELS)
+    vendor = currency = None
+
+    for match in _FIELD_PATTERN.finditer(text):
+        kind = match.lastgroup
+        if kind == "amount":
+            label = " ".join(match.group("amount_label").lower().split())
+            if label.startswith("sub"):
+                continue
+            rank = _AMOUNT_LABELS.index(label)
+            # The last total of the most specific label wins
+            if rank <= amount_rank:
+                amount, amount_rank = float(match.group("amount_value").replace(",", "")), rank
+                amount_currency = match.group("amount_currency")
+        elif kind == "number":
+            rank = _NUMBER_LABELS.index(match.group("number_label").lower())
+            if rank < number_rank:
+                number, number_rank = match.group("number_value").rstrip("/-"), rank
+        elif kind == "vendor":
+            vendor = vendor or match.group("vendor_value").strip()
+        elif kind in ("code", "symbol"):
+            currency = currency or match.group(kind)
+        else:
+            if kind == "dmy":
+                raw = match.group("dmy")
+                rank = _DMY_RANKS[match.group("dmy_sep")]
+                year, month, day = int(raw[6:10]), int(raw[3:5]), int(raw[0:2])
+            elif kind == "ymd":
+                raw = match.group("ymd")
+                rank = _YMD_RANKS[match.group("ymd_sep")]
+                year, month, day = int(raw[0:4]), int(raw[5:7]), int(raw[8:10])
+            elif kind == "day_month":
+                rank = _DAY_MONTH_RANK
+                year, month, day = (int(match.group("dm_year")), _MONTHS.get(match.group("dm_month").lower()),
+                                    int(match.group("dm_day")))
+            else:
+                rank = _MONTH_DAY_RANK
+                year, month, day = (int(match.group("md_year")), _MONTHS.get(match.group("md_month").lower()),
+                                    int(match.group("md_day")))
+            if rank < date_rank:
+                parsed = _iso_date(year, month, day)
+                if parsed is not None:
+                    best_date, date_rank = parsed, rank
+
+    if amount is None:
+        amount = _stacked_total(text)
+    symbol = (amount_currency or currency or "").lower()
+    return {
+        "date": best_date,
+        "amount": amount,
+        "currency": _CURRENCIES.get(symbol),
+        "vendor": vendor or _heading(text),
+        "invoice_number": number
+    }
+
+
 def extract_invoice_date(text: str) -> Optional[str]:
     """
     Attempts to extract a valid date from invoice text using common formats.
@@ -74,6 +355,9 @@ def extract_invoice_date(text: str) -> Optional[str]:
     - DD-MM-YYYY
     - YYYY-MM-DD
     - YYYY/MM/DD
+    - DD.MM.YYYY
+    - DD Mon YYYY (e.g., 25 Jul 2024, 18Jun 2024, 5 August 2024)
+    - Mon DD, YYYY (e.g., Dec 3, 2024, August 5, 2024)
 
     Args:
         text (str): Full text content of an invoice.
@@ -81,23 +365,112 @@ def extract_invoice_date(text: str) -> Optional[str]:
     Returns:
         Optional[str]: The invoice date in ISO format (YYYY-MM-DD) if found, else None.
     """
-    # List of regex patterns to match common date formats
-    date_patterns = [
-        r"(\d{2}/\d{2}/\d{4})",       # e.g., 12/05/2024
-        r"(\d{2}-\d{2}-\d{4})",       # e.g., 12-05-2024
-        r"(\d{4}-\d{2}-\d{2})",       # e.g., 2024-05-12
-        r"(\d{4}/\d{2}/\d{2})"        # e.g., 2024/05/12
-    ]
-
-    for pattern in date_patterns:
-        match = re.search(pattern, text)
-        if match:
-            raw_date = match.group(1)
-            for fmt in ("%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d", "%Y/%m/%d"):
-                try:
-                    parsed_date = datetime.strptime(raw_date, fmt)
-                    return parsed_date.date().isoformat()  # Convert to YYYY-MM-DD format
-                except ValueError:
-                    # If format doesn't match, try the next one
-                    continue
-    return None  # No valid date found
\ No newline at end of file
+    return scan_invoice_text(text)["date"]
+
+def extract_invoice_amount(text: str) -> Optional[float]:
+    """
+    Attempts to extract the payable total from invoice text.
+
+    Looks for a number right after a total label (e.g. "Total Fare : ₹ 7377"),
+    possibly on the next line; the last match of the most specific label wins.
+    Receipts that print their labels below a column of values are handled too.
+
+    Args:
+        text (str): Full text content of an invoice.
+
+    Returns:
+        Optional[float]: The invoice total if found, else None.
+    """
+    return scan_invoice_text(text)["amount"]
+
+# Keywords that identify each expense category in invoice text
+CATEGORY_KEYWORDS = {
+    "meals": ["restaurant", "food", "meal", "table no", "dine", "cafe", "beverage", "biriyani", "menu"],
+    "cab": ["cab", "ride fee", "driver", "taxi", "pickup", "drop address", "uber", "ola"],
+    "travel": ["ticket", "pnr", "flight", "boarding", "passenger", "train", "bus", "journey", "fare"],
+    "accommodation": ["hotel", "room", "check-in", "check in", "stay", "lodging", "night"],
+}
+
+# Every category's keywords in one word-bounded pattern, so the text is scanned once
+_KEYWORD_CATEGORIES = {keyword: category for category, keywords in CATEGORY_KEYWORDS.items() for keyword in keywords}
+_KEYWORD_PATTERN = re.compile(
+    r"\b(" + "|".join(re.escape(k) for k in sorted(_KEYWORD_CATEGORIES, key=len, reverse=True)) + r")s?\b",
+    re.IGNORECASE
+)
+
+
+def score_invoice_categories(text: str) -> Dict[str, int]:
+    """
+    Counts the keyword matches of each expense category in invoice text.
+    """
+    scores = dict.fromkeys(CATEGORY_KEYWORDS, 0)
+    for keyword in _KEYWORD_PATTERN.findall(text):
+        scores[_KEYWORD_CATEGORIES[keyword.lower()]] += 1
+    return scores
+
+
+def detect_invoice_category(text: str) -> Optional[str]:
+    """
+    Guesses the expense category of an invoice from keyword matches.
+
+    Args:
+        text (str): Full text content of an invoice.
+
+    Returns:
+        Optional[str]: One of the CATEGORY_KEYWORDS keys, or None if nothing matched.
+    """
+    return extract_invoice_fields(text).category
+
+
+@dataclass(frozen=True)
+class InvoiceFields:
+    """
+    Structured fields pulled out of an invoice's text.
+    """
+    category: Optional[str]
+    # True when the category clearly outscores every other one
+    category_confident: bool
+    amount: Optional[float]
+    date: Optional[str]
+    # ISO 4217 code of the total's currency (e.g. "INR")
+    currency: Optional[str] = None
+    vendor: Optional[str] = None
+    invoice_number: Optional[str] = None
+
+    def as_metadata(self) -> Dict[str, Any]:
+        """
+        Returns the fields that were found, as vector store metadata
+        (which cannot hold None values).
+        """
+        fields = {
+            "category": self.category, "amount": self.amount, "currency": self.currency,
+            "vendor": self.vendor, "invoice_number": self.invoice_number
+        }
+        return {key: value for key, value in fields.items() if value is not None}
+
+
+@lru_cache(maxsize=256)
+def extract_invoice_fields(text: str) -> InvoiceFields:
+    """
+    Extracts the category, total amount, date, currency, vendor and invoice
+    number of an invoice, with one scan for the keywords and one for the rest
+    (see scan_invoice_text).
+
+    The category counts as confident when it has at least two keyword matches
+    and at least twice as many as the runner-up. Results are cached per text,
+    so the policy section lookup, the rules and the vector store metadata of
+    an invoice share one extraction.
+
+    Args:
+        text (str): Full text content of an invoice.
+
+    Returns:
+        InvoiceFields: The extracted fields (None where not found).
+    """
+    scores = sorted(score_invoice_categories(text).items(), key=lambda item: item[1], reverse=True)
+    (category, best), (_, second) = scores[0], scores[1]
+    return InvoiceFields(
+        category=category if best > 0 else None,
+        category_confident=best >= 2 and best >= 2 * second,
+        **scan_invoice_text(text)
+    )
@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import zipfile
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, asdict
+from typing import Iterable, Iterator, Optional, Set, Tuple, Union
+from app.utils.pdf_parser import extract_text_and_page_count, iter_pdf_members
+from app.core.metrics import span
+
+# Number of worker processes used for PDF text extraction (0 = extract in the calling thread)
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", str(os.cpu_count() or 2)))
+
+# A PDF to extract: a file path, raw bytes, or a (zip_path, member_name) pair
+PdfSource = Union[str, bytes, Tuple[str, str]]
+
+
+@dataclass
+class ExtractionResult:
+    """
+    Text extracted from one PDF, with its page count and extraction time.
+    """
+    name: str
+    text: str
+    pages: int
+    seconds: float
+    error: Optional[str] = None
+
+
+def extract_document(name: str, source: PdfSource) -> ExtractionResult:
+    """
+    Extracts one PDF. Runs inside a worker process, so it must stay picklable.
+
+    Args:
+        name (str): Display name of the document.
+        source (PdfSource): Path, raw bytes or (zip_path, member_name) of the PDF.
+
+    Returns:
+        ExtractionResult: The extracted text, or an empty text and the error message.
+    """
+    start = time.perf_counter()
+    try:
+        if isinstance(source, tuple):
+            zip_path, member_name = source
+            with zipfile.ZipFile(zip_path) as zip_ref:
+                source = zip_ref.read(member_name)
+        text, pages = extract_text_and_page_count(source)
+        return ExtractionResult(name, text, pages, time.perf_counter() - start)
+    except Exception as e:
+        return ExtractionResult(name, "", 0, time.perf_counter() - start, error=str(e))
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_pdf_pool() -> Optional[ProcessPoolExecutor]:
+    """
+    Returns the shared extraction pool, creating it on first use.
+    Returns None when PDF_WORKERS is 0.
+    """
+    global _pool
+    if PDF_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # "spawn" keeps workers free of the parent's threads, sockets and DB handles
+            _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown_pdf_pool():
+    """
+    Stops the shared extraction pool (a new one is created on next use).
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+            _pool = None
+
+
+def _reset_broken_pool(pool: ProcessPoolExecutor):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def extract_async(name: str, source: PdfSource) -> ExtractionResult:
+    """
+    Extracts one PDF in the process pool without blocking the event loop.
+    Falls back to a worker thread if the pool is disabled or has crashed.
+    """
+    with span("pdf_parse"):
+        pool = get_pdf_pool()
+        if pool is not None:
+            try:
+                return await asyncio.get_running_loop().run_in_executor(pool, extract_document, name, source)
+            except BrokenProcessPool:
+                print("Warning: PDF worker pool crashed; extracting in a thread instead.")
+                _reset_broken_pool(pool)
+        return await asyncio.to_thread(extract_document, name, source)
+
+
+def extract_many(sources: Iterable[Tuple[str, PdfSource]], max_pending: Optional[int] = None) -> Iterator[ExtractionResult]:
+    """
+    Extracts many PDFs across all cores and yields each result as soon as it is ready.
+
+    At most max_pending documents are submitted at once, so memory stays bounded
+    even for very large inputs. Results arrive in completion order, not input order.
+
+    Args:
+        sources (Iterable[Tuple[str, PdfSource]]): (name, source) pairs; consumed lazily.
+        max_pending (int, optional): Submission window. Defaults to 4x the worker count.
+
+    Yields:
+        ExtractionResult: One result per source.
+    """
+    pool = get_pdf_pool()
+    if pool is None:
+        for name, source in sources:
+            yield extract_document(name, source)
+        return
+
+    window = max_pending or max(1, PDF_WORKERS) * 4
+    iterator = iter(sources)
+    pending: Set[Future] = set()
+
+    def fill():
+        for name, source in iterator:
+            pending.add(pool.submit(extract_document, name, source))
+            if len(pending) >= window:
+                break
+
+    fill()
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            pending.discard(future)
+            yield future.result()
+        fill()
+
+
+def iter_pdf_sources(paths: Iterable[str]) -> Iterator[Tuple[str, PdfSource]]:
+    """
+    Walks files and directories, yielding every PDF and every PDF inside a ZIP.
+
+    Args:
+        paths (Iterable[str]): Files or directories to scan.
+
+    Yields:
+        Tuple[str, PdfSource]: Display name and source of each PDF.
+    """
+    for root_path in paths:
+        if os.path.isdir(root_path):
+            files = (
+                os.path.join(folder, name)
+                for folder, _, names in os.walk(root_path)
+                for name in sorted(names)
+            )
+        else:
+            files = iter([root_path])
+
+        for path in files:
+            lowered = path.lower()
+            if lowered.endswith(".pdf"):
+                yield path, path
+            elif lowered.endswith(".zip"):
+                try:
+                    with zipfile.ZipFile(path) as zip_ref:
+                        members = [info.filename for info in iter_pdf_members(zip_ref)]
+                except zipfile.BadZipFile:
+                    print(f"Warning: '{path}' is not a valid ZIP archive.", file=sys.stderr)
+                    continue
+                for member in members:
+                    yield f"{path}::{member}", (path, member)
+
+
+def main(argv: Optional[list] = None):
+    """
+    Command-line entry point: extract text from PDFs and ZIPs of PDFs in bulk.
+
+    Example:
+        python -m app.utils.pdf_pool "task 1 dataset" --output texts.jsonl
+    """
+    parser = argparse.ArgumentParser(description="Extract text from PDFs (and ZIPs of PDFs) using all cores.")
+    parser.add_argument("paths", nargs="+", help="PDF files, ZIP files or directories to scan")
+    parser.add_argument("--output", help="Write one JSON object per document to this JSONL file")
+    parser.add_argument("--workers", type=int, help="Number of worker processes (default: PDF_WORKERS)")
+    args = parser.parse_args(argv)
+
+    global PDF_WORKERS
+    if args.workers is not None:
+        PDF_WORKERS = args.workers
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else None
+    start = time.perf_counter()
+    documents = pages = failures = 0
+    try:
+        for result in extract_many(iter_pdf_sources(args.paths)):
+            documents += 1
+            pages += result.pages
+            failures += result.error is not None
+            status = f"ERROR: {result.error}" if result.error else f"{result.pages} page(s)"
+            print(f"{result.seconds:8.3f}s  {status:<14} {result.name}", file=sys.stderr)
+            if out:
+                out.write(json.dumps(asdict(result)) + "\n")
+    finally:
+        if out:
+            out.close()
+        shutdown_pdf_pool()
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Extracted {documents} document(s), {pages} page(s), {failures} failure(s) "
+        f"in {elapsed:.2f}s ({documents / elapsed if elapsed else 0:.1f} docs/s)",
+        file=sys.stderr
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Micro-benchmark of invoice field extraction over synthetic invoice texts.
+
+Times the single-pass extract_invoice_fields against the previous extractors
+(one regex scan per date layout, total label and category, and strptime for
+every date candidate), kept below as a reference, and checks that both agree
+on the date, amount and category scores. Also checks that invoices from
+"task 1 dataset/" that must reach the LLM (e.g. bills listing alcohol) get
+no rule-based verdict.
+
+Example:
+    python -m benchmarks.extract --texts 5000
+"""
+import os
+import re
+import sys
+import json
+import time
+import zipfile
+import argparse
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional
+from app.core.policy_registry import PolicyRecord, build_policy_context, split_policy_sections
+from app.core.rules import pre_classify
+from app.utils.pdf_parser import (
+    CATEGORY_KEYWORDS, _stacked_total, extract_invoice_fields, extract_text_from_pdf, extract_text_from_pdf_bytes,
+    score_invoice_categories
+)
+from benchmarks.synthetic import INVOICE_KINDS, invoice_text
+
+# Extra date lines mixed into the texts, so every layout the extractor knows is exercised
+_DATE_LINES = [
+    "Printed: {day:%Y-%m-%d}", "Due Date: {day:%d-%m-%Y}", "Issued {day:%Y/%m/%d}", "Valid till {day:%d.%m.%Y}",
+    "Paid on {day.day} {day:%B %Y}", "Statement {day:%B} {day.day}, {day.year}", "Ref 31/02/2024",
+]
+
+# Real invoices (ZIP, member) that rules must leave to the LLM, with the policy they are checked against
+DATASET_DIR = "task 1 dataset"
+DATASET_POLICY = "Policy-Nov-2024.pdf"
+LLM_ONLY_INVOICES = [
+    ("Meal Invoice.zip", "Meal Invoice 6.pdf"),  # Itemised bill listing "Wines"
+]
+
+# === Reference: the extractors before the single-pass scan ===
+
+_LEGACY_DATE_PATTERNS = [
+    r"(\d{2}/\d{2}/\d{4})", r"(\d{2}-\d{2}-\d{4})", r"(\d{4}-\d{2}-\d{2})", r"(\d{4}/\d{2}/\d{2})",
+    r"(\d{2}\.\d{2}\.\d{4})", r"(\d{1,2} ?[A-Z][a-z]{2,8} \d{4})", r"([A-Z][a-z]{2,8} \d{1,2}, \d{4})"
+]
+_LEGACY_DATE_FORMATS = ("%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d", "%Y/%m/%d", "%d.%m.%Y",
+                        "%d %b %Y", "%d %B %Y", "%b %d, %Y", "%B %d, %Y")
+_LEGACY_AMOUNT_PATTERNS = [
+    re.compile(
+        r"(?<!sub )(?<!sub)\b" + re.escape(label).replace(r"\ ", r"\s+")
+        + r"\b\s*(?:\(₹\))?\s*[:\-]?\s*(?:₹|rs\.?|inr|\$)?\s*(\d[\d,]*(?:\.\d{1,2})?)",
+        re.IGNORECASE
+    )
+    for label in ["grand total", "total amount", "total fare", "amount payable", "total", "net amount"]
+]
+_LEGACY_CATEGORY_PATTERNS = {
+    category: re.compile(r"\b(?:" + "|".join(re.escape(k) for k in keywords) + r")s?\b", re.IGNORECASE)
+    for category, keywords in CATEGORY_KEYWORDS.items()
+}
+
+
+def legacy_date(text: str) -> Optional[str]:
+    for pattern in _LEGACY_DATE_PATTERNS:
+        for match in re.finditer(pattern, text):
+            raw_date = re.sub(r"^(\d{1,2})(?=[A-Z])", r"\1 ", match.group(1))
+            for fmt in _LEGACY_DATE_FORMATS:
+                try:
+                    return datetime.strptime(raw_date, fmt).date().isoformat()
+                except ValueError:
+                    continue
+    return None
+
+
+def legacy_amount(text: str) -> Optional[float]:
+    for pattern in _LEGACY_AMOUNT_PATTERNS:
+        matches = pattern.findall(text)
+        if matches:
+            return float(matches[-1].replace(",", ""))
+    return _stacked_total(text)
+
+
+def legacy_fields(text: str) -> Dict:
+    return {
+        "date": legacy_date(text),
+        "amount": legacy_amount(text),
+        "scores": {category: len(pattern.findall(text)) for category, pattern in _LEGACY_CATEGORY_PATTERNS.items()}
+    }
+
+
+def current_fields(text: str) -> Dict:
+    # Bypass the per-text cache, so every run measures the extraction itself
+    fields = extract_invoice_fields.__wrapped__(text)
+    return {"date": fields.date, "amount": fields.amount, "category": fields.category}
+
+
+def rule_verdicts(dataset_dir: str) -> Optional[List[str]]:
+    """
+    Returns the LLM_ONLY_INVOICES that pre_classify wrongly decides, or None if the dataset is missing.
+    """
+    policy_path = os.path.join(dataset_dir, DATASET_POLICY)
+    if not os.path.isfile(policy_path):
+        return None
+    text = extract_text_from_pdf(policy_path)
+    policy = PolicyRecord(policy_id="regression", text=text, sections=split_policy_sections(text))
+    wrong = []
+    for archive, member in LLM_ONLY_INVOICES:
+        with zipfile.ZipFile(os.path.join(dataset_dir, archive)) as zip_ref:
+            name = next(name for name in zip_ref.namelist() if os.path.basename(name) == member)
+            invoice = extract_text_from_pdf_bytes(zip_ref.read(name), member)
+        if pre_classify(build_policy_context(policy, invoice), invoice) is not None:
+            wrong.append(member)
+    return wrong
+
+
+# === Benchmark ===
+
+def synthetic_texts(count: int, seed: int) -> List[str]:
+    """
+    Returns count synthetic invoice texts, every other one with an extra date line.
+    """
+    texts = []
+    for number in range(count):
+        text = invoice_text(INVOICE_KINDS[number % len(INVOICE_KINDS)], number, seed)
+        if number % 2:
+            day = date(2023, 1, 1) + timedelta(days=number % 700)
+            line = _DATE_LINES[(number // 2) % len(_DATE_LINES)].format(day=day)
+            text = f"{line}\n{text}" if number % 4 == 1 else f"{text}\n{line}"
+        texts.append(text)
+    return texts
+
+
+def time_extractor(extract: Callable[[str], Dict], texts: List[str], repeat: int) -> float:
+    """
+    Best wall time, in seconds, of running extract over every text.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            extract(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Micro-benchmark of invoice field extraction.")
+    parser.add_argument("--texts", type=int, default=5000, help="Number of synthetic invoice texts")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per extractor; the fastest counts")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic invoices")
+    parser.add_argument("--dataset", default=DATASET_DIR, help="Directory of the real invoices and policy")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    texts = synthetic_texts(args.texts, args.seed)
+    results = {
+        name: time_extractor(extract, texts, args.repeat)
+        for name, extract in (("legacy", legacy_fields), ("single", current_fields))
+    }
+
+    mismatches = {"date": 0, "amount": 0, "category": 0}
+    for text in texts:
+        old, new = legacy_fields(text), extract_invoice_fields(text)
+        mismatches["date"] += old["date"] != new.date
+        mismatches["amount"] += old["amount"] != new.amount
+        mismatches["category"] += old["scores"] != score_invoice_categories(text)
+    wrong_rules = rule_verdicts(args.dataset)
+
+    report = {
+        "texts": len(texts),
+        "extractors": {
+            name: {
+                "seconds": round(seconds, 4),
+                "microseconds_per_text": round(seconds / len(texts) * 1e6, 1),
+                "texts_per_second": round(len(texts) / seconds, 1)
+            }
+            for name, seconds in results.items()
+        },
+        "speedup": round(results["legacy"] / results["single"], 2),
+        "mismatches": mismatches,
+        "rule_verdicts_for_llm_only_invoices": wrong_rules
+    }
+
+    print(f"{'extractor':<9} {'texts':>6} {'seconds':>8} {'us/text':>8} {'texts/s':>9}")
+    for name, m in report["extractors"].items():
+        print(f"{name:<9} {len(texts):>6} {m['seconds']:>8} {m['microseconds_per_text']:>8} {m['texts_per_second']:>9}")
+    print(f"Speedup: {report['speedup']}x; mismatches with the reference: {mismatches}")
+    if wrong_rules is None:
+        print(f"Skipped the rule checks: '{args.dataset}' not found.")
+    else:
+        print(f"Invoices wrongly decided by rules: {wrong_rules or 'none'}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 1 if any(mismatches.values()) or wrong_rules else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from typing import Any, AsyncIterator, List, Optional
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Verdicts handed out by the fake chat model, picked by a hash of the invoice text
+FAKE_STATUSES = ["Fully Reimbursed", "Partially Reimbursed", "Declined"]
+
+
+def _stable_hash(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+
+
+class _Faults:
+    """
+    Seeded source of simulated latency and failures, shared by the fakes.
+    """
+
+    def __init__(self, latency: float, jitter: float, failure_rate: float, seed: int):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def next_delay(self, base: float) -> float:
+        with self._lock:
+            spread = self._random.uniform(-self.jitter, self.jitter)
+        return max(0.0, base * (1 + spread))
+
+    def should_fail(self) -> bool:
+        if self.failure_rate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < self.failure_rate
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Local stand-in for the Gemini chat model.
+
+    Answers the analyzer's single and batched prompts with well-formed JSON
+    verdicts (deterministic per invoice text) and chatbot prompts with a short
+    markdown answer. Latency, jitter and failure rate are configurable; failures
+    raise RuntimeError like a failed API call.
+    """
+
+    latency: float = 0.2
+    token_latency: float = 0.01
+    jitter: float = 0.2
+    failure_rate: float = 0.0
+    seed: int = 0
+    calls: int = 0
+    faults: Any = None
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.faults = _Faults(self.latency, self.jitter, self.failure_rate, self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark-chat"
+
+    def _respond(self, messages: List[BaseMessage]) -> str:
+        self.calls += 1
+        if self.faults.should_fail():
+            raise RuntimeError("Simulated LLM failure")
+
+        prompt = messages[-1].content
+        if "invoice_id" in prompt:
+            # Batched analysis: one verdict per "### Invoice N" block
+            blocks = re.split(r"^### Invoice (\d+)\n", prompt, flags=re.MULTILINE)[1:]
+            verdicts = []
+            for number, text in zip(blocks[::2], blocks[1::2]):
+                status = FAKE_STATUSES[_stable_hash(text) % len(FAKE_STATUSES)]
+                verdicts.append({"invoice_id": int(number), "status": status, "reason": f"Synthetic verdict: {status}"})
+            return json.dumps(verdicts)
+
+        if "## Invoice:" in prompt:
+            invoice = prompt.split("## Invoice:", 1)[1]
+            status = FAKE_STATUSES[_stable_hash(invoice) % len(FAKE_STATUSES)]
+            return json.dumps({"status": status, "reason": f"Synthetic verdict: {status}"})
+
+        return (
+            "Based on the retrieved invoices, the reimbursement decisions follow the policy limits "
+            "for each expense category. Declined items exceeded the allowed amounts."
+        )
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.faults.next_delay(self.latency))
+        content = self._respond(messages)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.faults.next_delay(self.latency))
+        content = self._respond(messages)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.faults.next_delay(self.latency))
+        content = self._respond(messages)
+        for word in re.findall(r"\S+\s*", content):
+            await asyncio.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word))
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Local stand-in for the Gemini embedding model.
+
+    Vectors are deterministic per text (seeded by its hash). Each call waits
+    latency seconds plus per_text_latency per text, and fails with
+    failure_rate probability.
+    """
+
+    def __init__(
+        self,
+        size: int = 768,
+        latency: float = 0.05,
+        per_text_latency: float = 0.002,
+        jitter: float = 0.2,
+        failure_rate: float = 0.0,
+        seed: int = 0
+    ):
+        self.size = size
+        self.per_text_latency = per_text_latency
+        self.calls = 0
+        self.texts = 0
+        self.faults = _Faults(latency, jitter, failure_rate, seed)
+
+    def _vector(self, text: str) -> List[float]:
+        rng = random.Random(_stable_hash(text))
+        return [rng.gauss(0, 1) for _ in range(self.size)]
+
+    def _call(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.texts += len(texts)
+        time.sleep(self.faults.next_delay(self.faults.latency + self.per_text_latency * len(texts)))
+        if self.faults.should_fail():
+            raise RuntimeError("Simulated embedding failure")
+        return [self._vector(text) for text in texts]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._call(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._call([text])[0]
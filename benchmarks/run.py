@@ -0,0 +1,339 @@
+"""
+Offline benchmark of the upload, ingest and chatbot query paths.
+
+Gemini is replaced by FakeChatModel / FakeEmbeddings (configurable latency and
+failure rate) and invoices are synthetic PDFs, so runs are repeatable and free.
+Every run uses a fresh temporary cache and vector store directory.
+
+Example:
+    python -m benchmarks.run --uploads 4 --invoices-per-upload 50 --queries 100
+    python -m benchmarks.run --save-baseline        # record benchmarks/baselines.json
+    python -m benchmarks.run --fail-on-regression   # compare against it (exit code 1 on regression)
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import resource
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of a list of values (0 for an empty list).
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+class RssSampler:
+    """
+    Samples the resident set size of this process in the background and keeps the peak.
+    Falls back to the lifetime peak (ru_maxrss) where /proc is not available.
+    """
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def current() -> int:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+def summarize(latencies: List[float], items: int, wall: float, errors: int, peak_rss: int) -> Dict:
+    """
+    Latency percentiles (seconds), throughput and peak RSS of one scenario.
+    """
+    return {
+        "operations": len(latencies),
+        "items": items,
+        "errors": errors,
+        "p50_seconds": round(percentile(latencies, 50), 4),
+        "p95_seconds": round(percentile(latencies, 95), 4),
+        "p99_seconds": round(percentile(latencies, 99), 4),
+        "items_per_second": round(items / wall, 2) if wall else 0.0,
+        "wall_seconds": round(wall, 3),
+        "peak_rss_mb": round(peak_rss / (1024 * 1024), 1)
+    }
+
+
+def run_parallel(operation: Callable[[int], int], count: int, workers: int) -> Dict:
+    """
+    Runs operation(i) for i in range(count) on a thread pool and times each call.
+    The operation returns the number of items it handled and raises on failure.
+    """
+    latencies: List[float] = []
+    totals = {"items": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def timed(i: int):
+        start = time.perf_counter()
+        try:
+            items = operation(i)
+        except Exception as e:
+            with lock:
+                if not totals["errors"]:
+                    print(f"  first failure: {e}", file=sys.stderr)
+                totals["errors"] += 1
+            return
+        with lock:
+            latencies.append(time.perf_counter() - start)
+            totals["items"] += items
+
+    with RssSampler() as rss:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            list(executor.map(timed, range(count)))
+        wall = time.perf_counter() - start
+    return summarize(latencies, totals["items"], wall, totals["errors"], rss.peak)
+
+
+def bench_upload(client, args, workdir: str) -> Dict:
+    from benchmarks.synthetic import policy_pdf, write_invoice_zip
+
+    policy = policy_pdf()
+    zips = [
+        write_invoice_zip(os.path.join(workdir, f"upload-{i}.zip"), args.invoices_per_upload, args.seed,
+                          start=i * args.invoices_per_upload)
+        for i in range(args.uploads)
+    ]
+
+    def upload(i: int) -> int:
+        with open(zips[i], "rb") as f:
+            response = client.post(
+                "/analyze/upload",
+                data={"employee_name": f"Employee {i % 4}", "batch_mode": str(args.batch_mode).lower()},
+                files={"invoices_zip": (os.path.basename(zips[i]), f), "policy_pdf": ("policy.pdf", policy)}
+            )
+        response.raise_for_status()
+        return response.json()["num_invoices"]
+
+    return run_parallel(upload, args.uploads, args.upload_concurrency)
+
+
+def bench_ingest(args) -> Dict:
+    from app.core.vector_store import ingest_batcher
+
+    async def ingest() -> Dict:
+        latencies: List[float] = []
+        errors = 0
+
+        async def submit(i: int):
+            nonlocal errors
+            metadata = {
+                "employee_name": f"Ingest {i % 8}", "invoice_file": f"ingest-{i:06d}.pdf",
+                "policy_id": "benchmark", "status": "Declined", "reason": "Synthetic",
+                "date": "2024-06-01", "date_int": 20240601, "amount": float(i % 500)
+            }
+            start = time.perf_counter()
+            try:
+                await ingest_batcher.submit(f"Synthetic invoice {i} for benchmarking ingest", metadata)
+            except Exception as e:
+                if not errors:
+                    print(f"  first failure: {e}", file=sys.stderr)
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - start)
+
+        with RssSampler() as rss:
+            start = time.perf_counter()
+            await asyncio.gather(*(submit(i) for i in range(args.ingest)))
+            wall = time.perf_counter() - start
+        return summarize(latencies, len(latencies), wall, errors, rss.peak)
+
+    return asyncio.run(ingest())
+
+
+# Mix of RAG questions and index-answered aggregation questions; repeats exercise the caches
+QUERY_TEMPLATES = [
+    "Why was the cab invoice of {name} declined?",
+    "Which meal expenses of {name} exceeded the limit?",
+    "How many declined invoices did {name} have in 2024?",
+    "What is the total amount claimed by {name}?",
+    "Summarize the travel reimbursements for {name}.",
+]
+
+
+def bench_query(client, args) -> Dict:
+    def query(i: int) -> int:
+        template = QUERY_TEMPLATES[i % len(QUERY_TEMPLATES)]
+        name = f"Employee {(i // len(QUERY_TEMPLATES)) % 4}"
+        response = client.post("/chatbot/query", json={"query": template.format(name=name)})
+        response.raise_for_status()
+        return 1
+
+    return run_parallel(query, args.queries, args.query_concurrency)
+
+
+def bench_scaling(client, args) -> Dict[str, Dict]:
+    """
+    Runs /chatbot/query at increasing concurrency. Every question is new, so
+    each one goes through the vector search and the LLM (no cached answers),
+    and each level sends the same number of queries per worker. Throughput
+    should grow with concurrency up to the LLM concurrency limit. Run after
+    the upload scenario, so there are invoices to retrieve.
+    """
+    results = {}
+    offset = 0
+    for level in [int(level) for level in args.scaling_levels.split(",") if level.strip()]:
+        def query(i: int, offset=offset) -> int:
+            name = f"Employee {i % 4}"
+            response = client.post(
+                "/chatbot/query", json={"query": f"Explain reimbursement decision {offset + i} for {name}."}
+            )
+            response.raise_for_status()
+            return 1
+
+        count = level * args.scaling_queries_per_worker
+        results[f"query_x{level}"] = run_parallel(query, count, level)
+        offset += count
+    return results
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Lists regressions: p95 latency above, or throughput below, the baseline by more than tolerance.
+    """
+    regressions = []
+    for scenario, metrics in results.items():
+        base = baseline.get(scenario)
+        if not base:
+            continue
+        if base["p95_seconds"] and metrics["p95_seconds"] > base["p95_seconds"] * (1 + tolerance):
+            regressions.append(f"{scenario}: p95 {metrics['p95_seconds']}s vs baseline {base['p95_seconds']}s")
+        if base["items_per_second"] and metrics["items_per_second"] < base["items_per_second"] * (1 - tolerance):
+            regressions.append(
+                f"{scenario}: {metrics['items_per_second']} items/s vs baseline {base['items_per_second']} items/s"
+            )
+    return regressions
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline benchmark with a fake LLM and embedder.")
+    parser.add_argument("--uploads", type=int, default=4, help="Number of /analyze/upload requests")
+    parser.add_argument("--invoices-per-upload", type=int, default=30, help="Synthetic invoices per upload ZIP")
+    parser.add_argument("--upload-concurrency", type=int, default=2, help="Uploads sent in parallel")
+    parser.add_argument("--batch-mode", action="store_true", help="Upload with batch_mode=true")
+    parser.add_argument("--ingest", type=int, default=500, help="Texts submitted to the ingest batcher")
+    parser.add_argument("--queries", type=int, default=50, help="Number of /chatbot/query requests")
+    parser.add_argument("--query-concurrency", type=int, default=4, help="Queries sent in parallel")
+    parser.add_argument("--scaling-levels", default="1,2,4,8", help="Query concurrency levels of the scaling scenario")
+    parser.add_argument("--scaling-queries-per-worker", type=int, default=4, help="Queries per worker at each level")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Seconds per fake LLM call")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Seconds per fake embedding call")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Probability that a fake call fails")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for synthetic data and fake models")
+    parser.add_argument("--scenarios", default="upload,ingest,query,scaling", help="Comma-separated scenarios to run")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    parser.add_argument("--baseline", default=BASELINES_PATH, help="Baseline file to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown before flagging")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with code 1 on a regression")
+    args = parser.parse_args(argv)
+
+    # Isolate every run: settings are read when the app modules are imported
+    workdir = tempfile.mkdtemp(prefix="invoice-bench-")
+    os.environ["CACHE_DIR"] = os.path.join(workdir, "cache")
+    os.environ["CHROMA_PERSIST_DIRECTORY"] = os.path.join(workdir, "chroma")
+    os.environ["VECTOR_STORE_BACKEND"] = "local"
+    os.environ["INGEST_ROLE"] = "auto"
+    os.environ["UPLOAD_DIR"] = os.path.join(workdir, "uploads")
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+
+    from fastapi.testclient import TestClient
+    from app.core import providers
+    from app.core.embedding_cache import CachedEmbeddings, embedding_cache
+    from benchmarks.fakes import FakeChatModel, FakeEmbeddings
+    import main as app_main
+
+    llm = FakeChatModel(latency=args.llm_latency, failure_rate=args.failure_rate, seed=args.seed)
+    embeddings = FakeEmbeddings(latency=args.embedding_latency, failure_rate=args.failure_rate, seed=args.seed)
+    providers.set_llm(llm)
+    providers.set_embeddings(CachedEmbeddings(embeddings, "fake-embeddings", embedding_cache))
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    results: Dict[str, Dict] = {}
+    with TestClient(app_main.app) as client:
+        for scenario in scenarios:
+            print(f"Running {scenario} ...", file=sys.stderr)
+            if scenario == "upload":
+                results[scenario] = bench_upload(client, args, workdir)
+            elif scenario == "ingest":
+                results[scenario] = bench_ingest(args)
+            elif scenario == "query":
+                results[scenario] = bench_query(client, args)
+            elif scenario == "scaling":
+                results.update(bench_scaling(client, args))
+            else:
+                parser.error(f"Unknown scenario: {scenario}")
+
+    config = {key: value for key, value in vars(args).items()
+              if key not in ("scenarios", "output", "baseline", "save_baseline", "fail_on_regression", "tolerance")}
+    report = {"config": config, "results": results, "fake_calls": {"llm": llm.calls, "embeddings": embeddings.calls}}
+
+    print(f"{'scenario':<9} {'ops':>5} {'items':>6} {'err':>4} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'items/s':>9} {'rss MB':>7}")
+    for scenario, m in results.items():
+        print(f"{scenario:<9} {m['operations']:>5} {m['items']:>6} {m['errors']:>4} {m['p50_seconds']:>8} "
+              f"{m['p95_seconds']:>8} {m['p99_seconds']:>8} {m['items_per_second']:>9} {m['peak_rss_mb']:>7}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline found; run with --save-baseline to record one.")
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("config") != config:
+        print("Warning: the baseline was recorded with different settings; comparison may be misleading.")
+    regressions = compare(results, baseline.get("results", {}), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not regressions:
+        print(f"No regressions against the baseline (tolerance {args.tolerance:.0%}).")
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
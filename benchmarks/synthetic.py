@@ -0,0 +1,150 @@
+import random
+import zipfile
+from datetime import date, timedelta
+import fitz  # PyMuPDF - used to write the synthetic PDFs
+
+# Invoice layouts modeled on "task 1 dataset/" (cab receipts, restaurant bills, bus/flight e-tickets)
+INVOICE_KINDS = ["cab", "meal", "travel"]
+
+_NAMES = ["Sonya", "Rani", "Sushma", "Arjun", "Meera", "Vikram", "Asha", "Rahul"]
+_CITIES = ["Bangalore", "Chennai", "Surat", "Pune", "Mumbai", "Hyderabad", "Delhi"]
+_DISHES = [("Biriyani", 200), ("Paneer Tikka", 180), ("Masala Dosa", 90), ("Veg Thali", 150),
+           ("Fresh Lime Soda", 60), ("Royal Stag Whisky", 150), ("Gulab Jamun", 70)]
+
+POLICY_TEXT = """Reimbursement Policy
+
+1. Purpose
+This policy defines which business expenses employees may claim.
+
+2. General Rules
+Claims must be submitted within 30 days with an itemised invoice.
+Alcoholic beverages are never reimbursable.
+
+3. Food and Beverages
+Meals during business travel are reimbursed up to Rs. 1000 per day.
+
+4. Cab and Commute
+Cab rides for official work are reimbursed up to Rs. 200 per trip.
+
+5. Travel
+Bus, train and flight tickets are reimbursed up to Rs. 8000 per journey.
+
+6. Accommodation
+Hotel stays are reimbursed up to Rs. 5000 per night.
+"""
+
+
+def _pdf(lines: list) -> bytes:
+    doc = fitz.open()
+    page = doc.new_page()
+    y = 56
+    for line in lines:
+        if y > page.rect.height - 56:
+            page = doc.new_page()
+            y = 56
+        page.insert_text((56, y), line, fontsize=10)
+        y += 14
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def _cab(rng: random.Random, day: date, number: int) -> list:
+    fare = round(rng.uniform(80, 450), 2)
+    fee = rng.choice([0, 10, 20])
+    total = round(fare * 1.18 + fee)
+    return [
+        "Customer Ride Receipt", f"Invoice No: CAB-{number:06d}", f"Date: {day.strftime('%d/%m/%Y')}",
+        f"Pickup: {rng.choice(_CITIES)} Central", "Drop Address: Tech Park Gate 2",
+        f"Driver: {rng.choice(_NAMES)}", "Description", "Amount (Rs.)",
+        "Ride Fee", f"Rs. {fare}", "Booking Fee", f"Rs. {fee}", "Subtotal", f"Rs. {total}", "Total", f"Rs. {total}",
+    ]
+
+
+def _meal(rng: random.Random, day: date, number: int) -> list:
+    items = rng.sample(_DISHES, rng.randint(1, 4))
+    lines = [
+        "CAFE SYNTHETIC", "7677 State Road", f"Receipt No.: {number}",
+        f"Table No.: {rng.randint(1, 60)}", f"Date: {day.strftime('%b')} {day.day}, {day.year} 20:22",
+        "QTY/ Item Name   Price   Amount",
+    ]
+    subtotal = 0
+    for name, price in items:
+        qty = rng.randint(1, 3)
+        subtotal += qty * price
+        lines.append(f"{qty} {name}   {price:.2f}   {qty * price:.2f}")
+    tax = round(subtotal * 0.05, 2)
+    lines += [f"Sub Total: {subtotal:.2f}", f"CGST: 5% {tax:.2f}", f"SGST: 5% {tax:.2f}",
+              f"Total: {subtotal + 2 * tax:.2f}", "THANK YOU!!"]
+    return lines
+
+
+def _travel(rng: random.Random, day: date, number: int) -> list:
+    origin, destination = rng.sample(_CITIES, 2)
+    fare = rng.randint(1500, 11000)
+    return [
+        "eTICKET", f"{origin}To{destination}{day.strftime('%d %b %Y')}",
+        f"Ticket no: SYN{number:010d}", f"PNR no: P{rng.randint(10**8, 10**9)}",
+        f"{day.strftime('%d %b %Y')}", "Reporting Date", "Number of Passengers", "1",
+        "Passenger Details (Age, Gender)", f"{rng.choice(_NAMES)}, {rng.randint(22, 60)}, Female",
+        f"Total Fare : Rs. {fare}", f"Net amount : Rs. {round(fare / 1.18, 2)}",
+        "Terms & Conditions", "Each passenger is allowed to carry one bag of upto 10 kgs.",
+    ]
+
+
+_BUILDERS = {"cab": _cab, "meal": _meal, "travel": _travel}
+
+
+def invoice_pdf(kind: str, number: int, seed: int = 0) -> bytes:
+    """
+    Builds one synthetic invoice PDF. The same (kind, number, seed) always gives the same invoice.
+
+    Args:
+        kind (str): One of INVOICE_KINDS.
+        number (int): Invoice number, also used to vary the content.
+        seed (int): Seed of the generated dataset.
+
+    Returns:
+        bytes: The PDF file.
+    """
+    return _pdf(_invoice_lines(kind, number, seed))
+
+
+def invoice_text(kind: str, number: int, seed: int = 0) -> str:
+    """
+    Returns the text of the invoice invoice_pdf builds, without rendering a PDF.
+    """
+    return "\n".join(_invoice_lines(kind, number, seed))
+
+
+def _invoice_lines(kind: str, number: int, seed: int) -> list:
+    rng = random.Random(f"{seed}:{kind}:{number}")
+    day = date(2024, 1, 1) + timedelta(days=rng.randint(0, 365))
+    return _BUILDERS[kind](rng, day, number)
+
+
+def policy_pdf() -> bytes:
+    """
+    Builds a policy PDF with numbered category sections, like Policy-Nov-2024.pdf.
+    """
+    return _pdf(POLICY_TEXT.splitlines())
+
+
+def write_invoice_zip(path: str, count: int, seed: int = 0, start: int = 0) -> str:
+    """
+    Writes a ZIP of count synthetic invoices, cycling through the invoice kinds.
+
+    Args:
+        path (str): Where to write the ZIP.
+        count (int): Number of invoices.
+        seed (int): Seed of the generated dataset.
+        start (int): First invoice number, so several ZIPs can hold distinct invoices.
+
+    Returns:
+        str: The path of the ZIP.
+    """
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+        for number in range(start, start + count):
+            kind = INVOICE_KINDS[number % len(INVOICE_KINDS)]
+            zip_ref.writestr(f"{kind}/{kind}-{number:06d}.pdf", invoice_pdf(kind, number, seed))
+    return path
@@ -1,12 +1,131 @@
-from fastapi import FastAPI
+import time
+_import_started = time.perf_counter()
+
+import os
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from app.api import analyze, chatbot
+from app.core import providers, metrics
+from app.core.ingest_writer import ingest_writer
+from app.core.jobs import job_manager
+from app.core.llm_client import llm_client
+from app.core.upload_storage import upload_storage
+from app.core.vector_store import backfill_invoice_index, backfill_lexical_index
+from app.utils.pdf_pool import shutdown_pdf_pool
+
+providers.startup_timings["app_import"] = round(time.perf_counter() - _import_started, 4)
+
+# Create the LLM, embedding and vector store clients at startup instead of on the first request
+WARM_UP_ON_STARTUP = os.environ.get("WARM_UP_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Elect the single process that writes the vector store and runs upload jobs (see app.core.ingest_writer)
+    await ingest_writer.start()
+    if not ingest_writer.is_writer and providers.VECTOR_STORE_BACKEND == "local":
+        print(
+            "Warning: This process is a read replica, but the local vector store is not shared between "
+            "processes; invoices stored by the writer will not be visible here. "
+            "Set VECTOR_STORE_BACKEND=http (see README) or run a single worker."
+        )
+
+    if WARM_UP_ON_STARTUP:
+        try:
+            timings = await asyncio.to_thread(providers.warm_up)
+            print(f"Startup timings (seconds): {timings}")
+        except Exception as e:
+            print(f"Warning: Provider warm-up failed, clients will be created on first use: {e}")
+
+    if WARM_UP_ON_STARTUP and ingest_writer.is_writer:
+        # Index invoices stored before the structured invoice index existed
+        try:
+            await asyncio.to_thread(backfill_invoice_index)
+        except Exception as e:
+            print(f"Warning: Could not backfill the invoice index: {e}")
+
+        # Index documents stored before the keyword index existed
+        try:
+            await asyncio.to_thread(backfill_lexical_index)
+        except Exception as e:
+            print(f"Warning: Could not backfill the keyword index: {e}")
+
+    # Start the upload sweeper first, so resumed jobs can claim their upload sessions
+    await upload_storage.start(adopt=ingest_writer.is_writer)
+    # Start the background job workers (the writer resumes jobs interrupted by a restart)
+    await job_manager.start()
+    yield
+    await job_manager.stop()
+    await upload_storage.stop()
+    await ingest_writer.stop()
+    # Stop the PDF extraction worker processes
+    shutdown_pdf_pool()
+
 
 app = FastAPI(
     title="Invoice Reimbursement System",
     description="LLM-powered API for invoice analysis and chatbot RAG",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+@app.middleware("http")
+async def record_request_timing(request: Request, call_next):
+    """
+    Records the latency of every request by route and, if SERVER_TIMING_HEADER
+    is enabled, returns the per-step breakdown in a Server-Timing header.
+    """
+    token = metrics.start_request_timing()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        spans = metrics.stop_request_timing(token)
+    elapsed = time.perf_counter() - start
+
+    # Label by route template (e.g. /analyze/jobs/{job_id}) to keep the number of series bounded
+    if request.scope.get("route") is None:
+        route = "unmatched"
+    else:
+        segments = request.url.path.split("/")
+        for name, value in request.path_params.items():
+            segments = [f"{{{name}}}" if segment == str(value) else segment for segment in segments]
+        route = "/".join(segments)
+    metrics.http_request_seconds.observe(
+        elapsed, method=request.method, route=route, status=response.status_code
+    )
+    if metrics.SERVER_TIMING_HEADER:
+        response.headers["Server-Timing"] = metrics.format_server_timing(spans, elapsed)
+    return response
+
+
 # Include API routers
 app.include_router(analyze.router, prefix="/analyze",tags=["Invoice Analysis"])
-app.include_router(chatbot.router, prefix="/chatbot",tags=["Chatbot"])
\ No newline at end of file
+app.include_router(chatbot.router, prefix="/chatbot",tags=["Chatbot"])
+
+
+@app.get("/metrics", tags=["Health"], response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """
+    Step timings, LLM call/token/retry counters and request latencies in Prometheus text format.
+    """
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/health", tags=["Health"])
+async def health():
+    """
+    Liveness check that also reports import and client start-up timings
+    and the state of the LLM client (circuit breaker, concurrency limit),
+    of upload storage and of the ingest writer election.
+    """
+    return {
+        "status": "ok",
+        "startup_timings": providers.startup_timings,
+        "llm": llm_client.stats(),
+        "uploads": await asyncio.to_thread(upload_storage.stats),
+        "vector_store": {"backend": providers.VECTOR_STORE_BACKEND},
+        "ingest": await asyncio.to_thread(ingest_writer.stats)
+    }
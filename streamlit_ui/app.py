@@ -1,6 +1,7 @@
 import streamlit as st
 import requests
 import json
+import time
 from datetime import datetime
 from io import BytesIO
 import zipfile
@@ -33,23 +34,36 @@ if section == "📤 Upload & Analyze":
         if not policy_pdf or not invoice_zip or not employee_name.strip():
             st.error("Please provide all required inputs.")
         else:
-            with st.spinner("Processing invoices..."):
-                files = {
-                    "policy_pdf": ("policy.pdf", policy_pdf, "application/pdf"),
-                    "invoices_zip": ("invoices.zip", invoice_zip, "application/zip"),
-                }
-                data = {"employee_name": employee_name.strip()}
-                try:
+            files = {
+                "policy_pdf": ("policy.pdf", policy_pdf, "application/pdf"),
+                "invoices_zip": ("invoices.zip", invoice_zip, "application/zip"),
+            }
+            # Run as a background job so large batches are not cut off by HTTP timeouts
+            data = {"employee_name": employee_name.strip(), "background": "true"}
+            try:
+                with st.spinner("Uploading files..."):
                     res = requests.post(f"{API_BASE}/analyze/upload", files=files, data=data)
                     res.raise_for_status()
-                    response = res.json()
+                    job = res.json()
+
+                if "job_id" not in job:
+                    st.error("⚠️ Analysis failed or malformed response.")
+                    st.json(job)
+                else:
+                    # Poll the job until every invoice has been analyzed
+                    progress = st.progress(0.0, text="Queued...")
+                    while True:
+                        response = requests.get(f"{API_BASE}/analyze/jobs/{job['job_id']}").json()
+                        done, total = response["progress"]["done"], response["progress"]["total"] or job["num_invoices"]
+                        progress.progress(min(done / total, 1.0) if total else 0.0, text=f"Analyzed {done} of {total} invoices")
+                        if response["status"] in ("completed", "failed"):
+                            break
+                        time.sleep(1)
 
-                    # Success check based on presence of analysis_results
-                    if "analysis_results" in response:
+                    if response["status"] == "completed":
                         st.success("✅ Invoices analyzed and stored successfully!")
                         st.markdown(f"**👤 Employee Name:** `{response['employee_name']}`")
-                        st.markdown(f"**📄 Policy Summary Preview:**\n```{response['policy_summary'][:500]}...```")
-                        st.markdown(f"**📦 Invoices Processed:** `{response.get('num_invoices', 0)}`")
+                        st.markdown(f"**📦 Invoices Processed:** `{len(response['analysis_results'])}`")
 
                         st.markdown("### 🧾 Detailed Invoice Analysis")
                         for invoice_name, result in response["analysis_results"].items():
@@ -61,11 +75,13 @@ if section == "📤 Upload & Analyze":
                             with st.expander(f"{status_emoji} {invoice_name}"):
                                 st.markdown(f"**Status:** `{result['status']}`")
                                 st.markdown(f"**Reason:**\n{result['reason']}")
+                                if result.get("decision_path"):
+                                    st.caption(f"Decided by: {result['decision_path']}")
                     else:
-                        st.error("⚠️ Analysis failed or malformed response.")
+                        st.error(f"⚠️ Analysis failed: {response.get('error')}")
                         st.json(response)
-                except Exception as e:
-                    st.error(f"🚨 API Error: {e}")
+            except Exception as e:
+                st.error(f"🚨 API Error: {e}")
 
 # ========== SECTION 2: Chatbot ==========
 elif section == "💬 Chatbot Query":
@@ -96,12 +112,30 @@ elif section == "💬 Chatbot Query":
                 "filters": filters
             }
 
-            with st.spinner("💡 Querying the chatbot..."):
-                try:
-                    res = requests.post(f"{API_BASE}/chatbot/query", json=payload)
+            # Render the answer token by token as the server streams it
+            timings = {}
+
+            def stream_answer():
+                with requests.post(f"{API_BASE}/chatbot/query/stream", json=payload, stream=True) as res:
                     res.raise_for_status()
-                    result = res.json()
-                    st.markdown("### 📜 Response")
-                    st.markdown(result.get("response_markdown", "_No response received._"))
-                except Exception as e:
-                    st.error(f"🚨 Chatbot Error: {e}")
\ No newline at end of file
+                    event = None
+                    for line in res.iter_lines(decode_unicode=True):
+                        if line.startswith("event: "):
+                            event = line[len("event: "):]
+                        elif line.startswith("data: "):
+                            data = json.loads(line[len("data: "):])
+                            if event == "token":
+                                yield data["text"]
+                            elif event == "done":
+                                timings.update(data)
+
+            try:
+                st.markdown("### 📜 Response")
+                st.write_stream(stream_answer())
+                if timings.get("time_to_first_token") is not None:
+                    st.caption(
+                        f"⏱️ First token after {timings['time_to_first_token']:.2f}s, "
+                        f"complete after {timings['total_seconds']:.2f}s"
+                    )
+            except Exception as e:
+                st.error(f"🚨 Chatbot Error: {e}")
\ No newline at end of file